@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+# Async crawl engine - fetches many .onion pages at once through the Tor SOCKS proxy
+
+# Import required libraries
+import os
+import sys
+import time             # For per-host politeness bookkeeping
+import inspect
+import asyncio          # For running many fetches concurrently
+from concurrent.futures import ThreadPoolExecutor  # For frontier bookkeeping and page processing off the event loop
+from urllib.parse import urlsplit
+import aiohttp          # For making asynchronous HTTP requests
+from aiohttp_socks import ProxyConnector  # For routing aiohttp through Tor's SOCKS proxy
+from extract import get_extractor  # For parsing HTML content
+from fetcher import (DEFAULT_MAX_BYTES, TEXT_CONTENT_TYPES, FetchError, FetchResult,  # For bounded fetches
+                     ResponseTooLarge, UnsupportedContentType, allowed_content_type, media_type,
+                     retry_after)
+from dotenv import load_dotenv  # For loading environment variables from .env file
+import logging          # For logging information and errors
+
+from crawler import not_modified_result, read_urls_from_file
+from host_health import (Failure, HostHealth, RetryScheduler, SKIPPED,  # For retries and dead hosts
+                         classify_error, classify_status, url_host)
+from frontier import CrawlFrontier
+from links import link_score, resolve_links
+from page_store import PageStore
+from pipeline import CrawlPipeline
+from dedup import MirrorIndex
+from tor_pool import TorCircuitPool
+import metrics          # For fetch and processing instrumentation
+
+logger = logging.getLogger(__name__)  # Get a logger instance for this module
+
+
+class HostSlot:
+    """
+    Politeness gate for a single host: limits how many requests run against
+    the host at once and spaces request starts by the crawl delay
+    """
+    def __init__(self, concurrency, delay):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.delay = delay
+        self.next_request_at = 0.0  # Monotonic time the next request may start
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        # Reserve the next start time under the lock, then sleep outside it so
+        # other hosts (and later requests for this host) are not held up
+        async with self.lock:
+            now = time.monotonic()
+            start_at = max(now, self.next_request_at)
+            self.next_request_at = start_at + self.delay
+        if start_at > now:
+            await asyncio.sleep(start_at - now)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.semaphore.release()
+
+
+class AsyncDarkWebCrawler:
+    """
+    Concurrent crawler that overlaps many fetches over the Tor SOCKS proxy.
+    Concurrency is capped globally and per host; the crawl delay applies to
+    each host separately instead of serializing the whole run.
+    """
+    def __init__(self, proxy_url='socks5h://127.0.0.1:9050', max_concurrency=16,
+                 per_host_concurrency=2, crawl_delay=2.0, timeout=60, circuit_pool=None,
+                 connect_timeout=30, max_bytes=DEFAULT_MAX_BYTES, content_types=TEXT_CONTENT_TYPES,
+                 mirror_index=None, read_timeout=60, page_store=None):
+        """
+        Args:
+            proxy_url: SOCKS proxy to route every request through
+            max_concurrency: Maximum number of requests in flight overall
+            per_host_concurrency: Maximum number of requests in flight per host
+            crawl_delay: Minimum seconds between request starts to the same host
+            timeout: Total seconds allowed for a single request
+            circuit_pool: Optional TorCircuitPool; requests are then spread over
+                          its isolated circuits instead of proxy_url
+            connect_timeout: Seconds allowed to establish a connection
+            max_bytes: Largest response body read, in bytes
+            content_types: Media types whose bodies are downloaded
+            mirror_index: Optional MirrorIndex; pages with the same HTML as
+                          another URL are then skipped before parsing, and
+                          near duplicates are recorded as mirrors
+            read_timeout: Seconds allowed between bytes received
+            page_store: Optional PageStore; URLs already stored are then
+                        requested with If-None-Match / If-Modified-Since and
+                        unchanged pages are rebuilt from the stored fetch
+        """
+        self.proxy_url = proxy_url
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.crawl_delay = crawl_delay
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_bytes = max_bytes
+        self.content_types = content_types
+        self.mirror_index = mirror_index
+        self.page_store = page_store
+        self.visited_urls = set()  # URLs already fetched successfully
+        self.host_slots = {}       # Host name -> HostSlot
+        self.circuit_pool = circuit_pool
+        self.circuit_sessions = {}  # Circuit index -> (generation, ClientSession)
+        self.retired_sessions = []  # Sessions of rotated circuits, closed when the crawl ends
+
+    def _host_slot(self, url):
+        host = urlsplit(url).hostname or ''
+        slot = self.host_slots.get(host)
+        if slot is None:
+            slot = HostSlot(self.per_host_concurrency, self.crawl_delay)
+            self.host_slots[host] = slot
+        return slot
+
+    def _create_session(self, proxy_url=None):
+        # aiohttp_socks expects socks5:// plus rdns=True for remote DNS resolution,
+        # which is what socks5h:// means to requests (needed for .onion addresses)
+        connector = ProxyConnector.from_url(
+            (proxy_url or self.proxy_url).replace('socks5h://', 'socks5://', 1),
+            rdns=True,
+            limit=self.max_concurrency,
+            limit_per_host=self.per_host_concurrency,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout, sock_connect=self.connect_timeout,
+                                          sock_read=self.read_timeout),
+        )
+
+    async def _circuit_session(self, circuit):
+        """
+        Return the session bound to circuit, replacing it if the circuit was rotated
+        """
+        generation, session = self.circuit_sessions.get(circuit.index, (None, None))
+        if generation != circuit.generation:
+            if session is not None:
+                # Requests still using the old circuit keep their session until the crawl ends
+                self.retired_sessions.append(session)
+            session = self._create_session(circuit.proxy_url)
+            self.circuit_sessions[circuit.index] = (circuit.generation, session)
+        return session
+
+    async def _read_body(self, response):
+        """
+        Stream a response body, refusing unwanted media types before reading
+        and abandoning bodies larger than max_bytes. Returns (text, bytes read).
+        """
+        if response.status == 304 or response.status >= 400:
+            return '', 0  # Error pages are not worth downloading, unchanged pages have no body
+        content_type = response.headers.get('Content-Type')
+        if not allowed_content_type(content_type, self.content_types):
+            raise UnsupportedContentType(f"Skipping {media_type(content_type)} response")
+        if response.content_length is not None and response.content_length > self.max_bytes:
+            raise ResponseTooLarge(f"Response of {response.content_length} bytes exceeds {self.max_bytes}")
+
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            body += chunk
+            if len(body) > self.max_bytes:
+                raise ResponseTooLarge(f"Response exceeds {self.max_bytes} bytes")
+        return body.decode(response.charset or 'utf-8', errors='replace'), len(body)
+
+    async def _conditional_headers(self, url):
+        if self.page_store is None:
+            return {}
+        etag, last_modified = await asyncio.to_thread(self.page_store.validators, url) or (None, None)
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    async def _get(self, session, url):
+        """
+        GET a URL, on a pooled circuit when a circuit pool is set, conditionally
+        if it is in the page store. Returns a FetchResult as Fetcher.fetch.
+        """
+        headers = await self._conditional_headers(url)
+        circuit = self.circuit_pool.acquire() if self.circuit_pool is not None else None
+        circuit_label = str(circuit.index) if circuit is not None else 'default'
+        start = time.monotonic()
+        try:
+            if circuit is not None:
+                session = await self._circuit_session(circuit)
+            async with session.get(url, headers=headers) as response:
+                body, size = await self._read_body(response)
+        except FetchError:
+            # The circuit delivered; the response itself was refused
+            latency = time.monotonic() - start
+            metrics.observe_fetch(url_host(url), circuit_label, latency, 'skipped')
+            if circuit is not None:
+                self.circuit_pool.release(circuit, latency=latency)
+            raise
+        except Exception:
+            metrics.observe_fetch(url_host(url), circuit_label, time.monotonic() - start, 'error')
+            if circuit is not None:
+                self.circuit_pool.release(circuit, error=True)
+            raise
+        latency = time.monotonic() - start
+        metrics.observe_fetch(url_host(url), circuit_label, latency, metrics.status_outcome(response.status), size)
+        if circuit is not None:
+            self.circuit_pool.release(circuit, latency=latency, error=response.status >= 500)
+        not_modified = response.status == 304
+        # The delay a 429 or 503 asked for, used by the retry scheduler
+        delay = retry_after(response.headers.get('Retry-After')) if response.status >= 400 else None
+        return FetchResult(url, response.status, None if not_modified else body, response.headers.get('ETag'),
+                           response.headers.get('Last-Modified'), not_modified, delay, size)
+
+    @staticmethod
+    def _extract(url, response):
+        """
+        Extract the text, title and links (resolved to canonical URLs) from a fetched page
+        """
+        with metrics.PROCESSING_SECONDS.time(stage='extract'):
+            page = get_extractor().extract(response.text)
+        title = page.title if page.title is not None else "No title"
+        links = resolve_links(url, page.links)
+        return {
+            "url": url,
+            "title": title,
+            "status": response.status,
+            "raw_html": response.text,
+            "text": page.text,
+            "links": links,
+            "etag": response.etag,
+            "last_modified": response.last_modified,
+        }
+
+    def _process(self, url, response):
+        """
+        Extract a fetched page (a FetchResult) unless its HTML duplicates
+        another URL's. Returns the result dictionary, or None for a duplicate.
+        """
+        html = response.text
+        if self.mirror_index is None:
+            return self._extract(url, response)
+
+        # A mirror of a page already crawled is neither parsed nor matched again
+        duplicate = self.mirror_index.exact_duplicate(url, html)
+        if duplicate is not None:
+            metrics.DUPLICATES.inc(kind=duplicate.kind)
+            logger.info(f"Skipping {url}: same content as {duplicate.canonical_url}")
+            return None
+        result = self._extract(url, response)
+        # Near duplicates are still matched: the difference may be the leak
+        duplicate = self.mirror_index.near_duplicate(url, html, result['text'])
+        if duplicate is not None:
+            metrics.DUPLICATES.inc(kind=duplicate.kind)
+            logger.info(f"{url} mirrors {duplicate.canonical_url} ({duplicate.similarity:.0%} alike)")
+        return result
+
+    def link_priority(self, url):
+        """
+        Frontier priority of a newly found link: links.link_score, lowered for
+        links to known mirrors
+        """
+        priority = link_score(url)
+        if self.mirror_index is not None:
+            priority += self.mirror_index.priority(url)
+        return priority
+
+    async def fetch(self, session, url):
+        """
+        Fetch and extract a single URL, honouring the per-host politeness gate
+
+        Returns the same result dictionary as DarkWebCrawler.crawl_onion, or None
+        """
+        return (await self.fetch_with_failure(session, url))[0]
+
+    async def fetch_with_failure(self, session, url):
+        """
+        Fetch a single URL like fetch, also reporting why it failed
+
+        Returns (result, failure) as DarkWebCrawler.fetch_onion
+        """
+        if url in self.visited_urls:
+            return None, None
+
+        try:
+            async with self._host_slot(url):
+                logger.info(f"Crawling: {url}")
+                response = await self._get(session, url)
+            if response.not_modified and self.page_store is not None:
+                # Unchanged since the last visit: reuse the stored page
+                self.visited_urls.add(url)
+                logger.info(f"Not modified since last visit: {url}")
+                return await asyncio.to_thread(not_modified_result, self.page_store, url, response), None
+            if response.status != 200:
+                logger.warning(f"Failed to access {url}. Status code: {response.status}")
+                return None, Failure(classify_status(response.status), f"HTTP {response.status}",
+                                     response.retry_after)
+
+            self.visited_urls.add(url)
+            # Parse off the event loop so other fetches keep making progress
+            result = await asyncio.to_thread(self._process, url, response)
+            if result is None:
+                return None, None
+            logger.info(f"Page title: {result['title']}")
+            return result, None
+
+        except FetchError as e:
+            # Binary or oversized responses are skipped, not retried
+            logger.warning(f"Skipped {url}: {str(e)}")
+            return None, Failure(SKIPPED, str(e), None)
+        except Exception as e:
+            logger.error(f"Error crawling {url}: {str(e)}")
+            return None, Failure(classify_error(e), str(e), None)
+
+    async def crawl(self, urls):
+        """
+        Crawl all URLs concurrently
+
+        Returns a list of result dictionaries in the same order as the input
+        URLs, with None for URLs that failed
+        """
+        # Politeness gates hold asyncio primitives bound to the running loop
+        self.host_slots = {}
+        async with self._create_session() as session:
+            try:
+                return await asyncio.gather(*(self.fetch(session, url) for url in urls))
+            finally:
+                await self._close_circuit_sessions()
+
+    def open_session(self):
+        """
+        Session to share between crawl_frontier calls, so connections (and
+        circuit sessions) outlive a single crawl. Close it with close_session().
+        """
+        return self._create_session()
+
+    async def close_session(self, session):
+        await session.close()
+        await self._close_circuit_sessions()
+
+    async def crawl_frontier(self, frontier, on_result=None, scheduler=None, session=None):
+        """
+        Crawl recursively from a CrawlFrontier until it is empty or reaches its
+        page limit. Links found on each page are queued one level deeper.
+
+        Args:
+            frontier: CrawlFrontier holding the seed URLs
+            on_result: Optional callable invoked with each successful result;
+                       if it returns an awaitable the worker waits for it,
+                       which lets a bounded queue slow fetching down. It is
+                       called on the event loop, so it should hand slow work
+                       to a thread
+            scheduler: Optional RetryScheduler over frontier deciding retries
+                       and deferring hosts that are down; by default failed
+                       URLs are retried with backoff but no host is deferred
+            session: Optional session from open_session() to crawl with; it
+                     is left open. By default a session is opened and closed
+
+        Returns the number of pages fetched successfully
+        """
+        self.host_slots = {}
+        scheduler = scheduler or RetryScheduler(frontier)
+        loop = asyncio.get_running_loop()
+        in_flight = 0
+        busy = 0  # Workers taking a URL or still to queue the links of one
+        fetched = 0
+
+        # The frontier, scheduler and mirror lookups are SQLite calls; one
+        # thread runs them in order so they never hold up the event loop
+        bookkeeping = ThreadPoolExecutor(max_workers=1, thread_name_prefix='frontier')
+
+        def off_loop(function, *args, **kwargs):
+            return loop.run_in_executor(bookkeeping, lambda: function(*args, **kwargs))
+
+        async def worker(session):
+            nonlocal in_flight, busy, fetched
+            while True:
+                busy += 1
+                item = await off_loop(scheduler.next)
+                if item is None:
+                    busy -= 1
+                    # Other workers may still queue new links, so only stop once all are idle
+                    if busy == 0:
+                        # Wait for deferred URLs that are due soon; later ones are left for the next run
+                        wait = await off_loop(scheduler.wait_time)
+                        if wait is None:
+                            return
+                        await asyncio.sleep(min(wait, 1.0))
+                        continue
+                    await asyncio.sleep(0.1)
+                    continue
+
+                url, depth = item
+                try:
+                    in_flight += 1
+                    metrics.IN_FLIGHT.set(in_flight)
+                    try:
+                        result, failure = await self.fetch_with_failure(session, url)
+                    finally:
+                        in_flight -= 1
+                        metrics.IN_FLIGHT.set(in_flight)
+
+                    if result is None:
+                        if failure is not None:
+                            await off_loop(scheduler.failed, url, failure)
+                        else:
+                            # Already visited under another spelling, or a mirror
+                            await off_loop(frontier.mark_done, url)
+                        continue
+                    await off_loop(scheduler.succeeded, url)
+                    await off_loop(frontier.add_many, result['links'], depth=depth + 1,
+                                   priority=self.link_priority)
+                    fetched += 1
+                finally:
+                    busy -= 1
+                if on_result is not None:
+                    pending = on_result(result)
+                    if inspect.isawaitable(pending):
+                        await pending
+
+        try:
+            if session is not None:
+                try:
+                    await asyncio.gather(*(worker(session) for _ in range(self.max_concurrency)))
+                finally:
+                    # Nothing is in flight any more; live circuit sessions are kept for the next crawl
+                    await self._close_circuit_sessions(retired_only=True)
+                return fetched
+
+            async with self._create_session() as session:
+                try:
+                    await asyncio.gather(*(worker(session) for _ in range(self.max_concurrency)))
+                finally:
+                    await self._close_circuit_sessions()
+            return fetched
+        finally:
+            bookkeeping.shutdown(wait=False)
+
+    async def _close_circuit_sessions(self, retired_only=False):
+        if not retired_only:
+            for _, circuit_session in self.circuit_sessions.values():
+                await circuit_session.close()
+            self.circuit_sessions.clear()
+        for retired_session in self.retired_sessions:
+            await retired_session.close()
+        self.retired_sessions.clear()
+
+    def crawl_urls(self, urls):
+        """
+        Synchronous wrapper around crawl() for callers outside an event loop
+        """
+        return asyncio.run(self.crawl(urls))
+
+
+def crawler_from_env(mirror_index=None, page_store=None):
+    """
+    Build an AsyncDarkWebCrawler (and its TorCircuitPool, started, if
+    TOR_CIRCUITS is set) from the environment, skipping mirrors recorded in
+    mirror_index and revisiting pages stored in page_store conditionally,
+    if given.
+    Returns (crawler, circuit_pool or None).
+    """
+    # TOR_PORT may list several SocksPorts, e.g. 9050,9052,9054
+    socks_ports = tuple(int(port) for port in os.getenv('TOR_PORT', '9050').split(','))
+
+    # Spread requests over several isolated circuits when TOR_CIRCUITS is set
+    circuit_pool = None
+    if int(os.getenv('TOR_CIRCUITS', '0')) > 0:
+        circuit_pool = TorCircuitPool(
+            size=int(os.getenv('TOR_CIRCUITS')),
+            socks_ports=socks_ports,
+            control_port=int(os.getenv('TOR_CONTROL_PORT', '9051')),
+        )
+        circuit_pool.start()
+
+    crawler = AsyncDarkWebCrawler(
+        proxy_url=f"socks5h://127.0.0.1:{socks_ports[0]}",
+        max_concurrency=int(os.getenv('CRAWL_CONCURRENCY', '16')),
+        per_host_concurrency=int(os.getenv('CRAWL_HOST_CONCURRENCY', '2')),
+        crawl_delay=float(os.getenv('CRAWL_DELAY', '2')),
+        circuit_pool=circuit_pool,
+        connect_timeout=float(os.getenv('FETCH_CONNECT_TIMEOUT', '30')),
+        read_timeout=float(os.getenv('FETCH_READ_TIMEOUT', '60')),
+        max_bytes=int(os.getenv('FETCH_MAX_BYTES', str(DEFAULT_MAX_BYTES))),
+        mirror_index=mirror_index,
+        page_store=page_store,
+    )
+    return crawler, circuit_pool
+
+
+def main():
+    """
+    Crawl concurrently from the URLs in urls.txt, following links up to
+    MAX_DEPTH hops and MAX_PAGES pages. An interrupted crawl resumes from
+    where it stopped.
+    """
+    load_dotenv()
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    # Pages are stored as they are fetched; stored pages are revisited conditionally
+    page_store = PageStore()
+    mirror_index = MirrorIndex()
+    crawler, circuit_pool = crawler_from_env(mirror_index, page_store)
+
+    urls = read_urls_from_file('urls.txt')
+    if not urls:
+        logger.error("No URLs found in urls.txt. Exiting...")
+        sys.exit(1)
+
+    frontier = CrawlFrontier(
+        max_depth=int(os.getenv('MAX_DEPTH', '1')),
+        max_pages=int(os.getenv('MAX_PAGES', '100')),
+    )
+    frontier.add_many(urls)
+    pipeline = CrawlPipeline(page_store)
+    # Failed URLs are retried with backoff; hosts known to be down are skipped until they may be up again
+    host_health = HostHealth()
+    scheduler = RetryScheduler(frontier, host_health, max_retries=int(os.getenv('MAX_RETRIES', '3')))
+
+    # Export crawl metrics if METRICS_PORT or METRICS_SNAPSHOT is set
+    metrics.QUEUE_DEPTH.set_function(frontier.pending_count)
+    snapshot_writer = metrics.start_from_env(os.environ)
+
+    # Pages are stored and matched on one thread, off the event loop
+    process_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pipeline')
+
+    def process(result):
+        return asyncio.get_running_loop().run_in_executor(process_executor, pipeline.process, result)
+
+    start = time.time()
+    fetched = asyncio.run(crawler.crawl_frontier(frontier, on_result=process, scheduler=scheduler))
+    process_executor.shutdown(wait=True)
+    if snapshot_writer is not None:
+        snapshot_writer.stop()
+    if circuit_pool is not None:
+        circuit_pool.stop()
+    frontier.close()
+    page_store.close()
+    host_health.close()
+    mirror_index.close()
+    logger.info(f"Crawled {fetched} pages in {time.time() - start:.2f} seconds")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# Benchmark: HTML extraction backends on the shipped text.txt corpus
+#
+# Usage: python3 benchmarks/bench_extract.py [--corpus text.txt] [--repeat 5]
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser import Parser
+from extract import BACKENDS, get_extractor
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--corpus', default='text.txt')
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    documents = list(Parser(args.corpus, []).iter_documents())
+    size = sum(len(document) for document in documents)
+    print(f"Corpus: {len(documents)} pages, {size:,} characters, {args.repeat} passes")
+
+    reference = [get_extractor('bs4').extract(document) for document in documents]
+
+    for name in BACKENDS:
+        try:
+            extractor = get_extractor(name)
+        except ImportError:
+            print(f"{name:>12}: not installed")
+            continue
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            extracted = [extractor.extract(document) for document in documents]
+        elapsed = (time.perf_counter() - start) / args.repeat
+
+        identical = sum(1 for a, b in zip(reference, extracted) if a.text == b.text)
+        print(f"{name:>12}: {elapsed * 1000:8.1f} ms/pass  "
+              f"{size / elapsed / 1e6:6.1f} MB/s  text identical on {identical}/{len(documents)} pages")
+
+    print(f"Default backend: {get_extractor().name}")
+
+
+if __name__ == "__main__":
+    main()
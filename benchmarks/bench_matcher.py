@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# Benchmark: TermMatcher (Aho-Corasick) against the original nested term loop in Parser.parse
+#
+# Usage: python3 benchmarks/bench_matcher.py [--identities 200] [--corpus text.txt]
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser import Parser
+from matcher import TermMatcher
+
+
+def synthetic_terms(identities, seed=0):
+    """
+    Build roughly 12 field values per identity, shaped like the User Data tab fields
+    """
+    rng = random.Random(seed)
+    names = ['alice', 'bob', 'carol', 'dave', 'erin', 'frank', 'grace', 'heidi', 'ivan', 'judy']
+    streets = ['main st', 'oak ave', 'pine rd', 'elm st', 'maple dr']
+    terms = []
+    for i in range(identities):
+        first, last = rng.choice(names), rng.choice(names) + str(i)
+        terms += [
+            f"{first}.{last}@example.com",
+            f"555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}",
+            f"{rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(1000, 9999)}",
+            f"{rng.randint(1, 9999)} {rng.choice(streets)}",
+            first,
+            last,
+            f"19{rng.randint(50, 99)}-0{rng.randint(1, 9)}-{rng.randint(10, 28)}",
+            ' '.join(str(rng.randint(1000, 9999)) for _ in range(4)),
+            str(rng.randint(10 ** 9, 10 ** 10)),
+            f"X{rng.randint(10 ** 7, 10 ** 8)}",
+            f"D{rng.randint(10 ** 6, 10 ** 7)}",
+            f"keyword{i}",
+        ]
+    return list(dict.fromkeys(terms))  # Drop repeated first names
+
+
+def nested_loop(lines, terms):
+    # The original Parser.parse inner loop
+    results = {k: [] for k in terms}
+    for line in lines:
+        for data in terms:
+            if data.lower() in line.lower():
+                results[data].append(line)
+    return results
+
+
+def automaton(lines, matcher):
+    results = {k: [] for k in matcher.terms}
+    for line in lines:
+        for term in matcher.matched_terms(line):
+            results[term].append(line)
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--identities', type=int, default=200)
+    arg_parser.add_argument('--corpus', default='text.txt')
+    args = arg_parser.parse_args()
+
+    with open(args.corpus, 'r', encoding='utf-8', errors='replace') as file:
+        clean_text = Parser(args.corpus, []).clean_html(file.read())
+    lines = [line.strip() for line in clean_text.split('\n') if line.strip()]
+
+    terms = synthetic_terms(args.identities) + ['tor', 'privacy', 'onion']
+    print(f"Corpus: {len(clean_text):,} characters in {len(lines)} lines, {len(terms)} terms")
+
+    start = time.perf_counter()
+    expected = nested_loop(lines, terms)
+    nested_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = TermMatcher(terms)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    found = automaton(lines, matcher)
+    scan_time = time.perf_counter() - start
+
+    assert found == expected, "Automaton results differ from the nested loop"
+    print(f"Nested loop:        {nested_time:8.3f} s")
+    print(f"Automaton build:    {build_time:8.3f} s")
+    print(f"Automaton scan:     {scan_time:8.3f} s  ({nested_time / scan_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# Benchmark suite: crawl, clean, match, compare and lookup stages on a synthetic .onion
+# corpus served locally behind a stand-in SOCKS proxy. Results are saved as JSON
+# so runs of different versions can be compared.
+#
+# Usage: python3 benchmarks/bench_suite.py [--pages 200] [--hosts 20] [--identities 50]
+#                                           [--latency 0.05] [--output results.json]
+#                                           [--compare previous.json]
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import resource
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_matcher import synthetic_terms
+from fake_onion import FakeOnionServer, FakeSocksProxy, generate_corpus, load_seed_pages
+from async_crawler import AsyncDarkWebCrawler
+from crawler import DarkWebCrawler
+from matcher import FIELD_MODES, FieldMatcher, term_id
+from page_store import PageStore
+from parser import Parser
+from results_index import ResultsIndex
+from text_index import TextIndex
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Field of each value synthetic_terms builds per identity, in order
+SYNTHETIC_FIELDS = ['email', 'phone', 'ssn', 'address', 'first_name', 'last_name', 'dob',
+                    'credit_card', 'bank_account', 'passport', 'drivers_license', 'keyword']
+
+
+def typed_terms(identities, seed=0):
+    """
+    Synthetic user data as (value, mode) pairs, matched the way the GUI matches each field
+    """
+    terms = []
+    for i, value in enumerate(synthetic_terms(identities, seed)):
+        field = SYNTHETIC_FIELDS[i % len(SYNTHETIC_FIELDS)]
+        terms.append((value, FIELD_MODES.get(field, 'exact')))
+    return terms
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(seconds, items, latencies, size=None):
+    """
+    Throughput and latency percentiles (milliseconds) of a stage
+    """
+    latencies = sorted(latencies)
+    summary = {
+        'items': items,
+        'seconds': seconds,
+        'items_per_second': items / seconds if seconds > 0 else None,
+        'latency_ms': {
+            name: (percentile(latencies, fraction) * 1000 if latencies else None)
+            for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))
+        },
+    }
+    if size is not None:
+        summary['bytes'] = size
+        summary['mb_per_second'] = size / seconds / 1e6 if seconds > 0 else None
+    return summary
+
+
+def run_stage(name, stage, measure_memory):
+    """
+    Run stage() once for timing, then once more under tracemalloc for peak
+    memory, so tracing does not distort the timings.
+    stage() returns (items, latencies in seconds, bytes or None).
+    """
+    start = time.perf_counter()
+    items, latencies, size = stage()
+    summary = summarize(time.perf_counter() - start, items, latencies, size)
+
+    if measure_memory:
+        tracemalloc.start()
+        stage()
+        summary['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+
+    latency = summary['latency_ms']
+    rate = summary['items_per_second'] or 0
+    line = f"{name:>12}: {items:6d} items  {rate:9.1f} /s  p50 {latency['p50'] or 0:8.2f} ms  " \
+           f"p99 {latency['p99'] or 0:8.2f} ms"
+    if 'peak_memory_mb' in summary:
+        line += f"  peak {summary['peak_memory_mb']:7.1f} MB"
+    print(line)
+    return summary
+
+
+def crawl_sync_stage(urls, proxy_url):
+    def stage():
+        crawler = DarkWebCrawler(crawl_delay=0)
+        crawler.session.proxies = {'http': proxy_url, 'https': proxy_url}
+        latencies, size = [], 0
+        for url in urls:
+            start = time.perf_counter()
+            result = crawler.crawl_onion(url)
+            latencies.append(time.perf_counter() - start)
+            if result:
+                size += len(result['raw_html'].encode('utf-8'))
+        return len(urls), latencies, size
+    return stage
+
+
+def crawl_async_stage(urls, proxy_url, concurrency):
+    class TimedCrawler(AsyncDarkWebCrawler):
+        async def fetch(self, session, url):
+            start = time.perf_counter()
+            result = await super().fetch(session, url)
+            self.latencies.append(time.perf_counter() - start)
+            return result
+
+    def stage():
+        crawler = TimedCrawler(proxy_url=proxy_url, max_concurrency=concurrency,
+                               per_host_concurrency=concurrency, crawl_delay=0)
+        crawler.latencies = []
+        results = crawler.crawl_urls(urls)
+        size = sum(len(result['raw_html'].encode('utf-8')) for result in results if result)
+        return len(urls), crawler.latencies, size
+    return stage
+
+
+def clean_stage(pages, parser):
+    def stage():
+        latencies = []
+        for html in pages:
+            start = time.perf_counter()
+            parser.clean_html(html)
+            latencies.append(time.perf_counter() - start)
+        return len(pages), latencies, sum(len(html.encode('utf-8')) for html in pages)
+    return stage
+
+
+def match_stage(texts, parser, terms):
+    def stage():
+        matcher = FieldMatcher(terms)
+        latencies = []
+        for text in texts:
+            start = time.perf_counter()
+            list(parser.match_text(text, matcher))
+            latencies.append(time.perf_counter() - start)
+        return len(texts), latencies, sum(len(text.encode('utf-8')) for text in texts)
+    return stage
+
+
+def compare_stage(corpus, texts, terms, workers):
+    """
+    Index every page with parse_incremental, then answer the comparison tab's
+    per-field lookups from the index, timing each lookup
+    """
+    def stage():
+        directory = tempfile.mkdtemp(prefix='bench-compare-')
+        try:
+            page_store = PageStore(os.path.join(directory, 'pages.db'))
+            results_index = ResultsIndex(os.path.join(directory, 'results.db'))
+            for (url, html), text in zip(corpus.items(), texts):
+                page_store.add(url, html, text=text)
+            Parser(None, terms, page_store=page_store, workers=workers).parse_incremental(results_index)
+
+            latencies = []
+            for value, _ in terms:
+                start = time.perf_counter()
+                results_index.term_stats(term_id(value))
+                latencies.append(time.perf_counter() - start)
+            page_store.close()
+            results_index.close()
+            return len(terms), latencies, None
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return stage
+
+
+def lookup_stage(corpus, texts, terms):
+    """
+    Index every page in a text index, then look each term up in the whole
+    corpus with Parser.search, timing each lookup
+    """
+    def stage():
+        directory = tempfile.mkdtemp(prefix='bench-lookup-')
+        try:
+            page_store = PageStore(os.path.join(directory, 'pages.db'))
+            text_index = TextIndex(os.path.join(directory, 'text_index'))
+            for (url, html), text in zip(corpus.items(), texts):
+                page_store.add(url, html, text=text)
+            text_index.sync(page_store)
+            parser = Parser(None, [], page_store=page_store, text_index=text_index)
+
+            latencies = []
+            for term in terms:
+                start = time.perf_counter()
+                parser.search(term)
+                latencies.append(time.perf_counter() - start)
+            text_index.close()
+            page_store.close()
+            return len(terms), latencies, None
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return stage
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results, previous):
+    print(f"\nCompared with {previous.get('revision') or 'previous run'} "
+          f"({time.ctime(previous.get('timestamp', 0))}):")
+    for name, stage in results['stages'].items():
+        before = previous.get('stages', {}).get(name)
+        if not before or not before.get('items_per_second') or not stage.get('items_per_second'):
+            continue
+        speedup = stage['items_per_second'] / before['items_per_second']
+        line = f"{name:>12}: {speedup:6.2f}x throughput"
+        if before['latency_ms'].get('p50') and stage['latency_ms'].get('p50'):
+            line += f"  p50 {before['latency_ms']['p50']:.2f} -> {stage['latency_ms']['p50']:.2f} ms"
+        print(line)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--corpus', default='text.txt', help='Seed pages for the synthetic corpus')
+    arg_parser.add_argument('--pages', type=int, default=200)
+    arg_parser.add_argument('--hosts', type=int, default=20)
+    arg_parser.add_argument('--identities', type=int, default=50, help='About 12 terms per identity')
+    arg_parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to each response')
+    arg_parser.add_argument('--concurrency', type=int, default=16, help='Async crawler concurrency')
+    arg_parser.add_argument('--workers', type=int, default=1, help='Parser worker processes')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--stages', default='crawl,crawl_async,clean,match,compare,lookup')
+    arg_parser.add_argument('--no-memory', action='store_true', help='Skip the peak memory passes')
+    arg_parser.add_argument('--output', help='JSON results file (default: benchmarks/results/<time>-<rev>.json)')
+    arg_parser.add_argument('--compare', help='Earlier JSON results file to compare against')
+    args = arg_parser.parse_args()
+
+    # The crawlers log every page at INFO
+    logging.disable(logging.INFO)
+
+    stages = args.stages.split(',')
+    terms = typed_terms(args.identities, args.seed)
+    corpus = generate_corpus(load_seed_pages(args.corpus), args.pages, args.hosts, terms, seed=args.seed)
+    pages = list(corpus.values())
+    parser = Parser(None, [])
+    texts = [parser.clean_html(html) for html in pages]
+    print(f"Corpus: {len(pages)} pages on {args.hosts} hosts, "
+          f"{sum(len(html) for html in pages):,} characters, {len(terms)} terms")
+
+    server = FakeOnionServer(corpus, latency=args.latency).start()
+    proxy = FakeSocksProxy(server.address).start()
+    urls = list(corpus)
+
+    plan = {
+        'crawl': lambda: crawl_sync_stage(urls, proxy.proxy_url),
+        'crawl_async': lambda: crawl_async_stage(urls, proxy.proxy_url, args.concurrency),
+        'clean': lambda: clean_stage(pages, parser),
+        'match': lambda: match_stage(texts, parser, terms),
+        'compare': lambda: compare_stage(corpus, texts, terms, args.workers),
+        'lookup': lambda: lookup_stage(corpus, texts, terms),
+    }
+    results = {
+        'revision': git_revision(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'extractor': parser.extractor.name,
+        'config': vars(args),
+        'stages': {},
+    }
+    try:
+        for name in stages:
+            results['stages'][name] = run_stage(name, plan[name](), not args.no_memory)
+    finally:
+        proxy.stop()
+        server.stop()
+
+    # ru_maxrss is in kilobytes on Linux
+    results['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Peak resident memory: {results['max_rss_mb']:.1f} MB")
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(results['timestamp']))
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{results['revision'] or 'unknown'}.json")
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            print_comparison(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
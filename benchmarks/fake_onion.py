@@ -0,0 +1,210 @@
+# Stand-in for the Tor network in benchmarks: a synthetic .onion corpus served
+# from a local HTTP server behind a local SOCKS5 proxy
+
+import os
+import sys
+import time
+import socket
+import base64
+import random
+import hashlib
+import select
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser import Parser
+
+
+def onion_address(rng):
+    """
+    Random but well-formed v3 .onion host name (valid checksum)
+    """
+    pubkey = bytes(rng.getrandbits(8) for _ in range(32))
+    version = b'\x03'
+    checksum = hashlib.sha3_256(b'.onion checksum' + pubkey + version).digest()[:2]
+    return base64.b32encode(pubkey + checksum + version).decode('ascii').lower() + '.onion'
+
+
+def load_seed_pages(corpus_path):
+    """
+    Pages of the shipped text.txt corpus, used as templates for synthetic pages
+    """
+    return list(Parser(corpus_path, []).iter_documents())
+
+
+def variant(value, mode, rng):
+    """
+    How a leak might spell value: digit fields with other separators, emails
+    in another case or obfuscated, the rest as typed
+    """
+    if mode == 'digits':
+        digits = ''.join(ch for ch in value if ch.isdigit())
+        separator = rng.choice([' ', '-', '.', ''])
+        return separator.join(digits[i:i + 3] for i in range(0, len(digits), 3))
+    if mode == 'email' and rng.random() < 0.5:
+        return value.upper() if rng.random() < 0.5 else value.replace('@', ' [at] ')
+    return value
+
+
+def generate_corpus(seed_pages, pages, hosts, terms=(), plant_rate=0.2, links_per_page=5, seed=0):
+    """
+    Build a synthetic crawl corpus of pages spread over hosts.
+
+    Each page is a seed page with a block of links to other pages of the
+    corpus appended, and, on plant_rate of the pages, a few of terms
+    (plain strings or (value, mode) pairs) spelled as a leak might spell them.
+
+    Returns a dictionary of url -> html in a stable order for a given seed.
+    """
+    rng = random.Random(seed)
+    host_names = [onion_address(rng) for _ in range(hosts)]
+    urls = [f"http://{host_names[i % hosts]}/page/{i}" for i in range(pages)]
+    terms = [term if isinstance(term, tuple) else (term, 'exact') for term in terms]
+
+    corpus = {}
+    for i, url in enumerate(urls):
+        html = seed_pages[i % len(seed_pages)]
+        extra = [f'<a href="{rng.choice(urls)}">page</a>' for _ in range(links_per_page)]
+        if terms and rng.random() < plant_rate:
+            for value, mode in rng.sample(terms, min(3, len(terms))):
+                extra.append(f"<p>record: {variant(value, mode, rng)}</p>")
+        block = '<div>' + ' '.join(extra) + '</div>'
+        closing = html.lower().rfind('</body>')
+        corpus[url] = html[:closing] + block + html[closing:] if closing >= 0 else html + block
+    return corpus
+
+
+class FakeOnionServer:
+    """
+    HTTP server answering for every host of a corpus, picking the page by
+    Host header and path. latency adds a delay before each response, to
+    stand in for Tor's round trips.
+    """
+
+    def __init__(self, corpus, latency=0.0):
+        pages = {}
+        for url, html in corpus.items():
+            host_and_path = url.split('://', 1)[1]
+            host, _, path = host_and_path.partition('/')
+            pages[(host, '/' + path)] = html.encode('utf-8')
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if latency:
+                    time.sleep(latency)
+                host = (self.headers.get('Host') or '').split(':', 1)[0]
+                body = pages.get((host, self.path))
+                if body is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeSocksProxy:
+    """
+    Minimal SOCKS5 proxy that sends every CONNECT, whatever host it names,
+    to one target address. Accepts no authentication and username/password
+    authentication (any credentials), like Tor with IsolateSOCKSAuth.
+    """
+
+    def __init__(self, target):
+        class Handler(socketserver.BaseRequestHandler):
+            def _read(self, size):
+                data = b''
+                while len(data) < size:
+                    chunk = self.request.recv(size - len(data))
+                    if not chunk:
+                        raise ConnectionError("Client closed the connection")
+                    data += chunk
+                return data
+
+            def handle(self):
+                try:
+                    _, method_count = self._read(2)
+                    methods = self._read(method_count)
+                    if 2 in methods:
+                        self.request.sendall(b'\x05\x02')
+                        self._read(1)
+                        self._read(self._read(1)[0])  # Username
+                        self._read(self._read(1)[0])  # Password
+                        self.request.sendall(b'\x01\x00')
+                    else:
+                        self.request.sendall(b'\x05\x00')
+
+                    _, command, _, address_type = self._read(4)
+                    if address_type == 1:
+                        self._read(4)
+                    elif address_type == 3:
+                        self._read(self._read(1)[0])
+                    elif address_type == 4:
+                        self._read(16)
+                    self._read(2)  # Port
+                    if command != 1:
+                        self.request.sendall(b'\x05\x07\x00\x01' + b'\x00' * 6)
+                        return
+
+                    upstream = socket.create_connection(target)
+                    self.request.sendall(b'\x05\x00\x00\x01' + b'\x00' * 6)
+                    self._relay(upstream)
+                except (ConnectionError, OSError, ValueError):
+                    pass
+
+            def _relay(self, upstream):
+                sockets = [self.request, upstream]
+                try:
+                    while True:
+                        readable, _, _ = select.select(sockets, [], [], 30)
+                        if not readable:
+                            return
+                        for sock in readable:
+                            data = sock.recv(64 * 1024)
+                            if not data:
+                                return
+                            (upstream if sock is self.request else self.request).sendall(data)
+                finally:
+                    upstream.close()
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.address = self.server.server_address
+
+    @property
+    def proxy_url(self):
+        return f"socks5h://{self.address[0]}:{self.address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
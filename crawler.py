@@ -6,26 +6,40 @@ import os
 import sys
 import time             # For adding delays between requests
 import requests         # For making HTTP requests
-from bs4 import BeautifulSoup  # For parsing HTML content
-from stem.control import Controller  # For controlling Tor via the control port
-from stem import Signal         # For sending signals to Tor (e.g., to get a new identity)
+from extract import get_extractor  # For parsing HTML content
+from fetcher import Fetcher, FetchError, FetchTimeout, DEFAULT_MAX_BYTES  # For bounded, streamed HTTP fetches
+from host_health import (Failure, HostHealth, RetryScheduler, SKIPPED,  # For retries and dead hosts
+                         classify_error, classify_status, url_host)
+import metrics          # For fetch and processing instrumentation
+from tor_pool import TorController  # For controlling Tor via the control port
 from dotenv import load_dotenv  # For loading environment variables from .env file
 import logging          # For logging information and errors
+from frontier import CrawlFrontier  # For the persistent crawl queue
+from links import link_score, onion_address_valid, resolve_links  # For link extraction and ranking
+from page_store import PageStore  # For storing fetched pages
+from pipeline import CrawlPipeline  # For storing each page straight after extraction
+from dedup import MirrorIndex  # For skipping mirrored pages
 
-# Configure logging settings to track the program's operation
-logging.basicConfig(
-    level=logging.INFO,  # Set logging level to INFO (could be DEBUG for more details)
-    format='%(asctime)s - %(levelname)s - %(message)s'  # Format: timestamp - log level - message
-)
 logger = logging.getLogger(__name__)  # Get a logger instance for this module
 
 class DarkWebCrawler:
     """
     Main crawler class responsible for connecting to Tor and crawling .onion websites
     """
-    def __init__(self):
+    def __init__(self, circuit_pool=None, page_store=None, crawl_delay=2.0, mirror_index=None, **fetch_options):
         """
         Initialize the crawler with a new session and the Tor SOCKS proxy settings
+
+        Args:
+            circuit_pool: Optional TorCircuitPool to spread requests over several
+                          isolated circuits instead of the single default proxy
+            page_store: Optional PageStore of earlier fetches; pages in it are
+                        revisited with conditional requests
+            crawl_delay: Seconds to wait after each page fetched
+            mirror_index: Optional MirrorIndex; pages with the same HTML as
+                          another URL are then skipped before parsing, and
+                          near duplicates are recorded as mirrors
+            fetch_options: Pool sizes, timeouts and size cap passed to Fetcher
         """
         self.session = requests.session()  # Create a persistent session for making requests
         # Configure the session to use Tor's SOCKS proxy
@@ -35,6 +49,17 @@ class DarkWebCrawler:
             'https': 'socks5h://127.0.0.1:9050'   # HTTPS traffic through Tor
         }
         self.visited_urls = set()  # Initialize empty set to track visited URLs
+        self.circuit_pool = circuit_pool
+        self.tor_controller = None  # Opened on the first renew_tor_ip() without a circuit pool
+        self.page_store = page_store
+        self.crawl_delay = crawl_delay
+        self.mirror_index = mirror_index
+        # Keep-alive connection pools, timeouts and a body size cap for every fetch
+        self.fetcher = Fetcher(
+            self.session,
+            validators=page_store.validators if page_store is not None else None,
+            **fetch_options
+        )
 
     def connect_to_tor(self):
         """
@@ -47,7 +72,7 @@ class DarkWebCrawler:
             logger.info("Using SOCKS proxy: socks5h://127.0.0.1:9050")
 
             # This API endpoint returns if you're using Tor or not in JSON format
-            response = self.session.get('https://check.torproject.org/api/ip')
+            response = self.session.get('https://check.torproject.org/api/ip', timeout=self.fetcher.timeout)
             logger.info(f"Response status code: {response.status_code}")
             logger.info(f"Response content: {response.text}")
 
@@ -74,18 +99,56 @@ class DarkWebCrawler:
         Request a new Tor circuit/identity to change the exit node IP address
         This helps avoid rate limiting and adds another layer of anonymity
         """
+        if self.circuit_pool is not None:
+            # The pool reuses one controller connection and does not block the crawl
+            self.circuit_pool.request_newnym()
+            return
+
+        # Otherwise one controller connection on port 9051 is kept for every renewal;
+        # new connections use the new circuit, so there is nothing to wait for
+        if self.tor_controller is None:
+            self.tor_controller = TorController(port=9051)
+        self.tor_controller.send_newnym()
+
+    def _get(self, url):
+        """
+        GET a URL through Tor, on a pooled circuit when a circuit pool is set.
+        Returns a FetchResult.
+        """
+        circuit = self.circuit_pool.acquire() if self.circuit_pool is not None else None
+        proxies = {'http': circuit.proxy_url, 'https': circuit.proxy_url} if circuit is not None else None
+        circuit_label = str(circuit.index) if circuit is not None else 'default'
+        start = time.monotonic()
         try:
-            # Connect to the Tor controller on port 9051
-            with Controller.from_port(port=9051) as controller:
-                # Authenticate to the controller - requires proper Tor configuration
-                controller.authenticate()
-                # Send NEWNYM signal to request a new Tor circuit
-                controller.signal(Signal.NEWNYM)
-                logger.info("Successfully renewed Tor IP")
-                # Wait for the new circuit to be established
-                time.sleep(5)
-        except Exception as e:
-            logger.error(f"Error renewing Tor IP: {str(e)}")
+            response = self.fetcher.fetch(url, proxies=proxies)
+        except FetchError:
+            # The circuit delivered; the response itself was refused
+            latency = time.monotonic() - start
+            metrics.observe_fetch(url_host(url), circuit_label, latency, 'skipped')
+            if circuit is not None:
+                self.circuit_pool.release(circuit, latency=latency)
+            raise
+        except Exception:
+            metrics.observe_fetch(url_host(url), circuit_label, time.monotonic() - start, 'error')
+            if circuit is not None:
+                self.circuit_pool.release(circuit, error=True)
+            raise
+        latency = time.monotonic() - start
+        metrics.observe_fetch(url_host(url), circuit_label, latency,
+                              metrics.status_outcome(response.status), response.size)
+        if circuit is not None:
+            self.circuit_pool.release(circuit, latency=latency, error=response.status >= 500)
+        return response
+
+    def link_priority(self, url):
+        """
+        Frontier priority of a newly found link: links.link_score, lowered for
+        links to known mirrors
+        """
+        priority = link_score(url)
+        if self.mirror_index is not None:
+            priority += self.mirror_index.priority(url)
+        return priority
 
     def crawl_onion(self, url):
         """
@@ -94,56 +157,131 @@ class DarkWebCrawler:
         Args:
             url: The .onion URL to crawl
         """
+        return self.fetch_onion(url)[0]
+
+    def fetch_onion(self, url):
+        """
+        Crawl a single .onion URL like crawl_onion, also reporting why it failed
+
+        Returns (result, failure): the result dictionary and None on success,
+        None and a host_health.Failure otherwise, or (None, None) for a URL
+        that was already visited or whose HTML another URL already served
+        """
         # Skip if we've already visited this URL
         if url in self.visited_urls:
-            return
+            return None, None
 
         try:
             # Log the current URL being crawled
             logger.info(f"Crawling: {url}")
 
             # Make a GET request to the .onion URL through Tor
-            response = self.session.get(url)
+            response = self._get(url)
+
+            # Unchanged since the last visit: reuse the stored page
+            if response.not_modified and self.page_store is not None:
+                self.visited_urls.add(url)
+                logger.info(f"Not modified since last visit: {url}")
+                result = not_modified_result(self.page_store, url, response)
+                time.sleep(self.crawl_delay)
+                return result, None
 
             # Only process successful responses
-            if response.status_code == 200:
+            if response.status == 200:
                 # Add to visited URLs set to avoid revisiting
                 self.visited_urls.add(url)
 
-                # Parse HTML content with BeautifulSoup
-                soup = BeautifulSoup(response.text, 'html.parser')
+                # A mirror of a page already crawled is neither parsed nor matched again
+                if self.mirror_index is not None:
+                    duplicate = self.mirror_index.exact_duplicate(url, response.text)
+                    if duplicate is not None:
+                        metrics.DUPLICATES.inc(kind=duplicate.kind)
+                        logger.info(f"Skipping {url}: same content as {duplicate.canonical_url}")
+                        time.sleep(self.crawl_delay)
+                        return None, None
+
+                # Parse HTML content with the fastest available backend
+                with metrics.PROCESSING_SECONDS.time(stage='extract'):
+                    page = get_extractor().extract(response.text)
 
                 # Extract and log the page title
-                title = soup.title.string if soup.title else "No title"
+                title = page.title if page.title is not None else "No title"
                 logger.info(f"Page title: {title}")
 
-                # Find and extract all links on the page
-                links = soup.find_all('a', href=True)
-                for link in links:
-                    href = link['href']
-                    # Check if it's an .onion link or a regular link
-                    if href.endswith('.onion'):
-                        logger.info(f"Found .onion link: {href}")
-                    else:
-                        logger.info(f"Found regular link: {href}")
+                # Resolve the page's links to canonical URLs, dropping malformed .onion addresses;
+                # listing each one is only worth its cost when debugging
+                links = resolve_links(url, page.links)
+                onion = [onion_address_valid(url_host(link)) for link in links]
+                logger.info(f"Found {len(links)} links ({sum(onion)} .onion)")
+                if logger.isEnabledFor(logging.DEBUG):
+                    for link, is_onion_link in zip(links, onion):
+                        # Check if it's an .onion link or a regular link
+                        if is_onion_link:
+                            logger.debug(f"Found .onion link: {link}")
+                        else:
+                            logger.debug(f"Found regular link: {link}")
+
+                # Near duplicates are still matched: the difference may be the leak
+                if self.mirror_index is not None:
+                    duplicate = self.mirror_index.near_duplicate(url, response.text, page.text)
+                    if duplicate is not None:
+                        metrics.DUPLICATES.inc(kind=duplicate.kind)
+                        logger.info(f"{url} mirrors {duplicate.canonical_url} "
+                                    f"({duplicate.similarity:.0%} alike)")
 
                 # Add delay between requests to be respectful to the server
                 # and avoid detection/blocking
-                time.sleep(2)
+                time.sleep(self.crawl_delay)
 
                 return {
                     "url": url,
                     "title": title,
+                    "status": response.status,
                     "raw_html": response.text,
-                    "links": links
-                }
+                    "text": page.text,
+                    "links": links,
+                    "etag": response.etag,
+                    "last_modified": response.last_modified,
+                }, None
             else:
                 # Log unsuccessful responses with their status code
-                logger.warning(f"Failed to access {url}. Status code: {response.status_code}")
+                logger.warning(f"Failed to access {url}. Status code: {response.status}")
+                return None, Failure(classify_status(response.status), f"HTTP {response.status}",
+                                     response.retry_after)
 
+        except FetchError as e:
+            # Binary or oversized responses are skipped; only slow ones may be retried
+            logger.warning(f"Skipped {url}: {str(e)}")
+            kind = classify_error(e) if isinstance(e, FetchTimeout) else SKIPPED
+            return None, Failure(kind, str(e), None)
         except Exception as e:
             # Log any errors that occur during crawling
             logger.error(f"Error crawling {url}: {str(e)}")
+            return None, Failure(classify_error(e), str(e), None)
+
+def not_modified_result(page_store, url, response):
+    """
+    Result for a page the server reports unchanged (response is the 304
+    FetchResult), rebuilt from its last fetch stored in page_store
+    """
+    stored = page_store.latest(url)
+    text = page_store.get_text(stored['content_hash'])
+    links = page_store.get_links(stored['content_hash'])
+    if text is None:
+        page = get_extractor().extract(stored['html'])
+        text, links = page.text, page.links
+    # Pages stored before links were resolved at fetch time hold raw hrefs
+    links = resolve_links(url, links or [])
+    return {
+        "url": url,
+        "title": stored['title'] or "No title",
+        "status": response.status,
+        "raw_html": stored['html'],
+        "text": text,
+        "links": links,
+        "etag": response.etag or stored['etag'],
+        "last_modified": response.last_modified or stored['last_modified'],
+    }
 
 def read_urls_from_file(filename):
     """
@@ -172,8 +310,25 @@ def main():
     # Load environment variables from .env file
     load_dotenv()
 
+    # Configure logging settings to track the program's operation (LOG_LEVEL may come from .env)
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),  # INFO by default; DEBUG also lists every link found
+        format='%(asctime)s - %(levelname)s - %(message)s'  # Format: timestamp - log level - message
+    )
+
+    # Pages are stored as they are fetched; stored pages are revisited conditionally
+    page_store = PageStore()
+
     # Create a new crawler instance
-    crawler = DarkWebCrawler()
+    mirror_index = MirrorIndex()
+    crawler = DarkWebCrawler(
+        page_store=page_store,
+        mirror_index=mirror_index,
+        crawl_delay=float(os.getenv('CRAWL_DELAY', '2')),
+        max_bytes=int(os.getenv('FETCH_MAX_BYTES', str(DEFAULT_MAX_BYTES))),
+        connect_timeout=float(os.getenv('FETCH_CONNECT_TIMEOUT', '30')),
+        read_timeout=float(os.getenv('FETCH_READ_TIMEOUT', '60')),
+    )
 
     # Try to connect to Tor, exit if connection fails
     if not crawler.connect_to_tor():
@@ -186,12 +341,52 @@ def main():
         logger.error("No URLs found in urls.txt. Exiting...")
         sys.exit(1)
 
-    # Crawl each URL
-    for url in urls:
+    # Queue the seed URLs; URLs left over from an interrupted run are resumed
+    frontier = CrawlFrontier(
+        max_depth=int(os.getenv('MAX_DEPTH', '1')),
+        max_pages=int(os.getenv('MAX_PAGES', '100')),
+    )
+    frontier.add_many(urls)
+    pipeline = CrawlPipeline(page_store)
+
+    # Failed URLs are retried with backoff; hosts known to be down are skipped until they may be up again
+    host_health = HostHealth()
+    scheduler = RetryScheduler(frontier, host_health, max_retries=int(os.getenv('MAX_RETRIES', '3')))
+
+    # Export crawl metrics if METRICS_PORT or METRICS_SNAPSHOT is set
+    metrics.QUEUE_DEPTH.set_function(frontier.pending_count)
+    snapshot_writer = metrics.start_from_env(os.environ)
+
+    # Crawl until the frontier is empty or the page limit is reached
+    while True:
+        item = scheduler.next()
+        if item is None:
+            # Wait for deferred URLs that are due soon; later ones are left for the next run
+            wait = scheduler.wait_time()
+            if wait is None:
+                break
+            time.sleep(wait)
+            continue
+        url, depth = item
         logger.info(f"Processing URL: {url}")
-        crawler.crawl_onion(url)
-        # Add a delay between different URLs
-        time.sleep(5)
+        result, failure = crawler.fetch_onion(url)
+        if result:
+            scheduler.succeeded(url)
+            pipeline.process(result)
+            # Follow the page's links one level deeper
+            frontier.add_many(result['links'], depth=depth + 1, priority=crawler.link_priority)
+        elif failure is not None:
+            scheduler.failed(url, failure)
+        else:
+            frontier.mark_done(url)  # Already visited under another spelling, or a mirror
+        # Politeness between requests is fetch_onion's crawl_delay (CRAWL_DELAY)
+
+    if snapshot_writer is not None:
+        snapshot_writer.stop()
+    frontier.close()
+    page_store.close()
+    host_health.close()
+    mirror_index.close()
 
 if __name__ == "__main__":
     main()
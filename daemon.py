@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# Daemon - headless crawl, store, match and alert cycles on a schedule
+
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+import metrics
+from async_crawler import crawler_from_env
+from crawler import read_urls_from_file
+from dedup import MirrorIndex
+from frontier import CrawlFrontier
+from host_health import HostHealth, RetryScheduler
+from matcher import FieldMatcher
+from page_store import PageStore
+from parser import Parser
+from pipeline import CrawlPipeline
+from results_index import ResultsIndex
+from term_store import TermStore, load_fernet
+from text_index import TextIndex
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a cycle on the match queue
+_END_OF_CYCLE = None
+
+
+class CrawlDaemon:
+    """
+    Runs crawl -> store -> match -> alert cycles until stopped.
+
+    One crawler session (and its Tor circuits) and one compiled matcher are
+    kept for the life of the process; the matcher is only rebuilt when the
+    term store's version changes. Within a cycle fetching and matching
+    overlap: fetch workers hand pages to a bounded queue, drained by a
+    single thread that stores and matches them, so a slow matcher slows
+    fetching down instead of piling pages up in memory.
+    """
+
+    def __init__(self, crawler, frontier, scheduler, page_store, results_index, term_store,
+                 seeds_path='urls.txt', interval=3600.0, queue_size=64, alerts_path='data/alerts.jsonl',
+                 parse_workers=1, text_index=None):
+        """
+        Args:
+            crawler: AsyncDarkWebCrawler to fetch with
+            frontier: CrawlFrontier restarted from the seeds every cycle
+            scheduler: RetryScheduler over frontier
+            page_store: PageStore the pages are written to
+            results_index: ResultsIndex the hits are merged into
+            term_store: TermStore holding the identities to monitor
+            seeds_path: File of seed URLs, re-read every cycle
+            interval: Seconds from the start of one cycle to the start of the next
+            queue_size: Fetched pages held at most between fetching and matching
+            alerts_path: JSON Lines file new matches are appended to
+            parse_workers: Processes used to rescan stored pages when the terms change
+            text_index: Optional TextIndex pages are added to, narrowing down those
+                        rescanned when the terms change
+        """
+        self.crawler = crawler
+        self.frontier = frontier
+        self.scheduler = scheduler
+        self.page_store = page_store
+        self.results_index = results_index
+        self.term_store = term_store
+        self.seeds_path = seeds_path
+        self.interval = interval
+        self.queue_size = queue_size
+        self.alerts_path = alerts_path
+        self.parse_workers = parse_workers
+        self.text_index = text_index
+        self.pipeline = None
+        self._terms_version = None
+        self._term_labels = {}  # Term id -> [(identity name, field)]
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='match')
+
+    def _refresh_terms(self):
+        """
+        Rebuild the pipeline and matcher if the term store changed, rescanning
+        stored pages so the index matches the new terms. Runs on the match thread.
+        """
+        version = self.term_store.version
+        if self.pipeline is not None and version == self._terms_version:
+            return
+        terms = self.term_store.terms()
+        if not terms:
+            logger.warning("No identities in the term store; pages are stored but not matched")
+        self._term_labels = {}
+        for _, name, field, value in self.term_store.fields():
+            self._term_labels.setdefault(self.term_store.term_id(value), []).append((name, field))
+
+        # Checked before the pipeline stamps an empty index with the new terms
+        id_key = self.term_store.id_key
+        if terms and self.results_index.terms_version != FieldMatcher.terms_fingerprint(terms, id_key):
+            known = self.results_index.matched_terms()
+            Parser(None, [], page_store=self.page_store, workers=self.parse_workers, term_store=self.term_store,
+                   text_index=self.text_index).parse_incremental(self.results_index)
+            # A newly monitored value may already be on crawled pages; the pipeline
+            # will see it as known from now on, so alert on it here
+            self._alert_found(self.results_index.matched_terms() - known)
+        self.pipeline = CrawlPipeline(self.page_store, terms, self.results_index, on_alert=self._alert,
+                                      text_index=self.text_index, id_key=id_key)
+        self._terms_version = version
+
+    def _alert_found(self, term_ids):
+        """
+        Alert on every stored hit of term_ids, page by page as the pipeline does
+        """
+        if not term_ids:
+            return
+        pages = {}
+        for record in self.results_index.iter_hits(term_ids=term_ids):
+            pages.setdefault(record['url'], []).append(record)
+        for url, records in pages.items():
+            metrics.ALERTS.inc(len({record['term_id'] for record in records}))
+            self._alert(url, records)
+
+    def _alert(self, url, records):
+        """
+        Log and append to alerts_path the terms newly found on url, with the
+        context around each hit. Parser.match_text replaces every matched
+        value in a context with its term id, so the values themselves never
+        reach the alerts file.
+        """
+        if os.path.dirname(self.alerts_path):
+            os.makedirs(os.path.dirname(self.alerts_path), exist_ok=True)
+        with open(self.alerts_path, 'a', encoding='utf-8') as f:
+            for record in records:
+                for name, field in self._term_labels.get(record['term_id'], [(None, None)]):
+                    logger.warning(f"ALERT: {field or 'user data'}" + (f" of {name}" if name else "") + f" found on {url}")
+                    f.write(json.dumps({
+                        'time': time.time(), 'url': url, 'identity': name, 'field': field,
+                        'term_id': record['term_id'], 'page_id': record['page_id'], 'context': record['context'],
+                    }) + '\n')
+
+    async def _match_worker(self, queue, counts):
+        loop = asyncio.get_running_loop()
+        while True:
+            result = await queue.get()
+            metrics.MATCH_QUEUE.set(queue.qsize())
+            if result is _END_OF_CYCLE:
+                return
+            try:
+                _, hits = await loop.run_in_executor(self._executor, self.pipeline.process, result)
+                counts['pages'] += 1
+                counts['matches'] += len(hits)
+            except Exception as e:
+                logger.error(f"Error processing {result['url']}: {str(e)}")
+
+    async def run_cycle(self, session):
+        """
+        Crawl from the seeds once, storing and matching pages as they arrive.
+        Returns a dictionary of cycle statistics.
+        """
+        start = time.time()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._refresh_terms)
+
+        # Every cycle revisits the seeds and the pages found from them
+        self.crawler.visited_urls.clear()
+        self.frontier.restart()
+        self.frontier.add_many(read_urls_from_file(self.seeds_path))
+
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        counts = {'pages': 0, 'matches': 0}
+        matching = asyncio.create_task(self._match_worker(queue, counts))
+
+        async def enqueue(result):
+            await queue.put(result)
+            metrics.MATCH_QUEUE.set(queue.qsize())
+
+        try:
+            fetched = await self.crawler.crawl_frontier(self.frontier, on_result=enqueue,
+                                                        scheduler=self.scheduler, session=session)
+        finally:
+            await queue.put(_END_OF_CYCLE)
+            await matching
+
+        metrics.CYCLES.inc()
+        stats = dict(counts, fetched=fetched, seconds=time.time() - start)
+        logger.info(f"Cycle done: {fetched} pages fetched, {counts['matches']} matches "
+                    f"in {stats['seconds']:.1f} seconds")
+        return stats
+
+    async def run(self, cycles=None):
+        """
+        Run cycles every interval seconds, forever or cycles times
+        """
+        session = self.crawler.open_session()
+        completed = 0
+        try:
+            while cycles is None or completed < cycles:
+                started = time.time()
+                await self.run_cycle(session)
+                completed += 1
+                if cycles is not None and completed >= cycles:
+                    break
+                wait = self.interval - (time.time() - started)
+                if wait > 0:
+                    logger.info(f"Next cycle in {wait:.0f} seconds")
+                    await asyncio.sleep(wait)
+        finally:
+            await self.crawler.close_session(session)
+            self._executor.shutdown(wait=True)
+
+
+async def _run_until_signalled(daemon, cycles):
+    # SIGTERM stops the daemon like Ctrl-C: the running cycle is cancelled and
+    # its in-flight URLs are requeued by the frontier on the next start
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        try:
+            loop.add_signal_handler(signum, task.cancel)
+        except (NotImplementedError, RuntimeError):
+            pass
+    try:
+        await daemon.run(cycles)
+    except asyncio.CancelledError:
+        logger.info("Stopping")
+
+
+def main():
+    """
+    Run the daemon with settings from the command line and the environment
+    (the same variables as async_crawler.py)
+    """
+    load_dotenv()
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    arg_parser = argparse.ArgumentParser(description="Headless crawl-and-match service")
+    arg_parser.add_argument('--interval', type=float, default=float(os.getenv('CYCLE_INTERVAL', '3600')),
+                            help='Seconds between the starts of two cycles')
+    arg_parser.add_argument('--cycles', type=int, help='Stop after this many cycles (default: run forever)')
+    arg_parser.add_argument('--once', action='store_const', const=1, dest='cycles', help='Run a single cycle')
+    arg_parser.add_argument('--seeds', default='urls.txt', help='File of seed URLs, re-read every cycle')
+    arg_parser.add_argument('--queue-size', type=int, default=int(os.getenv('MATCH_QUEUE_SIZE', '64')),
+                            help='Fetched pages waiting to be matched at most')
+    arg_parser.add_argument('--alerts', default=os.getenv('ALERTS_FILE', 'data/alerts.jsonl'))
+    arg_parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Processes used to rescan stored pages when the user data changes')
+    args = arg_parser.parse_args()
+
+    if not read_urls_from_file(args.seeds):
+        logger.error(f"No URLs found in {args.seeds}. Exiting...")
+        sys.exit(1)
+
+    mirror_index = MirrorIndex()
+    page_store = PageStore()
+    crawler, circuit_pool = crawler_from_env(mirror_index, page_store)
+    frontier = CrawlFrontier(
+        max_depth=int(os.getenv('MAX_DEPTH', '1')),
+        max_pages=int(os.getenv('MAX_PAGES', '100')),
+    )
+    host_health = HostHealth()
+    scheduler = RetryScheduler(frontier, host_health, max_retries=int(os.getenv('MAX_RETRIES', '3')))
+    results_index = ResultsIndex()
+    term_store = TermStore(load_fernet('user_data/.encryption_key'), 'user_data/terms.db')
+    text_index = TextIndex()
+
+    # Export metrics if METRICS_PORT or METRICS_SNAPSHOT is set
+    metrics.QUEUE_DEPTH.set_function(frontier.pending_count)
+    snapshot_writer = metrics.start_from_env(os.environ)
+
+    daemon = CrawlDaemon(crawler, frontier, scheduler, page_store, results_index, term_store,
+                         seeds_path=args.seeds, interval=args.interval, queue_size=args.queue_size,
+                         alerts_path=args.alerts, parse_workers=args.workers, text_index=text_index)
+    try:
+        asyncio.run(_run_until_signalled(daemon, args.cycles))
+    except KeyboardInterrupt:
+        logger.info("Stopping")
+    finally:
+        if snapshot_writer is not None:
+            snapshot_writer.stop()
+        if circuit_pool is not None:
+            circuit_pool.stop()
+        frontier.close()
+        page_store.close()
+        results_index.close()
+        host_health.close()
+        term_store.close()
+        mirror_index.close()
+        text_index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# Dedup - exact and near-duplicate page detection and mirror clusters
+
+import os
+import re
+import time
+import zlib
+import sqlite3
+import struct
+import heapq
+import threading
+from collections import namedtuple
+from host_health import url_host
+from page_store import content_hash
+
+# Duplicate of another page: kind is 'exact' (same HTML) or 'near' (nearly the same text);
+# canonical_url is the first page of the mirror cluster, similarity the estimated
+# share of shingles the two pages have in common
+Duplicate = namedtuple('Duplicate', ['kind', 'canonical_url', 'similarity'])
+
+_WORD = re.compile(r'\w+')
+_MASK = (1 << 64) - 1
+# Odd 64-bit multiplier (golden ratio) spreading shingle bits into the high bits, which decide the order
+_MULTIPLIER = 0x9E3779B97F4A7C15
+
+# MinHash sketch settings: a page is summarized by the SKETCH_SIZE smallest
+# hashes of its shingles; the smallest INDEXED of those are looked up to
+# find candidate near duplicates
+SKETCH_SIZE = 32
+INDEXED = 8
+
+
+def shingle_hashes(text):
+    """
+    Distinct 64-bit hashes of the three-word shingles of text (lowercased)
+    """
+    word_hashes = {}
+    hashes = []
+    for word in _WORD.findall(text.lower()):
+        h = word_hashes.get(word)
+        if h is None:
+            h = word_hashes[word] = zlib.crc32(word.encode('utf-8')) & 0x1FFFFF
+        hashes.append(h)
+    if len(hashes) < 3:
+        return {h * _MULTIPLIER & _MASK for h in hashes}
+    return {((a << 42) | (b << 21) | c) * _MULTIPLIER & _MASK for a, b, c in zip(hashes, hashes[1:], hashes[2:])}
+
+
+def sketch(features, size=SKETCH_SIZE):
+    """
+    Bottom-k MinHash sketch: the size smallest feature hashes, ascending
+    """
+    return sorted(heapq.nsmallest(size, features))
+
+
+def resemblance(sketch_a, sketch_b, size=SKETCH_SIZE):
+    """
+    Estimated Jaccard similarity of the shingle sets two sketches were taken from
+    """
+    a, b = set(sketch_a), set(sketch_b)
+    union = heapq.nsmallest(size, a | b)
+    if not union:
+        return 0.0
+    return sum(1 for h in union if h in a and h in b) / len(union)
+
+
+def _signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _pack(hashes):
+    return struct.pack(f'<{len(hashes)}Q', *hashes)
+
+
+def _unpack(blob):
+    return struct.unpack(f'<{len(blob) // 8}Q', blob)
+
+
+class MirrorIndex:
+    """
+    Fingerprints of crawled pages, to recognize mirrors: the same page
+    served at several URLs (same HTML, caught before the page is parsed) or
+    nearly the same page (estimated share of common three-word shingles of
+    at least min_similarity, from MinHash sketches taken once its text is
+    extracted). Duplicates are grouped in clusters named after their first
+    page, stored in SQLite across runs.
+
+    Hosts serving mostly duplicates are mirrors; priority() ranks their
+    links below others in the frontier.
+    """
+
+    def __init__(self, db_path='data/mirrors.db', min_similarity=0.9, min_shingles=30, mirror_host_pages=3):
+        """
+        Args:
+            db_path: SQLite file holding page fingerprints and clusters
+            min_similarity: Estimated share of common shingles (0-1) of near duplicates
+            min_shingles: Pages with fewer distinct shingles are only compared exactly
+            mirror_host_pages: Pages seen on a host before its duplicate rate
+                               affects the priority of its links
+        """
+        self.db_path = db_path
+        self.min_similarity = min_similarity
+        self.min_shingles = min_shingles
+        self.mirror_host_pages = mirror_host_pages
+        self._lock = threading.Lock()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                host TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                sketch BLOB,
+                cluster TEXT NOT NULL,
+                duplicate TEXT,
+                similarity REAL,
+                seen_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS minhashes (
+                value INTEGER NOT NULL,
+                url TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS pages_content_hash ON pages (content_hash);
+            CREATE INDEX IF NOT EXISTS pages_host ON pages (host);
+            CREATE INDEX IF NOT EXISTS pages_cluster ON pages (cluster);
+            CREATE INDEX IF NOT EXISTS minhashes_value ON minhashes (value);
+            CREATE INDEX IF NOT EXISTS minhashes_url ON minhashes (url);
+        """)
+        self.conn.commit()
+
+    def _record(self, url, digest, page_sketch, cluster, duplicate, similarity):
+        self.conn.execute('DELETE FROM minhashes WHERE url = ?', (url,))
+        self.conn.execute(
+            'INSERT OR REPLACE INTO pages (url, host, content_hash, sketch, cluster, duplicate, similarity, seen_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (url, url_host(url), digest, _pack(page_sketch) if page_sketch else None,
+             cluster, duplicate, similarity, time.time())
+        )
+        if page_sketch:
+            self.conn.executemany('INSERT INTO minhashes (value, url) VALUES (?, ?)',
+                                  ((_signed(value), url) for value in page_sketch[:INDEXED]))
+        self.conn.commit()
+
+    def exact_duplicate(self, url, html):
+        """
+        Check html against every other page seen. Returns a Duplicate if
+        another URL served exactly the same HTML (and records url in its
+        cluster), None otherwise; the page is recorded by near_duplicate.
+        """
+        digest = content_hash(html)
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT cluster FROM pages WHERE content_hash = ? AND url != ? AND cluster != ? LIMIT 1',
+                (digest, url, url)
+            ).fetchone()
+            if row is None:
+                return None
+            self._record(url, digest, None, row[0], 'exact', 1.0)
+        return Duplicate('exact', row[0], 1.0)
+
+    def near_duplicate(self, url, html, text):
+        """
+        Check the text of a page that is not an exact duplicate against the
+        pages seen. Returns a Duplicate if another URL's text is at least
+        min_similarity alike, None otherwise. Records the page either way.
+        """
+        digest = content_hash(html)
+        features = shingle_hashes(text)
+        page_sketch = sketch(features) if len(features) >= self.min_shingles else None
+
+        with self._lock:
+            match = None
+            if page_sketch:
+                indexed = [_signed(value) for value in page_sketch[:INDEXED]]
+                rows = self.conn.execute(
+                    f"SELECT cluster, sketch FROM pages WHERE url IN ("
+                    f"SELECT DISTINCT url FROM minhashes WHERE value IN ({', '.join('?' * len(indexed))}) "
+                    f"AND url != ?) AND cluster != ?",
+                    (*indexed, url, url)
+                ).fetchall()
+                for cluster, other in rows:
+                    similarity = resemblance(page_sketch, _unpack(other))
+                    if similarity >= self.min_similarity and (match is None or similarity > match[1]):
+                        match = (cluster, similarity)
+
+            if match is None:
+                self._record(url, digest, page_sketch, url, None, None)
+                return None
+            self._record(url, digest, page_sketch, match[0], 'near', match[1])
+        return Duplicate('near', match[0], match[1])
+
+    def cluster(self, url):
+        """
+        URLs of the mirror cluster url belongs to (including url), or [url]
+        """
+        with self._lock:
+            row = self.conn.execute('SELECT cluster FROM pages WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return [url]
+            return [r[0] for r in self.conn.execute(
+                'SELECT url FROM pages WHERE cluster = ? ORDER BY seen_at', (row[0],)
+            )]
+
+    def priority(self, url):
+        """
+        Frontier priority adjustment for url, between -1 and 0: -1 for a
+        known duplicate, minus the share of duplicates among the pages of its
+        host once enough were seen, 0 otherwise
+        """
+        with self._lock:
+            row = self.conn.execute('SELECT duplicate FROM pages WHERE url = ?', (url,)).fetchone()
+            if row is not None and row[0] is not None:
+                return -1.0
+            pages, duplicates = self.conn.execute(
+                'SELECT COUNT(*), COUNT(duplicate) FROM pages WHERE host = ?', (url_host(url),)
+            ).fetchone()
+        if pages < self.mirror_host_pages:
+            return 0.0
+        return -duplicates / pages
+
+    def stats(self):
+        """
+        Number of pages seen, exact and near duplicates, and clusters with duplicates
+        """
+        with self._lock:
+            pages, exact, near = self.conn.execute(
+                "SELECT COUNT(*), COUNT(CASE duplicate WHEN 'exact' THEN 1 END), "
+                "COUNT(CASE duplicate WHEN 'near' THEN 1 END) FROM pages"
+            ).fetchone()
+            clusters = self.conn.execute(
+                'SELECT COUNT(DISTINCT cluster) FROM pages WHERE duplicate IS NOT NULL'
+            ).fetchone()[0]
+        return {'pages': pages, 'exact': exact, 'near': near, 'clusters': clusters}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,148 @@
+# HTML extraction backends - text, title and links from a page
+
+import re
+import logging
+from collections import namedtuple
+from bs4 import BeautifulSoup
+
+logger = logging.getLogger(__name__)
+
+# Plain-string result of extracting a page; holds no reference to a parse tree
+Extraction = namedtuple('Extraction', ['text', 'title', 'links'])
+
+# Elements whose content BeautifulSoup's get_text() leaves out
+SKIPPED_TAGS = ('script', 'style', 'template')
+
+# An HTML5 tree builder moves the text of a <noscript> in <head> into <body>
+# and merges it with the text after the element; the tags are swapped for a
+# private-use character first, and text nodes are split on it again, so the
+# two stay separate strings as with BeautifulSoup
+_NOSCRIPT_TAG = re.compile(r'</?noscript\b[^>]*>', re.IGNORECASE)
+_BOUNDARY = '\ue000'
+
+
+class BeautifulSoupExtractor:
+    """
+    Reference backend using BeautifulSoup's pure-Python html.parser
+    """
+    name = 'bs4'
+
+    def extract(self, html):
+        soup = BeautifulSoup(html, 'html.parser')
+        title = soup.title.string if soup.title else None
+        return Extraction(
+            text=soup.get_text(separator=' ', strip=True),
+            title=str(title) if title is not None else None,
+            links=[link['href'] for link in soup.find_all('a', href=True)],
+        )
+
+
+class SelectolaxExtractor:
+    """
+    Backend using selectolax's lexbor HTML5 parser (C)
+    """
+    name = 'selectolax'
+
+    def __init__(self):
+        from selectolax.lexbor import LexborHTMLParser
+        self._parser = LexborHTMLParser
+
+    def extract(self, html):
+        tree = self._parser(_NOSCRIPT_TAG.sub(_BOUNDARY, html))
+        title_node = tree.css_first('title')
+        links = [node.attributes.get('href') for node in tree.css('a[href]')]
+        tree.strip_tags(list(SKIPPED_TAGS))
+        strings = []
+        if tree.root is not None:
+            # Join stripped text nodes one by one: Node.text(strip=True) keeps
+            # whitespace-only nodes as extra separators, unlike get_text()
+            for node in tree.root.traverse(include_text=True):
+                if node.tag == '-text':
+                    for string in node.text_content.split(_BOUNDARY):
+                        string = string.strip()
+                        if string:
+                            strings.append(string)
+        return Extraction(
+            text=' '.join(strings),
+            title=title_node.text() if title_node is not None else None,
+            links=[href for href in links if href is not None],
+        )
+
+
+class LxmlExtractor:
+    """
+    Backend using lxml's libxml2 HTML parser (C)
+    """
+    name = 'lxml'
+
+    def __init__(self):
+        from lxml import etree
+        self._etree = etree
+
+    def extract(self, html):
+        etree = self._etree
+        # Parsed as bytes: lxml refuses a str that starts with an XML encoding
+        # declaration, as XHTML pages may. The parser is made per call because
+        # lxml parsers must not be shared between threads.
+        root = etree.HTML(html.encode('utf-8', errors='replace'), parser=etree.HTMLParser(encoding='utf-8'))
+        if root is None:
+            return Extraction(text='', title=None, links=[])
+
+        title_node = root.find('.//title')
+        links = [href for href in root.xpath('//a/@href')]
+        return Extraction(
+            text=' '.join(self._strings(root)),
+            title=title_node.text if title_node is not None else None,
+            links=[str(href) for href in links],
+        )
+
+    def _strings(self, root):
+        """
+        Stripped, non-empty text nodes of root in document order, leaving out
+        comments, processing instructions and SKIPPED_TAGS elements. The text
+        either side of a left-out node stays two strings, as with get_text().
+        """
+        skipped = 0  # Depth inside a left-out element
+        for event, node in self._etree.iterwalk(root, events=('start', 'end', 'comment', 'pi')):
+            if event == 'start':
+                if skipped or node.tag in SKIPPED_TAGS:
+                    skipped += 1
+                elif node.text and node.text.strip():
+                    yield node.text.strip()
+                continue
+            if event == 'end' and skipped:
+                skipped -= 1
+            # Comments and processing instructions only come as one event; their own text is left out
+            if not skipped and node is not root and node.tail and node.tail.strip():
+                yield node.tail.strip()
+
+
+# Fastest first
+BACKENDS = {
+    'selectolax': SelectolaxExtractor,
+    'lxml': LxmlExtractor,
+    'bs4': BeautifulSoupExtractor,
+}
+
+_default_extractor = None
+
+
+def get_extractor(name=None):
+    """
+    Return an extractor instance. With no name, the fastest installed backend
+    is picked (selectolax, then lxml) with BeautifulSoup as the fallback.
+    """
+    global _default_extractor
+
+    if name is not None:
+        return BACKENDS[name]()
+
+    if _default_extractor is None:
+        for backend in BACKENDS.values():
+            try:
+                _default_extractor = backend()
+                break
+            except ImportError:
+                continue
+        logger.debug(f"Using {_default_extractor.name} HTML extraction backend")
+    return _default_extractor
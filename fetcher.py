@@ -0,0 +1,168 @@
+# Fetcher - bounded HTTP fetches with pooled keep-alive connections, size caps and conditional requests
+
+import time
+import codecs
+import requests
+from collections import namedtuple
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+# Media types worth downloading; anything else (images, archives, binaries) is skipped
+TEXT_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain')
+
+# Largest response body read, in bytes (after content decoding)
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+
+# Result of a fetch. text is None when the server answered 304 Not Modified;
+# retry_after is the delay in seconds a 429 or 503 response asked for, if any;
+# size is the number of body bytes downloaded
+FetchResult = namedtuple('FetchResult', ['url', 'status', 'text', 'etag', 'last_modified', 'not_modified',
+                                         'retry_after', 'size'])
+
+
+class FetchError(Exception):
+    """
+    A response was abandoned before or while its body was downloaded
+    """
+
+
+class UnsupportedContentType(FetchError):
+    pass
+
+
+class ResponseTooLarge(FetchError):
+    pass
+
+
+class FetchTimeout(FetchError):
+    pass
+
+
+def media_type(content_type):
+    """
+    Lowercased media type of a Content-Type header value, without parameters
+    """
+    return (content_type or '').split(';', 1)[0].strip().lower()
+
+
+def allowed_content_type(content_type, allowed=TEXT_CONTENT_TYPES):
+    """
+    True if a Content-Type header value names one of the allowed media types.
+    Responses that do not declare a type are allowed.
+    """
+    return not media_type(content_type) or media_type(content_type) in allowed
+
+
+def charset(content_type, default='utf-8'):
+    """
+    Character set declared in a Content-Type header value, or default if it
+    declares none or one Python does not know
+    """
+    for param in (content_type or '').split(';')[1:]:
+        key, _, value = param.partition('=')
+        if key.strip().lower() == 'charset' and value.strip():
+            try:
+                return codecs.lookup(value.strip().strip('"\'')).name
+            except LookupError:
+                break
+    return default
+
+
+def retry_after(value):
+    """
+    Seconds to wait from a Retry-After header value (delay or HTTP date), or None
+    """
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value.strip())
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Fetcher:
+    """
+    Fetches pages with bounded time and memory. Connections are kept alive
+    in per-host pools; bodies are streamed and abandoned once they pass
+    max_bytes or max_time, and responses of other media types than
+    content_types are closed before their body is read. Revisits send
+    If-None-Match / If-Modified-Since so unchanged pages cost a 304.
+    """
+
+    def __init__(self, session=None, pool_connections=10, pool_maxsize=4, connect_timeout=30,
+                 read_timeout=60, max_time=120, max_bytes=DEFAULT_MAX_BYTES,
+                 content_types=TEXT_CONTENT_TYPES, validators=None, chunk_size=64 * 1024):
+        """
+        Args:
+            session: requests Session to send requests with (its proxies are kept)
+            pool_connections: Number of per-host connection pools kept open
+            pool_maxsize: Keep-alive connections kept per host
+            connect_timeout: Seconds allowed to establish a connection
+            read_timeout: Seconds allowed between bytes received
+            max_time: Total seconds allowed for downloading a response
+            max_bytes: Largest response body read, in bytes
+            content_types: Media types whose bodies are downloaded
+            validators: Optional function url -> (etag, last_modified) of the
+                        last stored fetch, used for conditional requests
+            chunk_size: Bytes read from the socket at a time
+        """
+        self.session = session or requests.session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_time = max_time
+        self.max_bytes = max_bytes
+        self.content_types = content_types
+        self.validators = validators
+        self.chunk_size = chunk_size
+
+    def _conditional_headers(self, url):
+        if self.validators is None:
+            return {}
+        etag, last_modified = self.validators(url) or (None, None)
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def fetch(self, url, proxies=None):
+        """
+        GET url and return a FetchResult
+
+        Raises UnsupportedContentType, ResponseTooLarge or FetchTimeout if the
+        body is refused, and requests exceptions for transport errors.
+        """
+        start = time.monotonic()
+        with self.session.get(url, headers=self._conditional_headers(url), proxies=proxies,
+                              timeout=self.timeout, stream=True) as response:
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if response.status_code == 304:
+                return FetchResult(url, 304, None, etag, last_modified, True, None, 0)
+            if response.status_code >= 400:
+                # Error pages are not worth downloading
+                return FetchResult(url, response.status_code, '', etag, last_modified, False,
+                                   retry_after(response.headers.get('Retry-After')), 0)
+
+            content_type = response.headers.get('Content-Type')
+            if not allowed_content_type(content_type, self.content_types):
+                raise UnsupportedContentType(f"Skipping {media_type(content_type)} response")
+            length = response.headers.get('Content-Length', '')
+            if length.isdigit() and int(length) > self.max_bytes:
+                raise ResponseTooLarge(f"Response of {length} bytes exceeds {self.max_bytes}")
+
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                body += chunk
+                if len(body) > self.max_bytes:
+                    raise ResponseTooLarge(f"Response exceeds {self.max_bytes} bytes")
+                if time.monotonic() - start > self.max_time:
+                    raise FetchTimeout(f"Response took longer than {self.max_time} seconds")
+
+        text = body.decode(charset(content_type), errors='replace')
+        return FetchResult(url, response.status_code, text, etag, last_modified, False, None, len(body))
@@ -0,0 +1,273 @@
+# Crawl frontier - persistent, resumable URL queue with a compact visited set
+
+import os
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from links import normalize_url  # URL canonicalization shared with link extraction
+
+logger = logging.getLogger(__name__)
+
+
+def url_fingerprint(url):
+    """
+    64-bit fingerprint of the normalized URL, as a signed integer so it fits
+    an SQLite INTEGER column
+    """
+    digest = hashlib.blake2b(normalize_url(url).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over 64-bit fingerprints. Memory depends only on
+    the configured capacity, never on how many URLs have been seen.
+    """
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, fingerprint):
+        # Double hashing: derive k bit positions from the two halves of the fingerprint
+        value = fingerprint & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = value >> 32, (value & 0xFFFFFFFF) | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, fingerprint):
+        for pos in self._positions(fingerprint):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, fingerprint):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(fingerprint))
+
+
+class CrawlFrontier:
+    """
+    Crawl frontier backed by SQLite so a crawl can resume after a crash.
+
+    Every URL ever queued is kept on disk keyed by its fingerprint, which doubles
+    as the visited set; an in-memory Bloom filter answers most "seen before?"
+    checks without touching the database.
+    """
+
+    PENDING = 'pending'
+    IN_PROGRESS = 'in_progress'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, db_path='data/frontier.db', max_depth=2, max_pages=100,
+                 bloom_capacity=1_000_000, error_rate=0.001):
+        """
+        Args:
+            db_path: SQLite file holding the queue and visited fingerprints
+            max_depth: Links further than this many hops from a seed are not queued
+            max_pages: Stop handing out URLs once this many pages were fetched
+            bloom_capacity: Expected number of distinct URLs (sizes the Bloom filter)
+            error_rate: Target false positive rate of the Bloom filter
+        """
+        self.db_path = db_path
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self._lock = threading.Lock()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS frontier (
+                fingerprint INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                depth INTEGER NOT NULL,
+                priority REAL NOT NULL DEFAULT 0,
+                state TEXT NOT NULL,
+                added_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                not_before REAL NOT NULL DEFAULT 0
+            )
+        """)
+        # Frontiers created before retries were scheduled lack their columns
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(frontier)')}
+        for column, definition in (('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+                                   ('not_before', 'REAL NOT NULL DEFAULT 0')):
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE frontier ADD COLUMN {column} {definition}')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS frontier_pending ON frontier (state, priority DESC, added_at)'
+        )
+        # URLs that were being fetched when the last run died go back on the queue
+        resumed = self.conn.execute(
+            'UPDATE frontier SET state = ? WHERE state = ?', (self.PENDING, self.IN_PROGRESS)
+        ).rowcount
+        self.conn.commit()
+        self.claimed = self.conn.execute(
+            'SELECT COUNT(*) FROM frontier WHERE state IN (?, ?)', (self.DONE, self.FAILED)
+        ).fetchone()[0]
+        if resumed:
+            logger.info(f"Requeued {resumed} URLs interrupted by the previous run")
+
+        # Rebuild the Bloom filter from the stored fingerprints
+        self.seen = BloomFilter(bloom_capacity, error_rate)
+        for (fingerprint,) in self.conn.execute('SELECT fingerprint FROM frontier'):
+            self.seen.add(fingerprint)
+
+    def _is_known(self, fingerprint):
+        if fingerprint not in self.seen:
+            return False
+        # Possible Bloom false positive: confirm against the database
+        row = self.conn.execute(
+            'SELECT 1 FROM frontier WHERE fingerprint = ?', (fingerprint,)
+        ).fetchone()
+        return row is not None
+
+    def _add(self, url, depth, priority):
+        if depth > self.max_depth:
+            return False
+        fingerprint = url_fingerprint(url)
+        if self._is_known(fingerprint):
+            return False
+        if callable(priority):
+            priority = priority(url)
+        self.conn.execute(
+            'INSERT INTO frontier (fingerprint, url, depth, priority, state, added_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (fingerprint, normalize_url(url), depth, priority, self.PENDING, time.time())
+        )
+        self.seen.add(fingerprint)
+        return True
+
+    def add(self, url, depth=0, priority=0.0):
+        """
+        Queue a URL unless it was seen before or is beyond max_depth.
+        Returns True if the URL was queued.
+        """
+        with self._lock:
+            added = self._add(url, depth, priority)
+            self.conn.commit()
+            return added
+
+    def add_many(self, urls, depth=0, priority=0.0):
+        """
+        Queue several URLs at the same depth in one transaction. priority may
+        be a function of the URL, called for new URLs only.
+        Returns the number of URLs queued.
+        """
+        with self._lock:
+            added = sum(1 for url in urls if self._add(url, depth, priority))
+            self.conn.commit()
+            return added
+
+    def pop(self):
+        """
+        Take the highest priority pending URL that is due and mark it in progress.
+        Returns (url, depth), or None when no URL is due or max_pages is reached.
+        """
+        with self._lock:
+            if self.max_pages is not None and self.claimed >= self.max_pages:
+                return None
+            row = self.conn.execute(
+                'SELECT fingerprint, url, depth FROM frontier WHERE state = ? AND not_before <= ? '
+                'ORDER BY priority DESC, added_at LIMIT 1', (self.PENDING, time.time())
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                'UPDATE frontier SET state = ? WHERE fingerprint = ?', (self.IN_PROGRESS, row[0])
+            )
+            self.conn.commit()
+            self.claimed += 1
+            return row[1], row[2]
+
+    def _set_state(self, url, state):
+        with self._lock:
+            self.conn.execute(
+                'UPDATE frontier SET state = ? WHERE fingerprint = ?', (state, url_fingerprint(url))
+            )
+            self.conn.commit()
+
+    def mark_done(self, url):
+        """
+        Record that a URL was fetched
+        """
+        self._set_state(url, self.DONE)
+
+    def mark_failed(self, url):
+        """
+        Record that fetching a URL failed
+        """
+        self._set_state(url, self.FAILED)
+
+    def _requeue(self, url, not_before, attempts):
+        with self._lock:
+            self.conn.execute(
+                'UPDATE frontier SET state = ?, not_before = ?, attempts = attempts + ? WHERE fingerprint = ?',
+                (self.PENDING, not_before, attempts, url_fingerprint(url))
+            )
+            self.conn.commit()
+            self.claimed -= 1  # It does not count towards max_pages until it is fetched
+
+    def defer(self, url, not_before):
+        """
+        Put a popped URL back on the queue, due at Unix time not_before, without
+        counting an attempt (e.g. because its host is known to be down)
+        """
+        self._requeue(url, not_before, 0)
+
+    def retry(self, url, not_before):
+        """
+        Put a URL whose fetch failed back on the queue, due at Unix time not_before
+        """
+        self._requeue(url, not_before, 1)
+
+    def attempts(self, url):
+        """
+        Number of times a URL was retried so far
+        """
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT attempts FROM frontier WHERE fingerprint = ?', (url_fingerprint(url),)
+            ).fetchone()
+            return row[0] if row is not None else 0
+
+    def next_ready_at(self):
+        """
+        Unix time the earliest pending URL is due, or None if none is pending
+        or max_pages is reached
+        """
+        with self._lock:
+            if self.max_pages is not None and self.claimed >= self.max_pages:
+                return None
+            return self.conn.execute(
+                'SELECT MIN(not_before) FROM frontier WHERE state = ?', (self.PENDING,)
+            ).fetchone()[0]
+
+    def restart(self):
+        """
+        Start a new crawl cycle over the URLs seen so far: fetched and failed
+        URLs go back on the queue with their retry count reset, and the
+        max_pages budget starts over. Returns the number of URLs requeued.
+        """
+        with self._lock:
+            requeued = self.conn.execute(
+                'UPDATE frontier SET state = ?, attempts = 0, not_before = 0 WHERE state IN (?, ?)',
+                (self.PENDING, self.DONE, self.FAILED)
+            ).rowcount
+            self.conn.commit()
+            self.claimed = 0
+            return requeued
+
+    def pending_count(self):
+        """
+        Number of URLs still waiting to be fetched
+        """
+        with self._lock:
+            return self.conn.execute(
+                'SELECT COUNT(*) FROM frontier WHERE state = ?', (self.PENDING,)
+            ).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
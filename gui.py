@@ -2,14 +2,26 @@ import tkinter as tk
 from tkinter import scrolledtext, ttk, messagebox
 from threading import Thread
 import time
-import json
 import os
-import base64
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+import logging
+from dotenv import load_dotenv  # For loading environment variables from .env file
 from crawler import DarkWebCrawler, read_urls_from_file
 from parser import Parser
+from page_store import PageStore
+from results_index import ResultsIndex
+from pipeline import CrawlPipeline
+from host_health import HostHealth, url_host
+from dedup import MirrorIndex
+from matcher import FIELD_MODES
+from term_store import TermStore, load_fernet
+from text_index import TextIndex
+from log_queue import LogQueue, page_summary
+
+# Log lines kept in the output area; older lines scroll out
+MAX_LOG_LINES = 5000
+# Milliseconds between log queue drains, and most lines shown per drain
+LOG_POLL_MS = 100
+LOG_BATCH = 500
 
 class DarkWebGUI:
     def __init__(self, master):
@@ -19,6 +31,9 @@ class DarkWebGUI:
         # Initialize encryption
         self._setup_encryption()
 
+        # Open the page store
+        self._setup_page_store()
+
         # Create notebook for tabs
         self.notebook = ttk.Notebook(master)
         self.notebook.pack(fill='both', expand=True, padx=10, pady=5)
@@ -40,23 +55,32 @@ class DarkWebGUI:
         # Setup comparison tab
         self._setup_comparison_tab()
 
-        # For capturing and showing logs
+        # Worker threads queue log lines; the Tk main loop shows them in batches
+        self.log_queue = LogQueue()
+        self.master.after(LOG_POLL_MS, self._drain_log)
         self.log("GUI initialized. Ready.")
 
     def _setup_encryption(self):
-        # Create user_data directory if it doesn't exist
-        os.makedirs('user_data', exist_ok=True)
+        # Load the encryption key, creating one on first run
+        self.fernet = load_fernet('user_data/.encryption_key')
+
+        # Identities to monitor, encrypted per record and decrypted on demand
+        self.term_store = TermStore(self.fernet, 'user_data/terms.db')
 
-        # Check if encryption key exists, if not create one
-        key_file = 'user_data/.encryption_key'
-        if not os.path.exists(key_file):
-            key = Fernet.generate_key()
-            with open(key_file, 'wb') as f:
-                f.write(key)
+        # Carry over the single identity saved before the term store existed
+        if self.term_store.count() == 0:
+            self.term_store.import_legacy_file('user_data/sensitive_info.enc')
 
-        # Load encryption key
-        with open(key_file, 'rb') as f:
-            self.fernet = Fernet(f.read())
+    def _setup_page_store(self):
+        self.page_store = PageStore('data/pages.db')
+        self.results_index = ResultsIndex('data/results.db')
+        self.host_health = HostHealth('data/hosts.db')
+        self.mirror_index = MirrorIndex('data/mirrors.db')
+        self.text_index = TextIndex('data/text_index')
+
+        # Carry over pages scraped before the page store existed
+        if self.page_store.count() == 0 and os.path.exists('text.txt'):
+            self.page_store.import_text_file('text.txt')
 
     def _setup_scraper_tab(self):
         # Scrollable text area for logs and output
@@ -109,6 +133,13 @@ class DarkWebGUI:
         comparison_frame = ttk.Frame(self.comparison_tab)
         comparison_frame.pack(padx=20, pady=20, fill='both', expand=True)
 
+        # Optional time window for the comparison
+        recent_frame = ttk.Frame(comparison_frame)
+        recent_frame.pack(pady=5)
+        ttk.Label(recent_frame, text="Only matches from the last N days (blank for all)").pack(side='left', padx=5)
+        self.recent_days = ttk.Entry(recent_frame, width=6)
+        self.recent_days.pack(side='left')
+
         # Add compare button
         compare_button = ttk.Button(comparison_frame, text="Compare Data", command=self.compare_data)
         compare_button.pack(pady=10)
@@ -119,81 +150,110 @@ class DarkWebGUI:
 
     def compare_data(self):
         try:
-            # Load sensitive data
-            with open('user_data/sensitive_info.enc', 'rb') as f:
-                encrypted_data = f.read()
-            decrypted_data = self.fernet.decrypt(encrypted_data)
-            sensitive_data = json.loads(decrypted_data.decode())
+            # Sensitive fields of every identity, decrypted once and cached by the store
+            sensitive_fields = self.term_store.fields()
+            if not sensitive_fields:
+                raise FileNotFoundError("No identities saved")
 
-            # Load parsed data
-            if not os.path.exists('results.txt'):
-                messagebox.showerror("Error", "No parsed data found. Please run the parser first.")
-                return
-
-            with open('results.txt', 'r') as f:
-                parsed_data = f.read().lower()  # Convert parsed data to lowercase
+            # Only report matches seen in the last N days, if a number was given
+            days = self.recent_days.get().strip()
+            recent = None
+            if days:
+                recent = self.results_index.terms_seen_since(time.time() - float(days) * 86400)
 
             # Clear previous results
             self.comparison_results.delete(1.0, tk.END)
             self.comparison_results.insert(tk.END, "=== Data Comparison Results ===\n\n")
 
-            # Compare each sensitive field
+            # Look each sensitive field up in the parser's hit index
             matches_found = False
-            for field, value in sensitive_data.items():
-                if value:
-                    # Convert value to lowercase for case-insensitive comparison
-                    value_lower = value.lower()
-                    if value_lower in parsed_data:
-                        matches_found = True
-                        self.comparison_results.insert(tk.END, f"⚠️ MATCH FOUND: {field}\n")
-                        self.comparison_results.insert(tk.END, f"Value: {value}\n")
-                        self.comparison_results.insert(tk.END, f"Found in parsed data.\n\n")
+            for _, name, field, value in sensitive_fields:
+                field_id = self.term_store.term_id(value)
+                stats = self.results_index.term_stats(field_id)
+                if stats is None or (recent is not None and field_id not in recent):
+                    continue
+                matches_found = True
+                label = f"{field} ({name})" if name else field
+                self.comparison_results.insert(tk.END, f"⚠️ MATCH FOUND: {label}\n")
+                self.comparison_results.insert(tk.END, f"Value: {value}\n")
+                self.comparison_results.insert(
+                    tk.END, f"Found {stats['hits']} times on {stats['pages']} pages "
+                            f"(first seen {time.ctime(stats['first_seen'])}, "
+                            f"last seen {time.ctime(stats['last_seen'])}).\n\n")
 
             if not matches_found:
                 self.comparison_results.insert(tk.END, "✅ No matches found in parsed data.\n")
 
         except FileNotFoundError:
             messagebox.showerror("Error", "No sensitive data found. Please save your data first.")
+        except ValueError:
+            messagebox.showerror("Error", "Number of days must be a number.")
         except Exception as e:
             messagebox.showerror("Error", f"Error during comparison: {str(e)}")
 
     def save_user_data(self):
         data = {field: entry.get() for field, entry in self.fields.items()}
 
-        # Convert data to JSON string
-        json_data = json.dumps(data)
+        # The form edits the first identity; more can be added with term_store.py import
+        ids = self.term_store.ids()
+        identity = self.term_store.get(ids[0]) if ids else None
+        self.term_store.put(data, name=identity['name'] if identity else 'default',
+                            identity_id=ids[0] if ids else None)
 
-        # Encrypt the data
-        encrypted_data = self.fernet.encrypt(json_data.encode())
+        messagebox.showinfo("Success", "User data saved securely!")
 
-        # Save encrypted data
-        with open('user_data/sensitive_info.enc', 'wb') as f:
-            f.write(encrypted_data)
+        # Look new values up in every page crawled so far, without waiting for the next parser run
+        # Values are stripped as TermStore.fields() strips them for matching
+        old_fields = identity['fields'] if identity else {}
+        changed = {field: value.strip() for field, value in data.items()
+                   if value.strip() and value.strip() != (old_fields.get(field) or '').strip()}
+        if changed:
+            Thread(target=self._check_new_terms, args=(changed,)).start()
 
-        messagebox.showinfo("Success", "User data saved securely!")
+    def _check_new_terms(self, fields):
+        try:
+            parser = Parser(text_filepath=None, user_data=[], page_store=self.page_store,
+                            text_index=self.text_index)
+            for field, value in fields.items():
+                records = parser.search((value, FIELD_MODES.get(field, 'exact')))
+                pages = {record['page_id'] for record in records}
+                if pages:
+                    self.log(f"⚠️ {field} already appears {len(records)} times on {len(pages)} crawled pages")
+                else:
+                    self.log(f"{field} not found in crawled pages")
+        except Exception as e:
+            self.log(f"Lookup error: {str(e)}")
 
     def load_user_data(self):
         try:
-            with open('user_data/sensitive_info.enc', 'rb') as f:
-                encrypted_data = f.read()
-
-            # Decrypt the data
-            decrypted_data = self.fernet.decrypt(encrypted_data)
-            data = json.loads(decrypted_data.decode())
+            ids = self.term_store.ids()
+            if not ids:
+                return  # No existing data to load
 
-            # Populate fields
-            for field, value in data.items():
+            # Populate fields from the first identity
+            for field, value in self.term_store.get(ids[0])['fields'].items():
                 if field in self.fields:
                     self.fields[field].insert(0, value)
-        except FileNotFoundError:
-            pass  # No existing data to load
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load encrypted data: {str(e)}")
 
     def log(self, message):
-        self.output_area.insert(tk.END, message + "\n")
-        self.output_area.see(tk.END)
-        self.output_area.update()
+        # Safe from any thread: Tk widgets are only touched by _drain_log
+        self.log_queue.put(message)
+
+    def _drain_log(self):
+        lines, dropped = self.log_queue.drain(LOG_BATCH)
+        if dropped:
+            lines.insert(0, f"[{dropped} log lines dropped]")
+        if lines:
+            self.output_area.insert(tk.END, "\n".join(lines) + "\n")
+            # Keep only the last MAX_LOG_LINES lines
+            excess = int(self.output_area.index('end-1c').split('.')[0]) - 1 - MAX_LOG_LINES
+            if excess > 0:
+                self.output_area.delete('1.0', f'{excess + 1}.0')
+            self.output_area.see(tk.END)
+        # Come back sooner while a backlog is waiting
+        self.master.after(1 if len(self.log_queue) else LOG_POLL_MS, self._drain_log)
 
     def start_scraping(self):
         thread = Thread(target=self._scrape)
@@ -201,7 +261,9 @@ class DarkWebGUI:
 
     def _scrape(self):
         self.log("Initializing crawler...")
-        crawler = DarkWebCrawler()
+        # Pages already in the store are revisited with conditional requests
+        # Pages mirroring one already crawled are skipped
+        crawler = DarkWebCrawler(page_store=self.page_store, mirror_index=self.mirror_index)
         crawler.log_callback = self.log  # Inject log method into crawler
 
         if not crawler.connect_to_tor():
@@ -213,18 +275,41 @@ class DarkWebGUI:
             self.log("No URLs found in urls.txt.")
             return
 
+        # Match pages against the saved user data as they are fetched
+        try:
+            user_data_list = self._load_user_data_list()
+        except FileNotFoundError:
+            user_data_list = []
+        pipeline = CrawlPipeline(self.page_store, user_data_list, self.results_index,
+                                 text_index=self.text_index, id_key=self.term_store.id_key)
+
         self.log(f"Found {len(urls)} URLs. Beginning crawl...\n")
 
         for url in urls:
-            result = crawler.crawl_onion(url)
+            # Hosts that kept failing are left alone until their cool-down ends
+            host = url_host(url)
+            if not self.host_health.allow(host):
+                self.log(f"Skipping {url}: host unreachable on recent runs, "
+                         f"next try after {time.ctime(self.host_health.retry_at(host))}")
+                continue
+            result, failure = crawler.fetch_onion(url)
+            self.host_health.record(host, failure)
             if result:
-                self.log(f"--- Content from {url} ---")
-                self.log(result.get("raw_html", "[No HTML returned]"))
-                with open("text.txt", "a", encoding="utf-8") as f:
-                    f.write(result.get("raw_html", "") + "\n\n")
+                self.log(page_summary(result))
+                _, hits = pipeline.process(result)
+                if hits:
+                    self.log(f"{len(hits)} user data matches on {url}")
             time.sleep(3)
 
-        self.log("Crawling completed. Raw HTML saved to text.txt")
+        self.text_index.flush()
+        self.log("Crawling completed. Pages saved to data/pages.db")
+
+    def _load_user_data_list(self):
+        # Terms of every identity, each paired with the way its field is matched
+        terms = self.term_store.terms()
+        if not terms:
+            raise FileNotFoundError("No identities saved")
+        return terms
 
     def run_parser(self):
         thread = Thread(target=self._parse)
@@ -234,24 +319,27 @@ class DarkWebGUI:
         try:
             self.log("Initializing parser...")
 
-            # Load decrypted user data from the encrypted file
-            with open('user_data/sensitive_info.enc', 'rb') as f:
-                encrypted_data = f.read()
-            decrypted_data = self.fernet.decrypt(encrypted_data)
-            sensitive_data = json.loads(decrypted_data.decode())
-
-            # Convert values to list and clean them
-            user_data_list = [v.strip() for v in sensitive_data.values() if v.strip()]
+            # Fails early if no identity is saved
+            self._load_user_data_list()
 
-            parser = Parser(text_filepath='text.txt', user_data=user_data_list)
-            parser.parse(results_filepath='results.txt')
+            # Terms come from the store, whose compiled matcher is reused until they change
+            parser = Parser(text_filepath=None, user_data=[], page_store=self.page_store,
+                            workers=os.cpu_count(), term_store=self.term_store, text_index=self.text_index)
+            # Only pages added or changed since the last run are scanned
+            parser.parse_incremental(self.results_index, results_filepath='results.jsonl')
 
-            self.log("Parser complete. Results written to results.txt")
+            self.log("Parser complete. Results written to results.jsonl")
         except Exception as e:
             self.log(f"Parser error: {str(e)}")
 
 
 if __name__ == "__main__":
+    load_dotenv()
+    # Crawler and parser modules log to the console as well as to the GUI
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
     root = tk.Tk()
     gui = DarkWebGUI(root)
     root.mainloop()
@@ -0,0 +1,322 @@
+# Host health - failure classification, retry backoff and per-host circuit breakers that persist across runs
+
+import os
+import time
+import random
+import sqlite3
+import threading
+import logging
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Failure kinds
+TIMEOUT = 'timeout'
+SOCKS = 'socks'
+CONNECTION = 'connection'
+SERVER_ERROR = 'http_5xx'
+RATE_LIMITED = 'http_429'
+HTTP_ERROR = 'http_error'  # Any other unsuccessful status, e.g. 404
+SKIPPED = 'skipped'        # Response refused by the fetcher (binary, too large)
+ERROR = 'error'            # Anything else
+
+# Failures worth trying again later
+RETRYABLE = frozenset((TIMEOUT, SOCKS, CONNECTION, SERVER_ERROR, RATE_LIMITED))
+# Failures that say the host itself is unreachable or broken
+HOST_FAILURES = frozenset((TIMEOUT, SOCKS, CONNECTION, SERVER_ERROR))
+
+# Why a fetch failed. retry_after is the delay the server asked for, if any
+Failure = namedtuple('Failure', ['kind', 'message', 'retry_after'])
+
+
+def _causes(error):
+    """
+    The error and every exception it wraps, through __cause__, __context__,
+    urllib3's reason attribute and exception arguments
+    """
+    seen = set()
+    pending = [error]
+    while pending:
+        error = pending.pop(0)
+        if error is None or id(error) in seen:
+            continue
+        seen.add(id(error))
+        yield error
+        pending += [error.__cause__, error.__context__]
+        # reason is an exception for urllib3 errors, but a plain string for ssl errors
+        pending += [cause for cause in (getattr(error, 'reason', None),) + tuple(error.args)
+                    if isinstance(cause, BaseException)]
+
+
+def classify_error(error):
+    """
+    Failure kind of an exception raised while fetching: SOCKS (the proxy
+    could not reach the host, as Tor reports dead hidden services),
+    TIMEOUT, CONNECTION or ERROR
+    """
+    causes = list(_causes(error))
+    if any('socks' in f"{type(cause).__module__}.{type(cause).__name__}".lower()
+           or 'socks' in str(cause).lower() for cause in causes):
+        return SOCKS
+    if any(isinstance(cause, TimeoutError) or 'Timeout' in type(cause).__name__ for cause in causes):
+        return TIMEOUT
+    if any(isinstance(cause, ConnectionError) or 'Connection' in type(cause).__name__ for cause in causes):
+        return CONNECTION
+    return ERROR
+
+
+def classify_status(status):
+    """
+    Failure kind of an unsuccessful HTTP status
+    """
+    if status == 429:
+        return RATE_LIMITED
+    if status >= 500:
+        return SERVER_ERROR
+    return HTTP_ERROR
+
+
+def backoff_delay(attempt, base_delay=5.0, max_delay=600.0):
+    """
+    Seconds to wait before retry number attempt (1 for the first retry):
+    exponential backoff with full jitter, so retries of many URLs that
+    failed together do not all come back at once
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def url_host(url):
+    return (urlsplit(url).hostname or '').lower()
+
+
+class HostHealth:
+    """
+    Circuit breaker per host, stored in SQLite so dead hosts stay known
+    across runs.
+
+    A host starts closed (requests allowed). After failure_threshold
+    consecutive host failures it opens for a cool-down during which its URLs
+    are deferred without a request. When the cool-down ends a single probe
+    request is let through (half-open): success closes the breaker, failure
+    opens it again for twice as long, up to max_cooldown.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, db_path='data/hosts.db', failure_threshold=3, cooldown=300.0,
+                 max_cooldown=86400.0, probe_wait=10.0):
+        """
+        Args:
+            db_path: SQLite file holding the breaker state of every host
+            failure_threshold: Consecutive failures that open a host's breaker
+            cooldown: Seconds a breaker first stays open
+            max_cooldown: Longest a breaker stays open after repeated failed probes
+            probe_wait: Seconds other URLs of a host wait while its probe is running
+        """
+        self.db_path = db_path
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_wait = probe_wait
+        self._probing = set()  # Hosts with a half-open probe in flight in this process
+        self._lock = threading.Lock()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS hosts (
+                host TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                consecutive_failures INTEGER NOT NULL DEFAULT 0,
+                total_failures INTEGER NOT NULL DEFAULT 0,
+                open_until REAL NOT NULL DEFAULT 0,
+                cooldown REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                last_failure REAL,
+                last_success REAL
+            )
+        """)
+        self.conn.commit()
+
+    def _row(self, host):
+        return self.conn.execute(
+            'SELECT state, consecutive_failures, open_until, cooldown FROM hosts WHERE host = ?', (host,)
+        ).fetchone()
+
+    def allow(self, host):
+        """
+        True if a request to host may go out now. Returns True once for a
+        host whose cool-down has ended, as its probe.
+        """
+        with self._lock:
+            row = self._row(host)
+            if row is None or row[0] == self.CLOSED:
+                return True
+            if host in self._probing or time.time() < row[2]:
+                return False
+            self._probing.add(host)
+            self.conn.execute('UPDATE hosts SET state = ? WHERE host = ?', (self.HALF_OPEN, host))
+            self.conn.commit()
+            return True
+
+    def retry_at(self, host):
+        """
+        Unix time at which host may be tried again
+        """
+        with self._lock:
+            row = self._row(host)
+            now = time.time()
+            if row is None or row[0] == self.CLOSED:
+                return now
+            if host in self._probing:
+                return now + self.probe_wait
+            return max(now, row[2])
+
+    def record_success(self, host):
+        """
+        Record that host answered; closes its breaker
+        """
+        with self._lock:
+            self._probing.discard(host)
+            self.conn.execute(
+                'INSERT INTO hosts (host, state, last_success) VALUES (?, ?, ?) '
+                'ON CONFLICT (host) DO UPDATE SET state = excluded.state, consecutive_failures = 0, '
+                'open_until = 0, cooldown = 0, last_success = excluded.last_success',
+                (host, self.CLOSED, time.time())
+            )
+            self.conn.commit()
+
+    def record_failure(self, host, failure):
+        """
+        Record a failed request to host and open its breaker if needed.
+        Rate limiting opens it for the delay the server asked for.
+        Returns the Unix time the host may be tried again.
+        """
+        with self._lock:
+            was_probe = host in self._probing
+            self._probing.discard(host)
+            now = time.time()
+            row = self._row(host) or (self.CLOSED, 0, 0.0, 0.0)
+            state, failures, open_until, cooldown = row
+            failures += 1
+
+            if failure.kind == RATE_LIMITED:
+                state, open_until = self.OPEN, now + (failure.retry_after or self.cooldown)
+            elif was_probe or state == self.HALF_OPEN:
+                cooldown = min(self.max_cooldown, max(cooldown, self.cooldown) * 2)
+                state, open_until = self.OPEN, now + cooldown
+            elif failures >= self.failure_threshold:
+                cooldown = self.cooldown
+                state, open_until = self.OPEN, now + cooldown
+                logger.info(f"{host} failed {failures} times in a row, deferring it for {cooldown:.0f} s")
+
+            self.conn.execute(
+                'INSERT INTO hosts (host, state, consecutive_failures, total_failures, open_until, cooldown, '
+                'last_error, last_failure) VALUES (?, ?, ?, 1, ?, ?, ?, ?) '
+                'ON CONFLICT (host) DO UPDATE SET state = excluded.state, '
+                'consecutive_failures = excluded.consecutive_failures, total_failures = total_failures + 1, '
+                'open_until = excluded.open_until, cooldown = excluded.cooldown, '
+                'last_error = excluded.last_error, last_failure = excluded.last_failure',
+                (host, state, failures, open_until, cooldown, failure.kind, now)
+            )
+            self.conn.commit()
+            return max(now, open_until)
+
+    def record(self, host, failure=None):
+        """
+        Record the outcome of a request to host: success if failure is None
+        or says the host answered (e.g. a 404), a host failure otherwise.
+        Returns the Unix time the host may be tried again.
+        """
+        if failure is not None and (failure.kind in HOST_FAILURES or failure.kind == RATE_LIMITED):
+            return self.record_failure(host, failure)
+        self.record_success(host)
+        return time.time()
+
+    def stats(self):
+        """
+        Number of hosts in each breaker state
+        """
+        with self._lock:
+            return dict(self.conn.execute('SELECT state, COUNT(*) FROM hosts GROUP BY state').fetchall())
+
+    def close(self):
+        self.conn.close()
+
+
+class RetryScheduler:
+    """
+    Hands out frontier URLs whose host is healthy and settles the outcome of
+    each fetch. URLs of hosts with an open breaker go back on the frontier
+    until the host may be tried again, without a request. Retryable failures
+    are requeued with jittered exponential backoff, up to max_retries times.
+    """
+
+    def __init__(self, frontier, health=None, max_retries=3, base_delay=5.0, max_delay=600.0):
+        """
+        Args:
+            frontier: CrawlFrontier to take URLs from
+            health: Optional HostHealth; without one no host is ever deferred
+            max_retries: Times a URL is retried after a retryable failure
+            base_delay: Backoff before the first retry, in seconds
+            max_delay: Longest backoff; URLs not due within it end the crawl
+                       and are picked up by the next run
+        """
+        self.frontier = frontier
+        self.health = health
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def next(self):
+        """
+        Take the next URL that may be fetched now, as (url, depth), or None
+        """
+        while True:
+            item = self.frontier.pop()
+            if item is None or self.health is None:
+                return item
+            host = url_host(item[0])
+            if self.health.allow(host):
+                return item
+            self.frontier.defer(item[0], self.health.retry_at(host))
+
+    def wait_time(self):
+        """
+        Seconds until the next deferred URL is due, or None if no URL is due
+        within max_delay (or none is left)
+        """
+        ready_at = self.frontier.next_ready_at()
+        if ready_at is None:
+            return None
+        wait = max(0.0, ready_at - time.time())
+        return wait if wait <= self.max_delay else None
+
+    def succeeded(self, url):
+        self.frontier.mark_done(url)
+        if self.health is not None:
+            self.health.record_success(url_host(url))
+
+    def failed(self, url, failure):
+        """
+        Settle a failed fetch: requeue it with backoff if the failure is
+        retryable and retries are left, otherwise mark it failed
+        """
+        retry_at = time.time()
+        if self.health is not None:
+            retry_at = self.health.record(url_host(url), failure)
+
+        attempt = self.frontier.attempts(url) + 1
+        if failure.kind not in RETRYABLE or attempt > self.max_retries:
+            self.frontier.mark_failed(url)
+            return
+
+        delay = failure.retry_after or backoff_delay(attempt, self.base_delay, self.max_delay)
+        retry_at = max(retry_at, time.time() + delay)
+        logger.info(f"Retrying {url} in {retry_at - time.time():.0f} s ({failure.kind}, attempt {attempt})")
+        self.frontier.retry(url, retry_at)
@@ -0,0 +1,160 @@
+# Links - URL canonicalization, .onion address validation and link scoring for the frontier
+
+import re
+import base64
+import hashlib
+import posixpath
+from functools import lru_cache
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode, quote
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Query parameters that only track where a visitor came from
+TRACKING_PARAMS = re.compile(r'^(utm_\w+|fbclid|gclid|ref|ref_src)$', re.IGNORECASE)
+
+# Characters that never need percent-encoding, and an escape sequence in a path
+_UNRESERVED = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+_ESCAPE = re.compile(r'%([0-9A-Fa-f]{2})')
+
+
+def _words(*words):
+    """
+    Pattern matching any of words as a whole word of a URL, where anything
+    but a letter or digit (/, -, _, ., ? or =) separates words
+    """
+    return re.compile(r'(?<![a-z0-9])(?:' + '|'.join(words) + r')(?![a-z0-9])')
+
+
+# How links are ranked in the frontier: the score of a link is the sum of the
+# scores of every category whose pattern matches one of the named parts of
+# its URL. The host is never matched, as random .onion names spell words by
+# chance. Leak-bearing pages come first; media and downloads, which the
+# fetcher skips anyway, come last.
+LINK_CATEGORIES = [
+    ('leak', _words(r'pastes?', 'pastebin', 'dumps?', r'leak(?:s|ed)?', r'breach(?:es)?', r'combo(?:s|list)?',
+                    r'dox(?:x|ed)?', 'databases?', 'db', 'credentials?', 'creds', 'fullz', 'cvv', 'ssn'),
+     1.0, ('path', 'query')),
+    ('forum', _words('forums?', 'forumdisplay', 'threads?', 'topics?', 'boards?', 'viewtopic', 'showthread',
+                     'posts?'),
+     0.3, ('path', 'query')),
+    ('media', re.compile(r'\.(jpe?g|png|gif|webp|svg|ico|bmp|mp[34]|webm|avi|mov|mkv|wav|ogg|flac|css|js|'
+                         r'woff2?|ttf|eot|zip|rar|7z|tar|gz|bz2|xz|exe|apk|iso|pdf)$'), -1.0, ('path',)),
+]
+# Added to the score of links off the Tor network
+CLEARNET_SCORE = -0.5
+
+
+@lru_cache(maxsize=65536)
+def onion_address_valid(host):
+    """
+    True if host is a v3 .onion address (optionally with subdomains) whose
+    56 base32 characters decode to a public key, a valid checksum and version 3.
+    Retired 16-character v2 addresses are not valid.
+    """
+    labels = host.lower().rstrip('.').split('.')
+    if len(labels) < 2 or labels[-1] != 'onion' or len(labels[-2]) != 56:
+        return False
+    try:
+        decoded = base64.b32decode(labels[-2].upper())
+    except ValueError:
+        return False
+    pubkey, checksum, version = decoded[:32], decoded[32:34], decoded[34:]
+    if version != b'\x03':
+        return False
+    return hashlib.sha3_256(b'.onion checksum' + pubkey + version).digest()[:2] == checksum
+
+
+def is_onion(host):
+    return bool(host) and host.lower().rstrip('.').endswith('.onion')
+
+
+def _unescape_unreserved(match):
+    char = chr(int(match.group(1), 16))
+    return char if char in _UNRESERVED else '%' + match.group(1).upper()
+
+
+def _normalize_path(path):
+    """
+    Resolve . and .. segments (keeping a trailing slash), decode needless
+    escapes such as %7E and upper-case the others, e.g. %2f -> %2F
+    """
+    if not path:
+        return '/'
+    normalized = posixpath.normpath(path)
+    if normalized.startswith('//'):
+        normalized = '/' + normalized.lstrip('/')
+    if path.endswith('/') and normalized != '/':
+        normalized += '/'
+    if '%' in normalized:
+        normalized = _ESCAPE.sub(_unescape_unreserved, normalized)
+    return quote(normalized, safe="/:@!$&'()*+,;=%~")
+
+
+def normalize_url(url):
+    """
+    Canonicalize a URL so trivially different spellings share one fingerprint:
+    lowercase scheme and host, drop default ports, fragments and tracking
+    parameters, resolve dot segments, normalize percent-encoding, sort query
+    parameters, and use '/' for an empty path
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower().rstrip('.')
+    netloc = host
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{parts.port}"
+    query = parts.query
+    if query:
+        params = [(key, value) for key, value in parse_qsl(query, keep_blank_values=True)
+                  if not TRACKING_PARAMS.match(key)]
+        query = urlencode(sorted(params))
+    return urlunsplit((scheme, netloc, _normalize_path(parts.path), query, ''))
+
+
+def resolve_links(base_url, hrefs):
+    """
+    Resolve hrefs found on base_url to canonical absolute http(s) URLs, in
+    order and without repeats. Fragment-only, mailto:, javascript: and
+    similar links are dropped, as are links to malformed .onion addresses.
+    """
+    links = []
+    seen = set()
+    for href in dict.fromkeys(hrefs):  # Pages repeat links; resolve each once
+        try:
+            absolute = urljoin(base_url, href.strip())
+            parts = urlsplit(absolute)
+            host = parts.hostname
+            if parts.scheme not in DEFAULT_PORTS or not host:
+                continue
+            if is_onion(host) and not onion_address_valid(host):
+                continue
+            link = normalize_url(absolute)
+        except ValueError:
+            continue  # Malformed IPv6 address, out-of-range port and the like
+        if link not in seen:
+            seen.add(link)
+            links.append(link)
+    return links
+
+
+def _matches(parts, pattern, fields):
+    return any(pattern.search(getattr(parts, field)) for field in fields)
+
+
+def link_categories(url, categories=LINK_CATEGORIES):
+    """
+    Names of the categories whose pattern matches url
+    """
+    parts = urlsplit(url.lower())
+    return [name for name, pattern, _, fields in categories if _matches(parts, pattern, fields)]
+
+
+def link_score(url, categories=LINK_CATEGORIES):
+    """
+    Frontier priority of a link from its categories; higher is crawled sooner
+    """
+    parts = urlsplit(url.lower())
+    score = sum(value for _, pattern, value, fields in categories if _matches(parts, pattern, fields))
+    if not is_onion(parts.hostname or ''):
+        score += CLEARNET_SCORE
+    return score
@@ -0,0 +1,57 @@
+# Log queue - bounded, thread-safe hand-off of log lines from worker threads to the GUI
+
+import threading
+from collections import deque
+
+
+class LogQueue:
+    """
+    Bounded queue of log lines. Worker threads put lines without ever
+    blocking; when the queue is full the oldest lines are dropped and
+    counted, so a flood of messages costs bounded memory. The GUI thread
+    drains it in batches.
+    """
+
+    def __init__(self, maxsize=10000):
+        """
+        Args:
+            maxsize: Most lines held before the oldest are dropped
+        """
+        self.maxsize = maxsize
+        self._lines = deque(maxlen=maxsize)
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def put(self, line):
+        with self._lock:
+            if len(self._lines) == self.maxsize:
+                self._dropped += 1
+            self._lines.append(line)
+
+    def drain(self, max_lines=500):
+        """
+        Take up to max_lines of the oldest lines.
+        Returns (lines, number of lines dropped since the last drain).
+        """
+        with self._lock:
+            count = min(max_lines, len(self._lines))
+            lines = [self._lines.popleft() for _ in range(count)]
+            dropped, self._dropped = self._dropped, 0
+        return lines, dropped
+
+    def __len__(self):
+        with self._lock:
+            return len(self._lines)
+
+
+def page_summary(result):
+    """
+    One-line description of a crawled page for the log, instead of its HTML
+    """
+    size = len((result.get('raw_html') or '').encode('utf-8'))
+    status = result.get('status')
+    summary = f"{result['url']}: \"{result.get('title') or 'No title'}\", {size / 1024:.1f} KB, " \
+              f"{len(result.get('links') or [])} links"
+    if status and status != 200:
+        summary += f", HTTP {status}"
+    return summary
@@ -0,0 +1,353 @@
+import hmac
+import pickle
+import hashlib
+from collections import deque
+from normalize import (DigitRuns, best_alignment, canonical_digits, canonical_email,
+                       default_max_edits, iter_emails, split_pieces)
+
+# How each User Data tab field is matched; fields not listed are matched exactly
+FIELD_MODES = {
+    'email': 'email',
+    'phone': 'digits',
+    'ssn': 'digits',
+    'credit_card': 'digits',
+    'bank_account': 'digits',
+    'address': 'fuzzy',
+    'first_name': 'fuzzy',
+    'last_name': 'fuzzy',
+}
+
+MATCH_MODES = ('exact', 'digits', 'email', 'fuzzy')
+
+
+def term_id(term, key=None):
+    """
+    Stable identifier of a term (case-insensitive). With a key (see
+    TermStore.id_key) it is an HMAC, which cannot be checked against a
+    guessed value without the key; without one it is a plain hash that can.
+    """
+    data = term.lower().encode('utf-8')
+    if key is None:
+        return hashlib.sha256(data).hexdigest()[:16]
+    return hmac.new(key, data, hashlib.sha256).hexdigest()[:16]
+
+
+class TermMatcher:
+    """
+    Aho-Corasick automaton over a set of terms. The automaton is compiled
+    once per term set and then finds every case-insensitive occurrence of
+    every term in a single linear pass over the text.
+    """
+
+    # Compiled automatons of recently used term sets, keyed by fingerprint
+    _cache = {}
+    _cache_size = 8
+
+    def __init__(self, terms):
+        # Keep the first spelling of each term, matching is case-insensitive
+        self.terms = []
+        seen = set()
+        for term in terms:
+            key = term.lower()
+            if key and key not in seen:
+                seen.add(key)
+                self.terms.append(term)
+        self.fingerprint = self.terms_fingerprint(self.terms)
+        self._build()
+
+    @staticmethod
+    def terms_fingerprint(terms):
+        """
+        Stable version stamp of a term set, independent of order and case
+        """
+        keys = sorted({term.lower() for term in terms if term})
+        return hashlib.sha256('\0'.join(keys).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def cached(cls, terms):
+        """
+        Return a compiled matcher for terms, reusing one built earlier in
+        this process for the same term set
+        """
+        fingerprint = cls.terms_fingerprint(terms)
+        matcher = cls._cache.pop(fingerprint, None)
+        if matcher is None:
+            matcher = cls(terms)
+        cls._cache[fingerprint] = matcher  # Most recently used goes last
+        while len(cls._cache) > cls._cache_size:
+            cls._cache.pop(next(iter(cls._cache)))
+        return matcher
+
+    def _build(self):
+        # Trie of lowercased terms: goto[state] maps a character to the next state
+        goto = [{}]
+        outputs = [[]]
+        for index, term in enumerate(self.terms):
+            state = 0
+            for ch in term.lower():
+                next_state = goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][ch] = next_state
+                    goto.append({})
+                    outputs.append([])
+                state = next_state
+            outputs[state].append(index)
+
+        # Breadth-first pass computing failure links, then folding them into a
+        # full transition table so scanning needs one dict lookup per character
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            fallback = fail[state]
+            delta[state] = dict(delta[fallback])
+            delta[state].update(goto[state])
+            outputs[state] = outputs[state] + outputs[fallback]
+            for ch, next_state in goto[state].items():
+                fail[next_state] = delta[fallback].get(ch, 0) if state else 0
+                queue.append(next_state)
+
+        self._delta = delta
+        self._outputs = [tuple(out) for out in outputs]
+        self._lengths = [len(term.lower()) for term in self.terms]
+
+    def iter_matches(self, text, lowered=False):
+        """
+        Yield (term, offset) for every occurrence of every term in text,
+        where offset is the start of the match in the lowercased text.
+        Pass lowered=True if text is already lowercase.
+        """
+        if not lowered:
+            text = text.lower()
+        delta = self._delta
+        outputs = self._outputs
+        state = 0
+        for position, ch in enumerate(text):
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                for index in outputs[state]:
+                    yield self.terms[index], position - self._lengths[index] + 1
+
+    def matched_terms(self, text, lowered=False):
+        """
+        Return the set of terms that occur in text
+        """
+        if not lowered:
+            text = text.lower()
+        delta = self._delta
+        outputs = self._outputs
+        found = set()
+        state = 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        return {self.terms[index] for index in found}
+
+    def dumps(self):
+        """
+        Serialize the compiled automaton. The output contains the terms in
+        plain text, so encrypt it before writing it anywhere persistent.
+        """
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def loads(data):
+        """
+        Load an automaton serialized with dumps()
+        """
+        matcher = pickle.loads(data)
+        if not isinstance(matcher, TermMatcher):
+            raise TypeError("Serialized data is not a TermMatcher")
+        return matcher
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(self.dumps())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            return cls.loads(file.read())
+
+
+def term_value(term):
+    """
+    The value of a term given either as a plain string or as a (value, mode) pair
+    """
+    return term[0] if isinstance(term, tuple) else term
+
+
+class FieldMatcher:
+    """
+    Matches user data terms according to their field type, each in one
+    linear pass over the text:
+
+    - exact: case-insensitive substring, as TermMatcher
+    - digits: phone, card and similar numbers, whatever separators the page
+      uses; the page's digit runs are canonicalized once and scanned with an
+      automaton of the canonical term digits
+    - email: addresses in the page are canonicalized once (lowercase, no
+      +tag, "[at]"/"(dot)" spellings undone) and looked up by canonical form
+    - fuzzy: names and addresses within a few edits of the term; exact hits
+      on pieces of the term pick candidates that are then verified by a
+      bounded edit distance
+
+    Exact terms and fuzzy pieces share one automaton.
+    """
+
+    _cache = {}
+    _cache_size = 8
+
+    def __init__(self, terms, id_key=None):
+        """
+        Args:
+            terms: Plain strings (matched exactly) or (value, mode) pairs with a
+                mode from MATCH_MODES
+            id_key: Optional secret the term ids of matches are keyed with (see term_id)
+        """
+        self.id_key = id_key
+        self.terms = []  # (value, mode)
+        seen = set()
+        for term in terms:
+            value, mode = term if isinstance(term, tuple) else (term, 'exact')
+            if mode not in MATCH_MODES:
+                raise ValueError(f"Unknown match mode: {mode}")
+            if value and (value.lower(), mode) not in seen:
+                seen.add((value.lower(), mode))
+                self.terms.append((value, mode))
+        self.fingerprint = self.terms_fingerprint(self.terms, id_key)
+        self._build()
+
+    @staticmethod
+    def terms_fingerprint(terms, id_key=None):
+        """
+        Stable version stamp of a term set, independent of order and case.
+        Without an id key, a set of exact terms has the same stamp as with
+        TermMatcher; with one, the stamp is keyed too, so it changes with the
+        term ids and does not give the terms away.
+        """
+        keys = set()
+        for term in terms:
+            value, mode = term if isinstance(term, tuple) else (term, 'exact')
+            if value:
+                keys.add(value.lower() if mode == 'exact' else f"{mode}:{value.lower()}")
+        fingerprint = TermMatcher.terms_fingerprint(keys)
+        if id_key is None:
+            return fingerprint
+        return hmac.new(id_key, fingerprint.encode('ascii'), hashlib.sha256).hexdigest()
+
+    @classmethod
+    def cached(cls, terms, id_key=None):
+        """
+        Return a compiled matcher for terms, reusing one built earlier in
+        this process for the same term set and id key
+        """
+        fingerprint = cls.terms_fingerprint(terms, id_key)
+        matcher = cls._cache.pop(fingerprint, None)
+        if matcher is None:
+            matcher = cls(terms, id_key)
+        cls._cache[fingerprint] = matcher  # Most recently used goes last
+        while len(cls._cache) > cls._cache_size:
+            cls._cache.pop(next(iter(cls._cache)))
+        return matcher
+
+    def _build(self):
+        # What a hit on each automaton string means: ('exact', value) or
+        # ('piece', fuzzy index, offset of the piece in the term)
+        self._roles = {}
+        self._fuzzy = []   # (value, lowercased value, max edits)
+        digits = {}        # Canonical digits -> values
+        self._emails = {}  # Canonical email -> values
+
+        for value, mode in self.terms:
+            lowered = ' '.join(value.lower().split())
+            if mode == 'digits' and len(canonical_digits(value)) >= 4:
+                digits.setdefault(canonical_digits(value), []).append(value)
+            elif mode == 'email' and canonical_email(value) is not None:
+                self._emails.setdefault(canonical_email(value), []).append(value)
+            elif mode == 'fuzzy' and default_max_edits(len(lowered)) > 0:
+                max_edits = default_max_edits(len(lowered))
+                for offset, piece in split_pieces(lowered, max_edits):
+                    self._roles.setdefault(piece, []).append(('piece', len(self._fuzzy), offset))
+                self._fuzzy.append((value, lowered, max_edits))
+            else:
+                # Values that do not fit their mode are matched as typed
+                self._roles.setdefault(value.lower(), []).append(('exact', value))
+
+        self._text_matcher = TermMatcher(self._roles)
+        self._digit_terms = digits
+        self._digit_matcher = TermMatcher(digits)
+
+    def term_id(self, term):
+        """
+        Id of one of the matcher's terms, keyed with the matcher's id key
+        """
+        return term_id(term, self.id_key)
+
+    def iter_spans(self, text, lowered=False):
+        """
+        Yield (value, start, end) for every match of every term in text,
+        ordered by start, where offsets index the lowercased text.
+        Pass lowered=True if text is already lowercase.
+        """
+        if not lowered:
+            text = text.lower()
+        spans = set()
+
+        fuzzy_windows = set()
+        for string, offset in self._text_matcher.iter_matches(text, lowered=True):
+            for role in self._roles[string.lower()]:
+                if role[0] == 'exact':
+                    spans.add((offset, offset + len(string), role[1]))
+                else:
+                    fuzzy_windows.add((role[1], offset - role[2]))
+
+        def word_bounded(start, end):
+            return ((start == 0 or not text[start - 1].isalnum())
+                    and (end == len(text) or not text[end].isalnum()))
+
+        for index, term_start in fuzzy_windows:
+            value, pattern, max_edits = self._fuzzy[index]
+            found = best_alignment(pattern, text, max_edits,
+                                   max(0, term_start - max_edits),
+                                   min(len(text), term_start + len(pattern) + max_edits),
+                                   accept=word_bounded)
+            if found is not None:
+                spans.add((found[1], found[2], value))
+
+        if self._digit_terms:
+            runs = DigitRuns(text)
+            for digits, offset in self._digit_matcher.iter_matches(runs.text, lowered=True):
+                span = runs.span(offset, offset + len(digits))
+                if span is not None:
+                    for value in self._digit_terms[digits]:
+                        spans.add((span[0], span[1], value))
+
+        if self._emails:
+            for email, start, end in iter_emails(text):
+                for value in self._emails.get(email, ()):
+                    spans.add((start, end, value))
+
+        for start, end, value in sorted(spans):
+            yield value, start, end
+
+    def dumps(self):
+        """
+        Serialize the compiled matcher. The output contains the terms in
+        plain text, and the id key, so encrypt it before writing it anywhere
+        persistent.
+        """
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def loads(data):
+        """
+        Load a matcher serialized with dumps()
+        """
+        matcher = pickle.loads(data)
+        if not isinstance(matcher, FieldMatcher):
+            raise TypeError("Serialized data is not a FieldMatcher")
+        return matcher
@@ -0,0 +1,352 @@
+# Metrics - counters, gauges and histograms for the crawl and parse hot paths,
+# exported as Prometheus text or JSON snapshots
+
+import os
+import json
+import time
+import bisect
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds in seconds. Fetches through Tor take seconds; page work takes milliseconds
+FETCH_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+PROCESSING_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}  # Label values -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """
+    Value that only goes up, e.g. bytes downloaded
+    """
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self, **labels):
+        """
+        Sum of the values whose labels match the given ones
+        """
+        with self._lock:
+            return sum(value for key, value in self._values.items()
+                       if all(dict(zip(self.labels, key)).get(name) == str(wanted)
+                              for name, wanted in labels.items()))
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_label_text(self.labels, key)} {value}" for key, value in items]
+
+    def snapshot(self):
+        with self._lock:
+            return [{'labels': dict(zip(self.labels, key)), 'value': value}
+                    for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """
+    Value that goes up and down, e.g. queue depth. A gauge can also read its
+    value from a function when metrics are exported.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        """
+        Read the (unlabelled) value from function() whenever metrics are exported
+        """
+        self._function = function
+
+    def _refresh(self):
+        if self._function is not None:
+            try:
+                self.set(self._function())
+            except Exception as e:
+                logger.debug(f"Could not read {self.name}: {str(e)}")
+
+    def render(self):
+        self._refresh()
+        return super().render()
+
+    def snapshot(self):
+        self._refresh()
+        return super().snapshot()
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values (e.g. latencies) over fixed buckets
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=PROCESSING_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        """
+        Context manager observing the seconds spent in its block
+        """
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), key + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {cumulative}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        return [{
+            'labels': dict(zip(self.labels, key)),
+            'count': sum(counts),
+            'sum': total,
+            'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], counts)),
+        } for key, (counts, total) in items]
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class MetricsRegistry:
+    """
+    Named collection of metrics with Prometheus text and JSON exporters
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.started_at = time.time()
+
+    def _register(self, metric):
+        self.metrics.setdefault(metric.name, metric)
+        return self.metrics[metric.name]
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=PROCESSING_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render_prometheus(self):
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """
+        All metrics as a JSON-serializable dictionary, with the rate of pages
+        fetched successfully since start-up
+        """
+        uptime = time.time() - self.started_at
+        pages = self.metrics['crawl_pages_total'].total(outcome='ok') if 'crawl_pages_total' in self.metrics else 0
+        return {
+            'timestamp': time.time(),
+            'uptime_seconds': uptime,
+            'pages_per_second': pages / uptime if uptime > 0 else 0.0,
+            'metrics': {name: metric.snapshot() for name, metric in self.metrics.items()},
+        }
+
+    def write_snapshot(self, path):
+        """
+        Write a JSON snapshot to path, replacing the previous one
+        """
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file, indent=2)
+        os.replace(temporary, path)
+
+
+# Process-wide registry and the metrics the crawler and parser record
+REGISTRY = MetricsRegistry()
+
+FETCH_SECONDS = REGISTRY.histogram(
+    'crawl_fetch_seconds', 'Time to fetch a page, by host and Tor circuit', ('host', 'circuit'), FETCH_BUCKETS)
+FETCH_BYTES = REGISTRY.counter('crawl_bytes_total', 'Response body bytes downloaded', ('host',))
+PAGES = REGISTRY.counter('crawl_pages_total', 'Fetches by outcome', ('outcome',))
+PROCESSING_SECONDS = REGISTRY.histogram(
+    'page_processing_seconds', 'Time spent on a page by stage (extract, match, index)', ('stage',))
+PARSED_PAGES = REGISTRY.counter('parse_pages_total', 'Pages cleaned and matched by the parser')
+QUEUE_DEPTH = REGISTRY.gauge('crawl_frontier_pending', 'URLs waiting in the crawl frontier')
+IN_FLIGHT = REGISTRY.gauge('crawl_requests_in_flight', 'Requests currently being fetched')
+MATCH_QUEUE = REGISTRY.gauge('pipeline_match_queue', 'Fetched pages waiting to be stored and matched')
+ALERTS = REGISTRY.counter('pipeline_alerts_total', 'User data terms newly found on a page')
+DUPLICATES = REGISTRY.counter('crawl_duplicates_total', 'Pages found to duplicate another URL, by kind', ('kind',))
+CYCLES = REGISTRY.counter('daemon_cycles_total', 'Crawl-and-match cycles completed by the daemon')
+
+
+def observe_fetch(host, circuit, seconds, outcome, size=0):
+    """
+    Record one fetch: latency by host and circuit, outcome ('ok',
+    'not_modified', 'http_<status>', 'skipped' or 'error') and body bytes
+    """
+    FETCH_SECONDS.observe(seconds, host=host, circuit=circuit)
+    if size:
+        FETCH_BYTES.inc(size, host=host)
+    PAGES.inc(outcome=outcome)
+
+
+def status_outcome(status):
+    """
+    Fetch outcome label of an HTTP status
+    """
+    return {200: 'ok', 304: 'not_modified'}.get(status, f"http_{status}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] == '/metrics.json':
+            body = json.dumps(self.registry.snapshot()).encode('utf-8')
+            content_type = 'application/json'
+        elif self.path.split('?', 1)[0] == '/metrics':
+            body = self.registry.render_prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_http_server(port, host='127.0.0.1', registry=REGISTRY):
+    """
+    Serve /metrics (Prometheus text) and /metrics.json from a background
+    thread. Binds to localhost by default. Returns the server; call
+    shutdown() on it to stop.
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
+
+
+class SnapshotWriter:
+    """
+    Background thread writing a JSON snapshot of the registry every interval seconds
+    """
+
+    def __init__(self, path, interval=30.0, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            self.registry.write_snapshot(self.path)
+        except OSError as e:
+            logger.error(f"Error writing metrics snapshot: {str(e)}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the thread and write a final snapshot
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
+
+
+def start_from_env(environ):
+    """
+    Start the exporters configured by METRICS_PORT and METRICS_SNAPSHOT
+    (with METRICS_INTERVAL seconds between snapshots). Returns the started
+    SnapshotWriter, or None.
+    """
+    if environ.get('METRICS_PORT'):
+        start_http_server(int(environ['METRICS_PORT']))
+    if environ.get('METRICS_SNAPSHOT'):
+        return SnapshotWriter(environ['METRICS_SNAPSHOT'], float(environ.get('METRICS_INTERVAL', '30'))).start()
+    return None
@@ -0,0 +1,140 @@
+# Normalization - canonical forms of digit and email values, and bounded edit distance
+
+import re
+import bisect
+
+# A run of digits, allowing short separators inside it: "(555) 123-4567", "4111 1111 1111 1111"
+_DIGIT_RUN = re.compile(r'\d(?:[ \t\-./()]{0,3}\d)*')
+_NON_DIGIT = re.compile(r'\D+')
+
+# An email address, also in the "name [at] example (dot) com" spellings leaks use to dodge scrapers.
+# Matched against lowercased text.
+_EMAIL = re.compile(
+    r'([a-z0-9._%+\-]+)'
+    r'(?:\s*@\s*|\s*[\[({<]\s*at\s*[\])}>]\s*)'
+    r'([a-z0-9\-]+(?:(?:\.|\s*[\[({<]\s*dot\s*[\])}>]\s*)[a-z0-9\-]+)+)'
+)
+_EMAIL_DOT = re.compile(r'\s*[\[({<]\s*dot\s*[\])}>]\s*')
+
+
+def canonical_digits(value):
+    """
+    Digits of value with every separator removed: '(555) 123-4567' -> '5551234567'
+    """
+    return _NON_DIGIT.sub('', value)
+
+
+def _canonical_email(match):
+    local, domain = match.group(1), match.group(2)
+    local = local.split('+', 1)[0]  # Sub-addresses reach the same mailbox
+    return f"{local}@{_EMAIL_DOT.sub('.', domain)}"
+
+
+def canonical_email(value):
+    """
+    Canonical form of an email address (lowercase, no +tag, de-obfuscated),
+    or None if value is not an email address
+    """
+    match = _EMAIL.fullmatch(value.strip().lower())
+    return _canonical_email(match) if match else None
+
+
+def iter_emails(text):
+    """
+    Generator of (canonical_email, start, end) for every email address in
+    text, which must already be lowercase
+    """
+    for match in _EMAIL.finditer(text):
+        yield _canonical_email(match), match.start(), match.end()
+
+
+class DigitRuns:
+    """
+    Digit runs of a text, canonicalized in one regex pass. The canonical
+    text holds the digits of each run with separators removed, runs divided
+    by a space, so digit terms can be matched against it with one automaton.
+    Matches are mapped back to the original text on demand.
+    """
+
+    def __init__(self, text):
+        self._runs = []    # (canonical start, original start, run text)
+        self._starts = []  # Canonical start of each run, for bisecting
+        pieces = []
+        position = 0
+        for match in _DIGIT_RUN.finditer(text):
+            digits = _NON_DIGIT.sub('', match.group())
+            self._runs.append((position, match.start(), match.group()))
+            self._starts.append(position)
+            pieces.append(digits)
+            position += len(digits) + 1
+        self.text = ' '.join(pieces)
+
+    def span(self, start, end):
+        """
+        Map the canonical slice [start, end) to (start, end) in the original
+        text, or None if the slice does not line up with digit groups, i.e.
+        it would split a group such as the '1234' of '555-1234'
+        """
+        index = bisect.bisect_right(self._starts, start) - 1
+        run_start, original_start, run = self._runs[index]
+        positions = [i for i, ch in enumerate(run) if ch.isdigit()]
+        first, last = start - run_start, end - run_start - 1
+        if first > 0 and positions[first - 1] == positions[first] - 1:
+            return None
+        if last < len(positions) - 1 and positions[last + 1] == positions[last] + 1:
+            return None
+        return original_start + positions[first], original_start + positions[last] + 1
+
+
+def default_max_edits(length):
+    """
+    Edits allowed when fuzzy matching a term of the given length: none for
+    short terms, where one edit already matches too much, then one, then two
+    """
+    if length < 5:
+        return 0
+    return 1 if length < 12 else 2
+
+
+def split_pieces(term, max_edits):
+    """
+    Split term into max_edits + 1 contiguous pieces as (offset, piece).
+    Any string within max_edits edits of term contains at least one piece
+    unchanged, so exact hits on the pieces find every fuzzy candidate.
+    """
+    count = max_edits + 1
+    bounds = [len(term) * i // count for i in range(count + 1)]
+    return [(bounds[i], term[bounds[i]:bounds[i + 1]]) for i in range(count)]
+
+
+def best_alignment(pattern, text, max_edits, lo=0, hi=None, accept=None):
+    """
+    Best approximate occurrence of pattern in text[lo:hi]: (distance, start,
+    end) of the substring with the fewest edits from pattern, preferring
+    longer substrings on ties, or None if every substring needs more than
+    max_edits edits. accept(start, end), if given, can reject substrings.
+    """
+    hi = len(text) if hi is None else hi
+    size = len(pattern)
+    costs = list(range(size + 1))
+    starts = [lo] * (size + 1)
+    best = None
+    for end in range(lo + 1, hi + 1):
+        ch = text[end - 1]
+        # The alignment may start anywhere in the window for free
+        new_costs, new_starts = [0] * (size + 1), [end] * (size + 1)
+        for i in range(1, size + 1):
+            cost, start = costs[i - 1] + (pattern[i - 1] != ch), starts[i - 1]
+            if costs[i] + 1 < cost:
+                cost, start = costs[i] + 1, starts[i]
+            if new_costs[i - 1] + 1 < cost:
+                cost, start = new_costs[i - 1] + 1, new_starts[i - 1]
+            new_costs[i], new_starts[i] = cost, start
+        costs, starts = new_costs, new_starts
+        if costs[size] <= max_edits and (accept is None or accept(starts[size], end)):
+            candidate = (costs[size], starts[size] - end, starts[size], end)
+            if best is None or candidate < best:
+                best = candidate
+    if best is None:
+        return None
+    return best[0], best[2], best[3]
@@ -0,0 +1,284 @@
+# Page store - compressed, indexed storage for crawled pages
+
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+
+def content_hash(html):
+    """
+    SHA-256 hex digest of a page body, used to deduplicate stored bodies
+    """
+    return hashlib.sha256(html.encode('utf-8', errors='replace')).hexdigest()
+
+
+class PageStore:
+    """
+    Stores every fetched page keyed by URL and fetch time.
+
+    Bodies are zlib-compressed and content-addressed: identical HTML fetched
+    from several URLs or on several runs is stored once. Pages can be looked
+    up by id, by URL (latest fetch) and by content hash.
+
+    Text and links extracted at fetch time can be stored alongside the body,
+    so the parser does not have to parse the HTML again.
+    """
+
+    def __init__(self, db_path='data/pages.db', compression_level=6):
+        """
+        Args:
+            db_path: SQLite file holding page metadata and bodies
+            compression_level: zlib compression level for stored bodies (1-9)
+        """
+        self.db_path = db_path
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS bodies (
+                content_hash TEXT PRIMARY KEY,
+                compression TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                body BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS extracts (
+                content_hash TEXT PRIMARY KEY,
+                text BLOB NOT NULL,
+                links BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                status INTEGER,
+                title TEXT,
+                content_hash TEXT NOT NULL REFERENCES bodies (content_hash),
+                etag TEXT,
+                last_modified TEXT
+            );
+            CREATE INDEX IF NOT EXISTS pages_url ON pages (url, id);
+            CREATE INDEX IF NOT EXISTS pages_fetched_at ON pages (fetched_at);
+            CREATE INDEX IF NOT EXISTS pages_content_hash ON pages (content_hash);
+        """)
+        # Stores created before cache validators were kept lack their columns
+        columns = {row['name'] for row in self.conn.execute('PRAGMA table_info(pages)')}
+        for column in ('etag', 'last_modified'):
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE pages ADD COLUMN {column} TEXT')
+        self.conn.commit()
+
+    def add(self, url, html, status=200, fetched_at=None, title=None, text=None, links=None,
+            etag=None, last_modified=None):
+        """
+        Store a fetched page. The body is only written if no page with the
+        same content was stored before, and a revisit that finds the content
+        unchanged (including a 304) refreshes the url's latest row instead of
+        adding one.
+
+        Args:
+            text: Clean text extracted from html, stored for the parser if given
+            links: List of href strings found on the page, stored with text
+            etag, last_modified: Cache validators the server sent, for conditional revisits
+
+        Returns the id of the page row written or refreshed.
+        """
+        digest = content_hash(html)
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        with self._lock:
+            exists = self.conn.execute(
+                'SELECT 1 FROM bodies WHERE content_hash = ?', (digest,)
+            ).fetchone()
+            if exists is None:
+                encoded = html.encode('utf-8', errors='replace')
+                self.conn.execute(
+                    'INSERT INTO bodies (content_hash, compression, size, body) VALUES (?, ?, ?, ?)',
+                    (digest, 'zlib', len(encoded), zlib.compress(encoded, self.compression_level))
+                )
+            if text is not None:
+                self.conn.execute(
+                    'INSERT OR IGNORE INTO extracts (content_hash, text, links) VALUES (?, ?, ?)',
+                    (digest, self._compress(text), self._compress('\n'.join(links or [])))
+                )
+            latest = self.conn.execute(
+                'SELECT id, content_hash FROM pages WHERE url = ? ORDER BY id DESC LIMIT 1', (url,)
+            ).fetchone()
+            if latest is not None and latest['content_hash'] == digest:
+                # A 304 carries no status of its own for the body, so the stored one is kept
+                self.conn.execute(
+                    'UPDATE pages SET fetched_at = ?, status = CASE WHEN ? = 304 THEN status ELSE ? END, '
+                    'title = COALESCE(?, title), etag = COALESCE(?, etag), '
+                    'last_modified = COALESCE(?, last_modified) WHERE id = ?',
+                    (fetched_at, status, status, title, etag, last_modified, latest['id'])
+                )
+                self.conn.commit()
+                return latest['id']
+            cursor = self.conn.execute(
+                'INSERT INTO pages (url, fetched_at, status, title, content_hash, etag, last_modified) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, fetched_at, status, title, digest, etag, last_modified)
+            )
+            self.conn.commit()
+            return cursor.lastrowid
+
+    def _compress(self, value):
+        return zlib.compress(value.encode('utf-8', errors='replace'), self.compression_level)
+
+    @staticmethod
+    def _decompress(value):
+        return zlib.decompress(value).decode('utf-8', errors='replace')
+
+    def get_text(self, digest):
+        """
+        Return the clean text stored for the given content hash, or None if
+        the page was stored without extracted text
+        """
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT text FROM extracts WHERE content_hash = ?', (digest,)
+            ).fetchone()
+        return self._decompress(row[0]) if row is not None else None
+
+    def get_links(self, digest):
+        """
+        Return the links stored for the given content hash, or None
+        """
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT links FROM extracts WHERE content_hash = ?', (digest,)
+            ).fetchone()
+        if row is None:
+            return None
+        links = self._decompress(row[0])
+        return links.split('\n') if links else []
+
+    def _body(self, digest):
+        row = self.conn.execute(
+            'SELECT compression, body FROM bodies WHERE content_hash = ?', (digest,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row['compression'] != 'zlib':
+            raise ValueError(f"Unsupported compression: {row['compression']}")
+        return self._decompress(row['body'])
+
+    def get_body(self, digest):
+        """
+        Return the decompressed body with the given content hash, or None
+        """
+        with self._lock:
+            return self._body(digest)
+
+    def _page(self, row, with_html=True):
+        if row is None:
+            return None
+        page = dict(row)
+        if with_html:
+            page['html'] = self._body(row['content_hash'])
+        return page
+
+    def get(self, page_id, with_html=True):
+        """
+        Return the page with the given id as a dictionary, or None
+        """
+        with self._lock:
+            row = self.conn.execute('SELECT * FROM pages WHERE id = ?', (page_id,)).fetchone()
+            return self._page(row, with_html)
+
+    def latest(self, url, with_html=True):
+        """
+        Return the most recent fetch of url, or None
+        """
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT * FROM pages WHERE url = ? ORDER BY id DESC LIMIT 1', (url,)
+            ).fetchone()
+            return self._page(row, with_html)
+
+    def validators(self, url):
+        """
+        Return (etag, last_modified) of the most recent fetch of url, or None
+        if it was never fetched
+        """
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT etag, last_modified FROM pages WHERE url = ? ORDER BY id DESC LIMIT 1', (url,)
+            ).fetchone()
+        return (row['etag'], row['last_modified']) if row is not None else None
+
+    def by_hash(self, digest):
+        """
+        Return metadata of every page whose body has the given content hash
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT * FROM pages WHERE content_hash = ? ORDER BY id', (digest,)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    def has_content(self, digest):
+        """
+        True if a body with the given content hash is already stored
+        """
+        with self._lock:
+            return self.conn.execute(
+                'SELECT 1 FROM bodies WHERE content_hash = ?', (digest,)
+            ).fetchone() is not None
+
+    def iter_pages(self, latest_only=True, with_html=True, batch_size=100, after_id=0):
+        """
+        Generator of stored pages in id order, loading one batch at a time.
+
+        Args:
+            latest_only: Only yield the most recent fetch of each URL
+            with_html: Include the decompressed body under 'html'
+            batch_size: Number of pages fetched from the database per query
+            after_id: Only yield pages with a greater id
+        """
+        query = 'SELECT * FROM pages WHERE id > ?'
+        if latest_only:
+            query += (' AND NOT EXISTS (SELECT 1 FROM pages AS newer'
+                      ' WHERE newer.url = pages.url AND newer.id > pages.id)')
+        query += ' ORDER BY id LIMIT ?'
+
+        last_id = after_id
+        while True:
+            with self._lock:
+                rows = self.conn.execute(query, (last_id, batch_size)).fetchall()
+                pages = [self._page(row, with_html) for row in rows]
+            if not pages:
+                return
+            for page in pages:
+                yield page
+            last_id = pages[-1]['id']
+
+    def count(self):
+        """
+        Number of stored fetches
+        """
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def import_text_file(self, text_filepath):
+        """
+        Import pages from the legacy append-only text.txt blob. The blob has no
+        URLs, so pages are stored as text-file:<path>#<index>.
+        Returns the number of pages imported.
+        """
+        from parser import Parser
+
+        imported = 0
+        for index, html in enumerate(Parser(text_filepath, []).iter_documents()):
+            self.add(f"text-file:{text_filepath}#{index}", html, status=None)
+            imported += 1
+        return imported
+
+    def close(self):
+        self.conn.close()
@@ -1,5 +1,34 @@
+import os
+import json
 import time
-from bs4 import BeautifulSoup
+import multiprocessing
+from bisect import bisect_left
+import metrics
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from extract import get_extractor
+from matcher import FieldMatcher, term_value
+
+# Matcher and settings used by process pool workers, set once per worker by _init_worker
+_worker_matcher = None
+_worker_context_chars = 80
+
+
+def _init_worker(matcher_data, context_chars):
+    global _worker_matcher, _worker_context_chars
+    _worker_matcher = FieldMatcher.loads(matcher_data)
+    _worker_context_chars = context_chars
+
+
+def _match_documents(documents):
+    """
+    Process pool task: clean and match a chunk of (key, html, text) documents.
+    Returns a list of (key, records, clean_seconds, match_seconds) as Parser.match_document.
+    """
+    parser = Parser(None, [], context_chars=_worker_context_chars)
+    return [(key,) + parser.match_document(html, text, _worker_matcher) for key, html, text in documents]
+
 
 class Parser:
     """
@@ -8,10 +37,20 @@ class Parser:
     the user data is present in the text file.
     """
 
-    def __init__(self, text_filepath, user_data, user_data_filepath=''):
+    def __init__(self, text_filepath, user_data, user_data_filepath='', page_store=None,
+                 workers=1, chunksize=4, min_parallel_pages=32, extractor=None, context_chars=80,
+                 term_store=None, text_index=None):
         self.user_data_filepath = user_data_filepath
         self.text_filepath = text_filepath
         self.user_data = user_data
+        self.term_store = term_store  # Optional TermStore to take the terms from when user_data is empty
+        self.page_store = page_store  # Optional PageStore to read pages from instead of text_filepath
+        self.text_index = text_index  # Optional TextIndex narrowing down the stored pages to read
+        self.workers = workers or os.cpu_count() or 1  # Processes used to clean and match pages
+        self.chunksize = chunksize  # Pages handed to a worker process per task
+        self.min_parallel_pages = min_parallel_pages  # Smaller inputs are parsed serially
+        self.extractor = extractor or get_extractor()  # Fastest installed HTML backend by default
+        self.context_chars = context_chars  # Characters of context kept either side of a match
 
 
     def load_user_data(self):
@@ -35,74 +74,373 @@ class Parser:
         Returns the clean text.
         """
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            return soup.get_text(separator=' ', strip=True)
+            return self.extractor.extract(html_content).text
         except Exception as e:
             print(f"Error cleaning HTML: {str(e)}")
             return html_content  # Return original content if cleaning fails
 
 
-    def parse(self, results_filepath=None):
+    def iter_documents(self):
         """
-        Parse the text file for user data.
-        Returns a dictionary with user data as keys and matching lines as values.
-        If results_filepath is provided, writes the results to that file.
+        Stream the text file one HTML page at a time.
+        Pages are appended back to back, so a new page starts at each
+        <!doctype ...> line, or at an <html> line once the previous page
+        has closed. Only the current page is held in memory.
         """
+        with open(self.text_filepath, 'r', encoding='utf-8', errors='replace') as file:
+            document = []
+            has_content = False   # Current page has something besides whitespace
+            doctype_only = False  # Current page is just a <!doctype> line so far
+            closed = False        # Current page has seen </html>
+
+            for line in file:
+                head = line.lstrip()[:9].lower()
+                starts_doctype = head.startswith('<!doctype')
+                starts_html = head.startswith('<html')
+
+                if has_content and (starts_doctype or (starts_html and (closed or not doctype_only))):
+                    yield ''.join(document)
+                    document, has_content, doctype_only, closed = [], False, False, False
+
+                document.append(line)
+                stripped = line.strip()
+                if stripped:
+                    doctype_only = not has_content and starts_doctype and '<html' not in stripped.lower()
+                    has_content = True
+                if '</html>' in line.lower():
+                    closed = True
+
+            if has_content:
+                yield ''.join(document)
 
-        if self.user_data_filepath is None or self.text_filepath is None:
-            raise ValueError("File paths cannot be None")
 
+    def document_text(self, html_content, text=None):
+        """
+        Clean text of a document, reusing text extracted at fetch time if available
+        """
+        return text if text is not None else self.clean_html(html_content)
+
+
+    def iter_pages(self):
+        """
+        Generator of (page_id, clean_text) for each page, cleaning one page at
+        a time so matching starts before the whole corpus is read.
+        Pages come from the page store if one is set (keyed by page id),
+        otherwise from the text file (keyed by position).
+        """
+        for page_id, html_content, text in self.iter_raw_pages():
+            yield page_id, self.document_text(html_content, text)
+
+
+    def match_documents(self, documents, matcher):
+        """
+        Clean and match a stream of (key, html, text) documents, where text is
+        the clean text if it is already known and None otherwise.
+        Generator of (key, records) in input order, with match records as built by match_text.
+
+        With more than one worker and at least min_parallel_pages documents,
+        pages are cleaned and matched in a process pool; a bounded number of
+        chunks is in flight at once so memory stays flat on large inputs.
+        Smaller inputs are handled in this process to avoid pool start-up costs.
+        """
+        for key, records, clean_seconds, match_seconds in self._match_documents(documents, matcher):
+            # Timings are taken where the work ran and recorded here, in the parent process
+            if clean_seconds is not None:
+                metrics.PROCESSING_SECONDS.observe(clean_seconds, stage='extract')
+            metrics.PROCESSING_SECONDS.observe(match_seconds, stage='match')
+            metrics.PARSED_PAGES.inc()
+            yield key, records
+
+
+    def match_document(self, html, text, matcher):
+        """
+        Clean and match one document.
+        Returns (records, clean_seconds, match_seconds), where clean_seconds is
+        None if the text was already known.
+        """
+        clean_seconds = None
+        if text is None:
+            start = time.perf_counter()
+            text = self.clean_html(html)
+            clean_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        records = list(self.match_text(text, matcher))
+        return records, clean_seconds, time.perf_counter() - start
 
+
+    def _match_documents(self, documents, matcher):
+        """
+        Generator of (key, records, clean_seconds, match_seconds), matching
+        in this process or in a process pool as described in match_documents
+        """
+        documents = iter(documents)
+        head = list(islice(documents, self.min_parallel_pages)) if self.workers > 1 else []
+        documents = chain(head, documents)
+
+        if self.workers <= 1 or len(head) < self.min_parallel_pages:
+            for key, html, text in documents:
+                yield (key,) + self.match_document(html, text, matcher)
+            return
+
+        # Spawn rather than fork: the parser is usually started from a GUI worker thread
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(matcher.dumps(), self.context_chars),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            in_flight = deque()
+            while True:
+                chunk = list(islice(documents, self.chunksize))
+                if not chunk:
+                    break
+                in_flight.append(executor.submit(_match_documents, chunk))
+                # Keep a couple of chunks per worker queued, collecting results in order
+                if len(in_flight) >= self.workers * 2:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+
+
+    def _stored_document(self, key, page):
+        """
+        (key, html, text) document for a page store entry. Text extracted at
+        fetch time is used as is; the HTML is only loaded when there is none.
+        """
+        text = self.page_store.get_text(page['content_hash'])
+        html = self.page_store.get_body(page['content_hash']) if text is None else None
+        return key, html, text
+
+
+    def iter_raw_pages(self):
+        """
+        Generator of (page_id, html, text) for each page, from the page store
+        if one is set (keyed by page id), otherwise from the text file (keyed
+        by position). text is None when the page still has to be cleaned.
+        """
+        if self.page_store is not None:
+            for page in self.page_store.iter_pages(with_html=False):
+                yield self._stored_document(page['id'], page)
+            return
+
+        for page_index, html_content in enumerate(self.iter_documents()):
+            yield page_index, html_content, None
+
+
+    def _get_user_data(self):
+        """
+        Return the terms to look for, taking them from the term store or
+        loading them from user_data_filepath if none were given
+        """
+        if not self.user_data and self.term_store is not None:
+            return self.term_store.terms()
         if not self.user_data:
             # Load user data
             print("Loading user data...")
-            user_data = self.load_user_data()
-        else:
-            user_data = self.user_data
+            return self.load_user_data()
+        return self.user_data
+
+
+    def _matcher(self, user_data):
+        """
+        Compiled matcher for user_data; the term store's own, kept until its
+        version changes, when the terms came from it
+        """
+        if not self.user_data and self.term_store is not None:
+            return self.term_store.matcher()
+        return FieldMatcher.cached(user_data)
 
 
+    def _candidate_hashes(self, user_data):
+        """
+        Content hashes of the stored pages that may hold any of the terms,
+        per the text index, or None if every page has to be read
+        """
+        if self.text_index is None or self.page_store is None:
+            return None
+        self.text_index.sync(self.page_store)
+        hashes = set()
+        for term in user_data:
+            value, mode = term if isinstance(term, tuple) else (term, 'exact')
+            found = self.text_index.candidates(value, mode)
+            if found is None:
+                return None
+            hashes.update(found)
+        return hashes
+
+
+    @staticmethod
+    def _entries(user_data, matcher):
+        """
+        Map each term id (as matcher makes them) back to every user data entry
+        spelling the term
+        """
+        entries = {}
+        for data in map(term_value, user_data):
+            entries.setdefault(matcher.term_id(data), []).append(data)
+        return entries
+
+
+    def match_text(self, clean_text, matcher):
+        """
+        Generator of match records, one per occurrence of a matcher term in
+        clean_text, matched as its field type requires (see FieldMatcher).
+        Each record is a dictionary with the term_id, the offset of the hit in
+        clean_text and a context window of up to context_chars characters
+        either side of it. Every hit in the window, this one included, is
+        replaced by its term id in brackets, so records never repeat the
+        matched values.
+        """
+        lowered = clean_text.lower()
+        # Offsets index the lowercased text, which lines up with clean_text
+        # unless lowercasing changed its length
+        source = clean_text if len(lowered) == len(clean_text) else lowered
+        width = self.context_chars
+        hits = [(offset, end, matcher.term_id(term))
+                for term, offset, end in matcher.iter_spans(lowered, lowered=True)]
+        spans = sorted(hits)
+        starts = [span[0] for span in spans]
+        longest = max((end - offset for offset, end, _ in hits), default=0)
+        for offset, end, hit_id in hits:
+            start, stop = max(0, offset - width), end + width
+            yield {
+                'term_id': hit_id,
+                'offset': offset,
+                'context': self._redact(source, start, stop,
+                                        spans[bisect_left(starts, start - longest):bisect_left(starts, stop)]),
+            }
+
+
+    @staticmethod
+    def _redact(source, start, stop, spans):
+        """
+        source[start:stop] with each of spans, (offset, end, term id) sorted
+        by offset, that overlaps it replaced by [term id]
+        """
+        pieces = []
+        cursor = start
+        for offset, end, hit_id in spans:
+            if end <= cursor:
+                continue
+            pieces.append(source[cursor:max(offset, cursor)])
+            pieces.append(f"[{hit_id}]")
+            cursor = end
+        pieces.append(source[cursor:stop])
+        return ''.join(pieces)
+
+
+    def write_results(self, records, results_filepath):
+        """
+        Write match records to results_filepath as JSON Lines
+        """
+        with open(results_filepath, 'w', encoding='utf-8') as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+    def parse(self, results_filepath=None):
+        """
+        Parse the text file for user data.
+        Returns a dictionary with user data as keys and lists of match records
+        (term_id, page_id, offset, context) as values.
+        If results_filepath is provided, writes the records to that file as JSON Lines.
+        """
+
+        if self.user_data_filepath is None or (self.text_filepath is None and self.page_store is None):
+            raise ValueError("File paths cannot be None")
+
+        user_data = self._get_user_data()
+
         start = time.time()
 
-        results = {k: [] for k in user_data}
+        results = {k: [] for k in map(term_value, user_data)}
+        records = []
         results_count = 0
 
-        print("Parsing text file for results...")
+        # Compile all terms up front so each page is scanned once
+        matcher = self._matcher(user_data)
+        entries = self._entries(user_data, matcher)
 
-        # Read the text file
-        with open(self.text_filepath, 'r', encoding='utf-8', errors='replace') as file:
-            html_content = file.read()
+        print("Parsing text file for results...")
 
-            # Clean HTML content
-            clean_text = self.clean_html(html_content)
+        # Stream the text file page by page, cleaning each page on its own
+        for page_id, page_records in self.match_documents(self.iter_raw_pages(), matcher):
+            for record in page_records:
+                record['page_id'] = page_id
+                records.append(record)
+                for data in entries[record['term_id']]:
+                    results[data].append(record)
+                    results_count += 1
 
-            # Process the cleaned text line by line
-            for line in clean_text.split('\n'):
-                line = line.strip()
-                if not line:  # Skip empty lines
-                    continue
+        # Write the results to a file
+        if results_filepath is not None:
+            self.write_results(records, results_filepath)
 
-                # Check if any user data is present in the line
-                for data in user_data:
-                    if data.lower() in line.lower():  # Case-insensitive matching
-                        results[data].append(line)
-                        results_count += 1
+        end = time.time()
+        time_taken = end - start
+        print(f"Parsing completed in {time_taken:.2f} seconds.")
+        print(f"Found {results_count} results in the text file related to user data.")
 
-        # Write the results to a file
         if results_filepath is not None:
-            with open(results_filepath, 'w', encoding='utf-8') as file:
-                file.write("PARSER RESULTS\n")
-                file.write("=============\n\n")
+            print(f"Results written to '{results_filepath}'.")
+
+        return results
+
+
+    def parse_incremental(self, results_index, results_filepath=None):
+        """
+        Parse only the pages of the page store that are new or changed since
+        the last run, and merge their hits into results_index. Every page is
+        rescanned when the user data differs from the last run.
+        Returns the same dictionary as parse(), built from the whole index.
+        """
+
+        if self.page_store is None:
+            raise ValueError("Incremental parsing requires a page store")
+
+        user_data = self._get_user_data()
+
+        start = time.time()
+
+        matcher = self._matcher(user_data)
+        entries = self._entries(user_data, matcher)
+
+        # Hits produced with a different term set are stale
+        candidates = None
+        if results_index.terms_version != matcher.fingerprint:
+            print("User data changed since the last run, rescanning all pages...")
+            results_index.reset(matcher.fingerprint)
+            # Pages the text index rules out for every term have no hits and need not be read
+            candidates = self._candidate_hashes(user_data)
+
+        print("Parsing new and changed pages...")
 
-                for data, lines in results.items():
-                    if lines:  # Only write results if there are matches
-                        file.write(f"Data: {data}\n")
-                        for line in lines:
-                            file.write(f"  - {line}\n")
-                        file.write("\n")
+        def changed_pages():
+            for page in self.page_store.iter_pages(with_html=False):
+                if not results_index.is_current(page['url'], page['content_hash']):
+                    if candidates is not None and page['content_hash'] not in candidates:
+                        results_index.update_page(page['url'], page['id'], page['content_hash'], [])
+                        continue
+                    yield self._stored_document(page, page)
+
+        scanned = 0
+        for page, page_records in self.match_documents(changed_pages(), matcher):
+            results_index.update_page(page['url'], page['id'], page['content_hash'], page_records)
+            scanned += 1
+
+        # Rebuild the full result set from the index
+        results = {k: [] for k in map(term_value, user_data)}
+        records = []
+        results_count = 0
+        for record in results_index.iter_hits():
+            records.append(record)
+            for data in entries.get(record['term_id'], []):
+                results[data].append(record)
+                results_count += 1
+
+        if results_filepath is not None:
+            self.write_results(records, results_filepath)
 
         end = time.time()
         time_taken = end - start
-        print(f"Parsing completed in {time_taken:.2f} seconds.")
+        print(f"Parsing completed in {time_taken:.2f} seconds ({scanned} pages scanned).")
         print(f"Found {results_count} results in the text file related to user data.")
 
         if results_filepath is not None:
@@ -111,6 +449,40 @@ class Parser:
         return results
 
 
+    def search(self, term):
+        """
+        Find one term, a plain string or a (value, mode) pair, on every
+        stored page as parse() would. With a text index only the pages
+        that may hold the term are read; pages stored since the index was
+        last updated are indexed first.
+        Returns the match records, each with its page_id.
+        """
+        if self.page_store is None:
+            raise ValueError("Searching requires a page store")
+
+        value, mode = term if isinstance(term, tuple) else (term, 'exact')
+        matcher = FieldMatcher.cached([(value, mode)])
+
+        candidates = None
+        if self.text_index is not None:
+            self.text_index.sync(self.page_store)
+            candidates = self.text_index.candidates(value, mode)
+
+        # Documents are keyed by the ids of the pages sharing their content
+        if candidates is None:
+            documents = (self._stored_document([page['id']], page)
+                         for page in self.page_store.iter_pages(with_html=False))
+        else:
+            documents = (self._stored_document(page_ids, {'content_hash': digest})
+                         for digest, page_ids in candidates.items())
+
+        records = []
+        for page_ids, page_records in self.match_documents(documents, matcher):
+            for page_id in page_ids:
+                records.extend(dict(record, page_id=page_id) for record in page_records)
+        return records
+
+
 # def main():
 #     """
 #     Main function to run the parser.
@@ -0,0 +1,78 @@
+# Crawl pipeline - hands each fetched page to the page store and matcher in one pass
+
+import logging
+import metrics
+from page_store import content_hash
+from parser import Parser
+from matcher import FieldMatcher, term_value
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlPipeline:
+    """
+    Processes crawl results as they arrive. Each page is parsed once, at
+    fetch time; its clean text, title and links go straight to the page
+    store and the matcher as plain strings, so the parser never has to read
+    the HTML back from disk and parse it a second time.
+    """
+
+    def __init__(self, page_store, user_data=None, results_index=None, on_alert=None, text_index=None,
+                 id_key=None):
+        """
+        Args:
+            page_store: PageStore the pages are written to
+            user_data: Terms to match against each page, as plain strings or
+                (value, mode) pairs; None or empty to only store pages
+            results_index: Optional ResultsIndex the hits are merged into
+            on_alert: Optional callable invoked with (url, records) for the
+                match records of terms newly found on a page, per results_index
+            text_index: Optional TextIndex each page's text is added to
+            id_key: Optional secret the term ids of the records are keyed with,
+                TermStore.id_key when the terms come from a term store
+        """
+        self.page_store = page_store
+        self.results_index = results_index
+        self.on_alert = on_alert
+        self.text_index = text_index
+        self.user_data = [data for data in (user_data or []) if term_value(data)]
+        self.parser = Parser(None, self.user_data, page_store=page_store)
+        self.matcher = FieldMatcher.cached(self.user_data, id_key) if self.user_data else None
+
+        if self.results_index is not None and self.matcher is not None:
+            if self.results_index.terms_version is None:
+                self.results_index.reset(self.matcher.fingerprint)
+
+    def process(self, result):
+        """
+        Store and match one crawl result (as returned by crawl_onion)
+
+        Returns (page_id, records) with match records as built by Parser.match_text
+        """
+        page_id = self.page_store.add(
+            result['url'], result['raw_html'], status=result.get('status'),
+            title=result.get('title'), text=result['text'], links=result.get('links'),
+            etag=result.get('etag'), last_modified=result.get('last_modified'),
+        )
+        digest = content_hash(result['raw_html'])
+        if self.text_index is not None:
+            with metrics.PROCESSING_SECONDS.time(stage='index'):
+                self.text_index.add(result['url'], page_id, digest, result['text'])
+
+        hits = []
+        if self.matcher is not None:
+            with metrics.PROCESSING_SECONDS.time(stage='match'):
+                hits = list(self.parser.match_text(result['text'], self.matcher))
+            for record in hits:
+                record['page_id'] = page_id
+            # Hits only belong in the index if it was built for the same term set;
+            # otherwise the next incremental parse rescans everything anyway
+            if self.results_index is not None and self.results_index.terms_version == self.matcher.fingerprint:
+                new_terms = self.results_index.update_page(result['url'], page_id, digest, hits)
+                if new_terms and self.on_alert is not None:
+                    metrics.ALERTS.inc(len(new_terms))
+                    self.on_alert(result['url'], [record for record in hits if record['term_id'] in new_terms])
+
+        if hits:
+            logger.info(f"{len(hits)} matches on {result['url']}")
+        return page_id, hits
@@ -0,0 +1,222 @@
+# Results index - persistent parser results for incremental parsing
+
+import os
+import time
+import sqlite3
+import threading
+
+
+class ResultsIndex:
+    """
+    Persistent store of parser match records, together with the content
+    hash each page had when it was scanned and the version of the term set
+    used. Lets the parser skip pages that have not changed since the last run.
+
+    A per-term summary (hit count, page count, first and last time seen) is
+    kept up to date as pages are scanned, so lookups by term never have to
+    touch the individual hits.
+    """
+
+    # Bumped whenever the table layout changes; older indexes are rebuilt
+    SCHEMA_VERSION = 3
+
+    def __init__(self, db_path='data/results.db'):
+        """
+        Args:
+            db_path: SQLite file holding scan state and hits
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+        if row is None or int(row[0]) != self.SCHEMA_VERSION:
+            # Results are derived data: drop them and let the next parse rescan
+            self.conn.executescript("""
+                DROP TABLE IF EXISTS hits;
+                DROP TABLE IF EXISTS scanned_pages;
+                DROP TABLE IF EXISTS term_stats;
+                DELETE FROM meta;
+            """)
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('schema_version', ?)", (str(self.SCHEMA_VERSION),)
+            )
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS scanned_pages (
+                url TEXT PRIMARY KEY,
+                page_id INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                scanned_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS hits (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                page_id INTEGER NOT NULL,
+                term_id TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                context TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS hits_url ON hits (url);
+            CREATE INDEX IF NOT EXISTS hits_term_id ON hits (term_id, url);
+            CREATE TABLE IF NOT EXISTS term_stats (
+                term_id TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL,
+                pages INTEGER NOT NULL,
+                first_seen REAL,
+                last_seen REAL
+            );
+            CREATE INDEX IF NOT EXISTS term_stats_last_seen ON term_stats (last_seen);
+        """)
+        self.conn.commit()
+
+    @property
+    def terms_version(self):
+        """
+        Fingerprint of the term set the stored hits were produced with
+        """
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'terms_version'").fetchone()
+            return row[0] if row else None
+
+    def reset(self, terms_version):
+        """
+        Drop all hits and scan state, e.g. because the watched terms changed.
+        First/last seen times of terms are kept; their counts restart at zero.
+        """
+        with self._lock:
+            self.conn.execute('DELETE FROM hits')
+            self.conn.execute('DELETE FROM scanned_pages')
+            self.conn.execute('UPDATE term_stats SET hits = 0, pages = 0')
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('terms_version', ?)", (terms_version,)
+            )
+            self.conn.commit()
+
+    def is_current(self, url, content_hash):
+        """
+        True if url was already scanned with exactly this content
+        """
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT content_hash FROM scanned_pages WHERE url = ?', (url,)
+            ).fetchone()
+            return row is not None and row[0] == content_hash
+
+    def update_page(self, url, page_id, content_hash, records):
+        """
+        Replace the match records of url with the result of a fresh scan
+
+        Args:
+            url: Page URL
+            page_id: PageStore id of the scanned fetch
+            content_hash: Content hash of the scanned body
+            records: Match records (term_id, offset, context) found on the page
+        Returns the set of term ids found on the page that were not on it before.
+        """
+        records = list(records)
+        now = time.time()
+        with self._lock:
+            previous = {row[0] for row in self.conn.execute(
+                'SELECT DISTINCT term_id FROM hits WHERE url = ?', (url,)
+            )}
+            found = {record['term_id'] for record in records}
+
+            self.conn.execute('DELETE FROM hits WHERE url = ?', (url,))
+            self.conn.executemany(
+                'INSERT INTO hits (url, page_id, term_id, offset, context) VALUES (?, ?, ?, ?, ?)',
+                ((url, page_id, record['term_id'], record['offset'], record['context'])
+                 for record in records)
+            )
+            self.conn.execute(
+                'INSERT OR REPLACE INTO scanned_pages (url, page_id, content_hash, scanned_at) '
+                'VALUES (?, ?, ?, ?)',
+                (url, page_id, content_hash, now)
+            )
+
+            # Refresh the summary of every term whose hits on this page changed
+            for changed_term in previous | found:
+                hits, pages = self.conn.execute(
+                    'SELECT COUNT(*), COUNT(DISTINCT url) FROM hits WHERE term_id = ?', (changed_term,)
+                ).fetchone()
+                seen_at = now if changed_term in found else None
+                self.conn.execute(
+                    'INSERT INTO term_stats (term_id, hits, pages, first_seen, last_seen) '
+                    'VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT (term_id) DO UPDATE SET hits = excluded.hits, pages = excluded.pages, '
+                    'first_seen = COALESCE(term_stats.first_seen, excluded.first_seen), '
+                    'last_seen = COALESCE(excluded.last_seen, term_stats.last_seen)',
+                    (changed_term, hits, pages, seen_at, seen_at)
+                )
+            self.conn.commit()
+            return found - previous
+
+    def term_stats(self, term_id):
+        """
+        Summary of a term's matches: a dictionary with hits, pages, first_seen
+        and last_seen (Unix times), or None if the term has no hits, either
+        because it was never matched or because the pages it was on changed
+        or were rescanned since
+        """
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT hits, pages, first_seen, last_seen FROM term_stats WHERE term_id = ?', (term_id,)
+            ).fetchone()
+        if row is None or row[0] == 0:
+            return None
+        return {'hits': row[0], 'pages': row[1], 'first_seen': row[2], 'last_seen': row[3]}
+
+    def terms_seen_since(self, since):
+        """
+        Set of term ids matched at or after the Unix time since that still have hits
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT term_id FROM term_stats WHERE last_seen >= ? AND hits > 0', (since,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def matched_terms(self):
+        """
+        Set of term ids that have at least one hit
+        """
+        with self._lock:
+            rows = self.conn.execute('SELECT term_id FROM term_stats WHERE hits > 0').fetchall()
+        return {row[0] for row in rows}
+
+    def iter_hits(self, batch_size=1000, term_ids=None):
+        """
+        Generator of match records (term_id, page_id, url, offset, context)
+        for every stored hit, or only those of term_ids, in the order they
+        were recorded, one batch at a time
+        """
+        where = ''
+        args = ()
+        if term_ids is not None:
+            term_ids = list(term_ids)
+            where = f" AND term_id IN ({','.join('?' * len(term_ids))})"
+            args = tuple(term_ids)
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    'SELECT id, term_id, page_id, url, offset, context FROM hits '
+                    f'WHERE id > ?{where} ORDER BY id LIMIT ?', (last_id,) + args + (batch_size,)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield {
+                    'term_id': row[1],
+                    'page_id': row[2],
+                    'url': row[3],
+                    'offset': row[4],
+                    'context': row[5],
+                }
+            last_id = rows[-1][0]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,289 @@
+# Term store - encrypted store of the identities (user data) to monitor, with a decrypted cache
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from cryptography.fernet import Fernet
+from matcher import FIELD_MODES, FieldMatcher, term_id
+
+
+def load_fernet(key_file='user_data/.encryption_key'):
+    """
+    Fernet for the key in key_file, generating and saving a new key if there is none
+    """
+    if not os.path.exists(key_file):
+        if os.path.dirname(key_file):
+            os.makedirs(os.path.dirname(key_file), exist_ok=True)
+        with open(key_file, 'wb') as f:
+            f.write(Fernet.generate_key())
+    with open(key_file, 'rb') as f:
+        return Fernet(f.read())
+
+
+class TermStore:
+    """
+    Identities to monitor, each a name and a dictionary of field -> value
+    (as in the User Data tab), stored in SQLite as one Fernet-encrypted
+    record per identity.
+
+    Records are decrypted lazily, all at once, the first time they are
+    needed, and kept in memory for cache_ttl seconds. Every change bumps a
+    version stamp stored with the records, so other processes notice it
+    without decrypting anything, and callers can tell whether what they
+    built from the terms (e.g. a compiled matcher) is still valid.
+
+    Term ids in results are keyed with a random secret, kept encrypted
+    with the records, so they cannot be checked against guessed values.
+    """
+
+    def __init__(self, fernet, db_path='user_data/terms.db', cache_ttl=300.0):
+        """
+        Args:
+            fernet: Fernet used to encrypt and decrypt records
+            db_path: SQLite file holding the encrypted records
+            cache_ttl: Seconds decrypted records are kept in memory
+        """
+        self.fernet = fernet
+        self.db_path = db_path
+        self.cache_ttl = cache_ttl
+        self._cache = None  # (version, loaded at, {id: identity})
+        self._terms = None  # (cached identities they were built from, terms)
+        self._matcher = None  # (version, FieldMatcher)
+        self._id_key = None
+        self._lock = threading.RLock()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS identities (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data BLOB NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '0');
+        """)
+        self.conn.commit()
+
+    @property
+    def version(self):
+        """
+        Version stamp of the stored identities; changes whenever any of them does
+        """
+        with self._lock:
+            return int(self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0])
+
+    @property
+    def id_key(self):
+        """
+        Secret the term ids of matches are keyed with, generated on first use
+        """
+        with self._lock:
+            if self._id_key is None:
+                # Another process may create it at the same time; the first one stored wins
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO meta (key, value) VALUES ('id_key', ?)",
+                    (self.fernet.encrypt(os.urandom(32)).decode(),)
+                )
+                self.conn.commit()
+                token = self.conn.execute("SELECT value FROM meta WHERE key = 'id_key'").fetchone()[0]
+                self._id_key = self.fernet.decrypt(token.encode())
+            return self._id_key
+
+    def term_id(self, value):
+        """
+        Id of value in match records built with matcher()
+        """
+        return term_id(value, self.id_key)
+
+    def _bump_version(self):
+        self.conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+
+    def _encrypt(self, name, fields):
+        return self.fernet.encrypt(json.dumps({'name': name, 'fields': fields}).encode())
+
+    def _identities(self):
+        """
+        Decrypted identities by id, from the cache while it is fresh and current
+        """
+        with self._lock:
+            version = self.version
+            if self._cache is not None:
+                cached_version, loaded_at, identities = self._cache
+                if cached_version == version and time.time() - loaded_at < self.cache_ttl:
+                    return identities
+            identities = {}
+            for identity_id, data in self.conn.execute('SELECT id, data FROM identities ORDER BY id'):
+                identities[identity_id] = json.loads(self.fernet.decrypt(data).decode())
+            self._cache = (version, time.time(), identities)
+            return identities
+
+    def clear_cache(self):
+        """
+        Drop the decrypted identities and compiled matcher from memory
+        """
+        with self._lock:
+            self._cache = None
+            self._terms = None
+            self._matcher = None
+
+    def count(self):
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM identities').fetchone()[0]
+
+    def ids(self):
+        with self._lock:
+            return [row[0] for row in self.conn.execute('SELECT id FROM identities ORDER BY id')]
+
+    def get(self, identity_id):
+        """
+        Identity as {'name': ..., 'fields': {...}}, or None
+        """
+        return self._identities().get(identity_id)
+
+    def identities(self):
+        """
+        All identities as {id: {'name': ..., 'fields': {...}}}
+        """
+        return dict(self._identities())
+
+    def put(self, fields, name='', identity_id=None):
+        """
+        Save an identity, replacing identity_id if given.
+        Returns the identity's id.
+        """
+        with self._lock:
+            data = self._encrypt(name, fields)
+            if identity_id is None:
+                identity_id = self.conn.execute(
+                    'INSERT INTO identities (data, updated_at) VALUES (?, ?)', (data, time.time())
+                ).lastrowid
+            else:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO identities (id, data, updated_at) VALUES (?, ?, ?)',
+                    (identity_id, data, time.time())
+                )
+            self._bump_version()
+            self.conn.commit()
+            return identity_id
+
+    def delete(self, identity_id):
+        with self._lock:
+            self.conn.execute('DELETE FROM identities WHERE id = ?', (identity_id,))
+            self._bump_version()
+            self.conn.commit()
+
+    def import_identities(self, identities, replace=False):
+        """
+        Add many identities in one transaction, one encryption per identity.
+
+        Args:
+            identities: Iterable of {'name': ..., 'fields': {...}} dictionaries,
+                        or plain field dictionaries
+            replace: Remove the stored identities first
+        Returns the number of identities imported.
+        """
+        now = time.time()
+        rows = []
+        for identity in identities:
+            if 'fields' in identity:
+                rows.append((self._encrypt(identity.get('name', ''), identity['fields']), now))
+            else:
+                rows.append((self._encrypt('', identity), now))
+        with self._lock:
+            if replace:
+                self.conn.execute('DELETE FROM identities')
+            self.conn.executemany('INSERT INTO identities (data, updated_at) VALUES (?, ?)', rows)
+            self._bump_version()
+            self.conn.commit()
+        return len(rows)
+
+    def export_identities(self):
+        """
+        All identities as a list of {'id', 'name', 'fields'} dictionaries (decrypted)
+        """
+        return [dict(identity, id=identity_id) for identity_id, identity in self._identities().items()]
+
+    def import_legacy_file(self, path='user_data/sensitive_info.enc'):
+        """
+        Import the single identity of the GUI's former sensitive_info.enc
+        file, encrypted with the same key. Returns its id, or None if there
+        is no such file.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            fields = json.loads(self.fernet.decrypt(f.read()).decode())
+        return self.put(fields, name='default')
+
+    def fields(self):
+        """
+        Every non-empty field as (identity id, identity name, field, value)
+        """
+        return [(identity_id, identity.get('name', ''), field, value.strip())
+                for identity_id, identity in self._identities().items()
+                for field, value in identity['fields'].items() if value and value.strip()]
+
+    def terms(self):
+        """
+        Distinct terms to match, as (value, mode) pairs with each field's match mode
+        """
+        with self._lock:
+            identities = self._identities()
+            if self._terms is None or self._terms[0] is not identities:
+                terms = {}
+                for _, _, field, value in self.fields():
+                    terms.setdefault((value, FIELD_MODES.get(field, 'exact')), None)
+                self._terms = (identities, list(terms))
+            return list(self._terms[1])
+
+    def matcher(self):
+        """
+        FieldMatcher for terms(), compiled once per version of the store
+        """
+        with self._lock:
+            version = self.version
+            if self._matcher is None or self._matcher[0] != version:
+                self._matcher = (version, FieldMatcher.cached(self.terms(), self.id_key))
+            return self._matcher[1]
+
+    def close(self):
+        self.clear_cache()
+        self.conn.close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Import or export the identities of the encrypted term store")
+    arg_parser.add_argument('command', choices=['import', 'export', 'count'])
+    arg_parser.add_argument('path', nargs='?', help="JSON file: a list of {'name', 'fields'} objects")
+    arg_parser.add_argument('--db', default='user_data/terms.db')
+    arg_parser.add_argument('--key', default='user_data/.encryption_key')
+    arg_parser.add_argument('--replace', action='store_true', help='Replace the stored identities on import')
+    args = arg_parser.parse_args()
+
+    store = TermStore(load_fernet(args.key), args.db)
+    try:
+        if args.command == 'count':
+            print(store.count())
+        elif args.command == 'import':
+            with open(args.path or '/dev/stdin', 'r', encoding='utf-8') as f:
+                print(f"Imported {store.import_identities(json.load(f), replace=args.replace)} identities")
+        else:
+            # Writes the decrypted identities: keep the output somewhere safe
+            if args.path:
+                with open(args.path, 'w', encoding='utf-8') as f:
+                    json.dump(store.export_identities(), f, indent=2)
+            else:
+                json.dump(store.export_identities(), sys.stdout, indent=2)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+# Test setup - makes the repository modules and the benchmark helpers importable
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
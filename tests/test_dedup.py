@@ -0,0 +1,104 @@
+# Exact and MinHash near-duplicate detection and mirror clusters
+
+import os
+import random
+
+from conftest import ROOT
+from dedup import MirrorIndex, resemblance, shingle_hashes, sketch
+from extract import get_extractor
+from fake_onion import load_seed_pages, onion_address
+
+WORDS = [f"word{i}" for i in range(500)]
+
+
+def page_text(rng, words=300):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def edited(text, rng, edits):
+    words = text.split()
+    for i in rng.sample(range(len(words)), edits):
+        words[i] = 'changed'
+    return ' '.join(words)
+
+
+def seen(index, url, html, text):
+    return index.exact_duplicate(url, html) or index.near_duplicate(url, html, text)
+
+
+def test_minhash_resemblance_tracks_jaccard_similarity():
+    rng = random.Random(3)
+    text = page_text(rng, 2000)
+    other = edited(text, rng, 100)
+    a, b = shingle_hashes(text), shingle_hashes(other)
+    jaccard = len(a & b) / len(a | b)
+    assert abs(resemblance(sketch(a), sketch(b)) - jaccard) < 0.15
+    assert resemblance(sketch(a), sketch(a)) == 1.0
+    assert resemblance(sketch(a), sketch(shingle_hashes(page_text(rng, 2000)))) < 0.1
+    assert shingle_hashes('The cat sat') == shingle_hashes('the  CAT, sat!')
+
+
+def test_near_duplicates_join_the_first_page_cluster(tmp_path):
+    index = MirrorIndex(str(tmp_path / 'mirrors.db'), min_similarity=0.8)
+    rng = random.Random(5)
+    text = page_text(rng)
+    first, copy, mirror, unrelated = (f"http://{onion_address(rng)}/" for _ in range(4))
+
+    assert seen(index, first, f"<p>{text}</p>", text) is None
+    duplicate = seen(index, copy, f"<p>{text}</p>", text)
+    assert (duplicate.kind, duplicate.canonical_url, duplicate.similarity) == ('exact', first, 1.0)
+
+    mirrored = edited(text, rng, 3)
+    duplicate = seen(index, mirror, f"<div>{mirrored}</div>", mirrored)
+    assert (duplicate.kind, duplicate.canonical_url) == ('near', first)
+    assert 0.8 <= duplicate.similarity < 1.0
+
+    other = page_text(rng)
+    assert seen(index, unrelated, f"<p>{other}</p>", other) is None
+    assert index.cluster(mirror) == [first, copy, mirror]
+    assert index.stats() == {'pages': 4, 'exact': 1, 'near': 1, 'clusters': 1}
+
+    # Revisiting the first page does not make it a duplicate of its own mirrors
+    assert seen(index, first, f"<p>{text}</p>", text) is None
+
+
+def test_short_pages_are_only_compared_exactly(tmp_path):
+    index = MirrorIndex(str(tmp_path / 'mirrors.db'), min_shingles=30)
+    assert seen(index, 'http://a.onion/', '<p>it works</p>', 'it works') is None
+    assert seen(index, 'http://b.onion/', '<p>it works!</p>', 'it works') is None
+    assert seen(index, 'http://c.onion/', '<p>it works</p>', 'it works').kind == 'exact'
+
+
+def test_mirror_hosts_are_deprioritized_and_clusters_persist(tmp_path):
+    path = str(tmp_path / 'mirrors.db')
+    index = MirrorIndex(path, mirror_host_pages=3)
+    rng = random.Random(7)
+    text = page_text(rng)
+    seen(index, 'http://origin.onion/', f"<p>{text}</p>", text)
+    for i in range(3):
+        seen(index, f"http://mirror.onion/{i}", f"<p>{text}</p>", text)
+    other = page_text(rng)
+    seen(index, 'http://mirror.onion/own', f"<p>{other}</p>", other)
+    index.close()
+
+    index = MirrorIndex(path, mirror_host_pages=3)
+    assert index.priority('http://mirror.onion/0') == -1.0
+    assert index.priority('http://mirror.onion/new') == -0.75
+    assert index.priority('http://origin.onion/next') == 0.0
+    assert len(index.cluster('http://origin.onion/')) == 4
+
+
+def test_boilerplate_pages_of_the_sample_corpus_cluster_together(tmp_path):
+    index = MirrorIndex(str(tmp_path / 'mirrors.db'))
+    extractor = get_extractor('bs4')
+    urls = []
+    for i, html in enumerate(load_seed_pages(os.path.join(ROOT, 'text.txt'))):
+        url = f"http://sample{i}.onion/"
+        seen(index, url, html, extractor.extract(html).text)
+        urls.append(url)
+
+    clusters = {tuple(index.cluster(url)) for url in urls}
+    assert sorted(clusters, key=len, reverse=True)[:2] == [
+        tuple(urls[i] for i in (0, 1, 2, 3, 4, 5, 7)), (urls[6], urls[8]),
+    ]
+    assert sum(len(cluster) for cluster in clusters) == len(urls)
@@ -0,0 +1,48 @@
+# Extraction backends must give the same text, title and links as BeautifulSoup
+
+import os
+import pytest
+
+from conftest import ROOT
+from extract import BACKENDS, get_extractor
+from parser import Parser
+
+FAST_BACKENDS = [name for name in BACKENDS if name != 'bs4']
+
+CASES = [
+    '<p>a<!--x-->b</p>',
+    '<p>a<?php x ?>b</p>',
+    '<p>a<script>s<!--c-->t</script>b<!--d--></p>e',
+    '<p>a<template>t<b>x</b></template>b</p>',
+    '<p>a<style>p {}</style> b</p>',
+    '<noscript>ns</noscript>ok',
+    '<html><head><noscript>ns</noscript></head><body>ok</body></html>',
+    '<p>a <noscript> ns </noscript> b</p>',
+    '<?xml version="1.0" encoding="utf-8"?>\n'
+    '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>T</title></head>'
+    '<body><p>café</p><a href="/x">x</a></body></html>',
+    '',
+]
+
+
+def backend(name):
+    try:
+        return get_extractor(name)
+    except ImportError:
+        pytest.skip(f"{name} is not installed")
+
+
+@pytest.mark.parametrize('name', FAST_BACKENDS)
+@pytest.mark.parametrize('html', CASES)
+def test_backend_matches_bs4(name, html):
+    assert backend(name).extract(html) == get_extractor('bs4').extract(html)
+
+
+@pytest.mark.parametrize('name', FAST_BACKENDS)
+def test_backend_matches_bs4_on_sample_pages(name):
+    extractor = backend(name)
+    reference = get_extractor('bs4')
+    documents = list(Parser(os.path.join(ROOT, 'text.txt'), []).iter_documents())
+    assert documents
+    for html in documents:
+        assert extractor.extract(html) == reference.extract(html)
@@ -0,0 +1,78 @@
+# Frontier queueing, resume after a crash, restart and the Bloom filter
+
+import random
+import time
+
+from frontier import BloomFilter, CrawlFrontier, url_fingerprint
+
+SEED = 'http://seed.onion/'
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = BloomFilter(10_000, error_rate=0.01)
+    rng = random.Random(1)
+    added = [rng.getrandbits(64) - 2 ** 63 for _ in range(10_000)]
+    for fingerprint in added:
+        bloom.add(fingerprint)
+    assert all(fingerprint in bloom for fingerprint in added)
+    others = [rng.getrandbits(64) - 2 ** 63 for _ in range(10_000)]
+    false_positives = sum(fingerprint in bloom for fingerprint in others)
+    assert false_positives < 300  # ~1% expected at capacity
+
+
+def test_urls_are_deduplicated_on_their_normalized_form(tmp_path):
+    frontier = CrawlFrontier(str(tmp_path / 'frontier.db'), max_depth=1)
+    assert frontier.add(SEED)
+    assert not frontier.add('HTTP://SEED.onion:80/')
+    assert url_fingerprint(SEED) == url_fingerprint('HTTP://SEED.onion:80/')
+    assert frontier.add_many(['http://a.onion/', 'http://a.onion/', SEED], depth=1) == 1
+    assert not frontier.add('http://deep.onion/', depth=2)
+    assert frontier.pending_count() == 2
+
+
+def test_interrupted_urls_are_requeued_and_seen_set_survives(tmp_path):
+    path = str(tmp_path / 'frontier.db')
+    frontier = CrawlFrontier(path, max_pages=10)
+    frontier.add_many([SEED, 'http://a.onion/', 'http://b.onion/'])
+    fetched, _ = frontier.pop()
+    frontier.mark_done(fetched)
+    interrupted, _ = frontier.pop()
+    frontier.close()  # the crawler dies while fetching the second URL
+
+    resumed = CrawlFrontier(path, max_pages=10)
+    assert resumed.claimed == 1
+    assert resumed.pending_count() == 2
+    assert not resumed.add(fetched)  # the rebuilt Bloom filter still knows it
+    left = {SEED, 'http://a.onion/', 'http://b.onion/'} - {fetched}
+    assert interrupted in left
+    assert {resumed.pop()[0], resumed.pop()[0]} == left
+    assert resumed.pop() is None
+
+
+def test_max_pages_retry_defer_and_restart(tmp_path):
+    frontier = CrawlFrontier(str(tmp_path / 'frontier.db'), max_pages=2)
+    frontier.add_many([SEED, 'http://a.onion/', 'http://b.onion/'])
+    first, _ = frontier.pop()
+    second, _ = frontier.pop()
+    assert frontier.pop() is None  # max_pages reached
+
+    # A retry frees its slot, is counted, and is not due before not_before
+    frontier.retry(first, time.time() + 60)
+    assert frontier.attempts(first) == 1
+    third, _ = frontier.pop()
+    assert third not in (first, second)
+    frontier.mark_done(second)
+    frontier.mark_failed(third)
+
+    # Deferring does not count an attempt
+    frontier.defer(second, 0)
+    assert frontier.attempts(second) == 0
+    assert frontier.pop()[0] == second
+    frontier.mark_done(second)
+
+    assert frontier.restart() == 2
+    assert frontier.attempts(third) == 0
+    assert frontier.next_ready_at() == 0
+    # The retried URL keeps its backoff; the rest are due again
+    assert {frontier.pop()[0], frontier.pop()[0]} == {second, third}
+    assert frontier.pop() is None
@@ -0,0 +1,141 @@
+# Failure classification, circuit breaker transitions and retry limits
+
+import socket
+import time
+
+import pytest
+import requests
+
+from fake_onion import FakeSocksProxy
+from frontier import CrawlFrontier
+from host_health import (CONNECTION, HTTP_ERROR, RATE_LIMITED, SERVER_ERROR, SOCKS, TIMEOUT,
+                         Failure, HostHealth, RetryScheduler, backoff_delay, classify_error,
+                         classify_status)
+
+HOST = 'dead.onion'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'time', clock)
+    return clock
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()
+
+
+def test_failures_are_classified():
+    assert classify_status(429) == RATE_LIMITED
+    assert classify_status(503) == SERVER_ERROR
+    assert classify_status(404) == HTTP_ERROR
+    assert classify_error(requests.exceptions.ReadTimeout()) == TIMEOUT
+    assert classify_error(requests.exceptions.ConnectionError(ConnectionRefusedError())) == CONNECTION
+
+    # The proxy cannot reach the hidden service, as Tor reports a dead host
+    proxy = FakeSocksProxy(closed_port()).start()
+    try:
+        with pytest.raises(requests.exceptions.RequestException) as raised:
+            requests.get('http://dead.onion/', timeout=5,
+                         proxies={'http': proxy.proxy_url, 'https': proxy.proxy_url})
+    finally:
+        proxy.stop()
+    assert classify_error(raised.value) == SOCKS
+
+
+def test_breaker_opens_probes_and_closes(tmp_path, clock):
+    health = HostHealth(str(tmp_path / 'hosts.db'), failure_threshold=3, cooldown=100, max_cooldown=300)
+    timeout = Failure(TIMEOUT, 'timed out', None)
+
+    for _ in range(2):
+        health.record(HOST, timeout)
+        assert health.allow(HOST)
+    assert health.record(HOST, timeout) == clock.now + 100
+    assert health.stats() == {HostHealth.OPEN: 1}
+    assert not health.allow(HOST)
+
+    # Cool-down over: exactly one probe goes out, the others wait for it
+    clock.now += 100
+    assert health.allow(HOST)
+    assert not health.allow(HOST)
+    assert health.retry_at(HOST) == clock.now + health.probe_wait
+    assert health.stats() == {HostHealth.HALF_OPEN: 1}
+
+    # A failed probe doubles the cool-down, capped at max_cooldown
+    assert health.record(HOST, timeout) == clock.now + 200
+    clock.now += 200
+    assert health.allow(HOST)
+    assert health.record(HOST, timeout) == clock.now + 300
+    clock.now += 300
+    assert health.allow(HOST)
+
+    # A host that answers, even with a 404, closes the breaker
+    health.record(HOST, Failure(HTTP_ERROR, '404', None))
+    assert health.stats() == {HostHealth.CLOSED: 1}
+    assert health.allow(HOST) and health.allow(HOST)
+
+
+def test_breaker_state_persists_and_honours_retry_after(tmp_path, clock):
+    path = str(tmp_path / 'hosts.db')
+    health = HostHealth(path)
+    assert health.record(HOST, Failure(RATE_LIMITED, '429', 42)) == clock.now + 42
+    health.close()
+
+    reopened = HostHealth(path)
+    assert not reopened.allow(HOST)
+    assert reopened.retry_at(HOST) == clock.now + 42
+
+
+def test_backoff_is_jittered_and_capped():
+    for attempt in range(1, 12):
+        delay = backoff_delay(attempt, base_delay=5, max_delay=60)
+        assert 0 <= delay <= min(60, 5 * 2 ** (attempt - 1))
+
+
+def test_scheduler_retries_up_to_max_retries(tmp_path, clock):
+    frontier = CrawlFrontier(str(tmp_path / 'frontier.db'), max_pages=10)
+    scheduler = RetryScheduler(frontier, max_retries=2, base_delay=1, max_delay=10)
+    url = 'http://flaky.onion/'
+    frontier.add(url)
+
+    for attempt in (1, 2):
+        assert scheduler.next() == (url, 0)
+        scheduler.failed(url, Failure(SERVER_ERROR, '503', None))
+        assert frontier.attempts(url) == attempt
+        assert 0 <= scheduler.wait_time() <= 10
+        clock.now += 10
+    assert scheduler.next() == (url, 0)
+    scheduler.failed(url, Failure(SERVER_ERROR, '503', None))
+    assert scheduler.next() is None and frontier.pending_count() == 0
+
+    # Failures that will not go away are not retried
+    frontier.add('http://gone.onion/')
+    scheduler.next()
+    scheduler.failed('http://gone.onion/', Failure(HTTP_ERROR, '404', None))
+    assert frontier.attempts('http://gone.onion/') == 0 and frontier.pending_count() == 0
+
+
+def test_scheduler_defers_hosts_with_an_open_breaker(tmp_path, clock):
+    frontier = CrawlFrontier(str(tmp_path / 'frontier.db'))
+    health = HostHealth(str(tmp_path / 'hosts.db'), failure_threshold=1, cooldown=50)
+    scheduler = RetryScheduler(frontier, health)
+    health.record(HOST, Failure(SOCKS, 'unreachable', None))
+    frontier.add_many([f'http://{HOST}/a', 'http://up.onion/'])
+
+    assert scheduler.next() == ('http://up.onion/', 0)
+    assert scheduler.next() is None
+    assert frontier.attempts(f'http://{HOST}/a') == 0
+    assert scheduler.wait_time() == 50
+    clock.now += 50
+    assert scheduler.next() == (f'http://{HOST}/a', 0)
@@ -0,0 +1,56 @@
+# Onion address validation, link resolution and link scores
+
+import base64
+import hashlib
+import random
+
+from fake_onion import onion_address
+from links import link_categories, link_score, onion_address_valid, resolve_links
+
+TOR_PROJECT = '2gzyxa5ihm7nsggfxnu52rck2vv4rvmdlkiu3zzui5du4xyclen53wid.onion'
+
+
+def v3_address(pubkey, version=b'\x03', checksum=None):
+    if checksum is None:
+        checksum = hashlib.sha3_256(b'.onion checksum' + pubkey + version).digest()[:2]
+    return base64.b32encode(pubkey + checksum + version).decode('ascii').lower() + '.onion'
+
+
+def test_onion_address_checksum():
+    assert onion_address_valid(TOR_PROJECT)
+    assert onion_address_valid('www.' + TOR_PROJECT.upper() + '.')
+    rng = random.Random(0)
+    assert all(onion_address_valid(onion_address(rng)) for _ in range(100))
+
+    pubkey = bytes(range(32))
+    assert onion_address_valid(v3_address(pubkey))
+    assert not onion_address_valid(v3_address(pubkey, checksum=b'\x00\x00'))
+    assert not onion_address_valid(v3_address(pubkey, version=b'\x02'))
+    # One character changed breaks the checksum
+    valid = v3_address(pubkey)
+    assert not onion_address_valid(('b' if valid[0] != 'b' else 'c') + valid[1:])
+
+    assert not onion_address_valid('expyuzz4wqqyqhjn.onion')  # retired v2
+    assert not onion_address_valid('1' * 56 + '.onion')  # not base32
+    assert not onion_address_valid(TOR_PROJECT[:-6] + '.com')
+
+
+def test_resolve_links_drops_malformed_onions_and_repeats():
+    base = f"http://{TOR_PROJECT}/a/b"
+    bad = 'a' * 56 + '.onion'
+    hrefs = ['c', './c#top', f"http://{bad}/", 'mailto:x@y.z', '../d?utm_source=x', 'http://[::1']
+    links = resolve_links(base, hrefs)
+    assert links == [f"http://{TOR_PROJECT}/a/c", f"http://{TOR_PROJECT}/d"]
+
+
+def test_link_score_reads_whole_words_of_path_and_query():
+    assert link_categories(f"http://{TOR_PROJECT}/forum/viewtopic?t=1") == ['forum']
+    assert link_categories(f"http://{TOR_PROJECT}/search?q=leaked+db") == ['leak']
+    # Words inside other words and the host name do not count
+    assert link_categories(f"http://{TOR_PROJECT}/platform/dbase") == []
+    assert link_categories('http://pastebin-forum.onion/') == []
+    # Media extensions only count at the end of the path
+    assert link_categories(f"http://{TOR_PROJECT}/logo.png") == ['media']
+    assert link_categories(f"http://{TOR_PROJECT}/view?file=logo.png") == []
+    assert link_score(f"http://{TOR_PROJECT}/leaks/") == 1.0
+    assert link_score('http://example.com/leaks/') == 0.5
@@ -0,0 +1,21 @@
+# Revisits only add a pages row when the content changed
+
+from page_store import PageStore
+
+
+def test_unchanged_revisit_refreshes_latest_row(tmp_path):
+    store = PageStore(str(tmp_path / 'pages.db'))
+    first = store.add('http://a.onion/', '<p>one</p>', fetched_at=1.0, title='A', etag='"1"')
+    # A 304 keeps the stored status, title and any validator it did not resend
+    again = store.add('http://a.onion/', '<p>one</p>', status=304, fetched_at=2.0, last_modified='Mon')
+    assert again == first
+    latest = store.latest('http://a.onion/')
+    assert (latest['fetched_at'], latest['status'], latest['title']) == (2.0, 200, 'A')
+    assert store.validators('http://a.onion/') == ('"1"', 'Mon')
+
+    changed = store.add('http://a.onion/', '<p>two</p>', fetched_at=3.0)
+    assert changed != first
+    # Going back to an older body is a change from the latest row
+    reverted = store.add('http://a.onion/', '<p>one</p>', fetched_at=4.0)
+    assert reverted not in (first, changed)
+    assert len(list(store.iter_pages(latest_only=False, with_html=False))) == 3
@@ -0,0 +1,136 @@
+# Circuit scoring, rotation and the shared NEWNYM controller
+
+import time
+
+import requests
+
+import tor_pool
+from fake_onion import FakeOnionServer, FakeSocksProxy
+from tor_pool import TorCircuitPool, TorController
+
+
+class StubController:
+    """
+    Stands in for a stem controller on the control port
+    """
+    opened = []
+
+    def __init__(self):
+        self.alive = True
+        self.signals = 0
+        self.newnym_available = True
+
+    @classmethod
+    def from_port(cls, port):
+        controller = cls()
+        cls.opened.append(controller)
+        return controller
+
+    def authenticate(self, password=None):
+        pass
+
+    def is_alive(self):
+        return self.alive
+
+    def is_newnym_available(self):
+        return self.newnym_available
+
+    def get_newnym_wait(self):
+        return 10.0
+
+    def signal(self, signal):
+        self.signals += 1
+
+    def close(self):
+        self.alive = False
+
+
+def test_acquire_spreads_load_and_prefers_healthy_circuits():
+    pool = TorCircuitPool(size=3, socks_ports=(9050, 9052))
+    assert [c.socks_port for c in pool.circuits] == [9050, 9052, 9050]
+    assert len({c.proxy_url for c in pool.circuits}) == 3
+
+    # Idle circuits win over busy ones, so parallel requests use different circuits
+    assert len({pool.acquire().index for _ in range(3)}) == 3
+    for circuit in pool.circuits:
+        pool.release(circuit, latency=1.0)
+
+    slow, failing, good = pool.circuits
+    slow.latency = 8.0
+    failing.errors = failing.requests
+    assert pool.acquire() is good
+    # Once busy enough, a worse circuit becomes the better choice
+    good.in_flight = 10
+    assert pool.acquire() is failing
+
+
+def test_check_circuits_rotates_only_unhealthy_circuits(monkeypatch):
+    pool = TorCircuitPool(size=4, max_error_rate=0.5, max_latency=10.0, min_requests=5, max_age=600.0)
+    erroring, slow, young, healthy = pool.circuits
+    for _ in range(5):
+        pool.release(erroring, latency=1.0, error=True)
+        pool.release(slow, latency=20.0)
+        pool.release(healthy, latency=1.0)
+    for _ in range(4):
+        pool.release(young, latency=1.0, error=True)  # too few requests to judge
+    old_credentials = erroring.proxy_url
+
+    assert pool.check_circuits() == [erroring, slow]
+    assert erroring.proxy_url != old_credentials
+    assert (erroring.generation, erroring.requests, erroring.errors, erroring.latency) == (1, 0, 0, None)
+    assert healthy.generation == young.generation == 0
+
+    # Every circuit is rotated once it reaches max_age
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 601)
+    assert pool.check_circuits() == pool.circuits
+
+
+def test_circuits_reach_onion_pages_through_isolated_socks_credentials():
+    server = FakeOnionServer({'http://site.onion/': '<p>hello</p>'}).start()
+    proxy = FakeSocksProxy(server.address).start()
+    try:
+        host, port = proxy.address
+        pool = TorCircuitPool(size=2, socks_host=host, socks_ports=(port,))
+        # Requests in flight together each get their own circuit
+        for circuit in [pool.acquire(), pool.acquire()]:
+            response = requests.get('http://site.onion/', timeout=5,
+                                    proxies={'http': circuit.proxy_url, 'https': circuit.proxy_url})
+            pool.release(circuit, latency=response.elapsed.total_seconds())
+            assert response.text == '<p>hello</p>'
+        assert [stats['requests'] for stats in pool.stats()] == [1, 1]
+    finally:
+        proxy.stop()
+        server.stop()
+
+
+def test_newnym_reuses_one_controller_connection(monkeypatch):
+    monkeypatch.setattr(StubController, 'opened', [])
+    monkeypatch.setattr(tor_pool, 'Controller', StubController)
+    tor = TorController(port=9051)
+
+    assert tor.send_newnym() and tor.send_newnym()
+    assert len(StubController.opened) == 1 and StubController.opened[0].signals == 2
+
+    # Rate limited signals are refused without reconnecting
+    StubController.opened[0].newnym_available = False
+    assert not tor.send_newnym()
+    assert len(StubController.opened) == 1
+
+    # A dropped connection is replaced
+    StubController.opened[0].alive = False
+    assert tor.send_newnym()
+    assert len(StubController.opened) == 2
+    tor.close()
+    assert not StubController.opened[1].alive
+
+
+def test_pool_sends_newnym_immediately_without_background_thread(monkeypatch):
+    monkeypatch.setattr(StubController, 'opened', [])
+    monkeypatch.setattr(tor_pool, 'Controller', StubController)
+    pool = TorCircuitPool(size=1)
+    assert pool.request_newnym()
+    assert pool.request_newnym()
+    assert len(StubController.opened) == 1 and StubController.opened[0].signals == 2
+    pool.stop()
+    assert not StubController.opened[0].alive
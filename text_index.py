@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+# Text index - n-gram inverted index over stored page text, for checking terms against every page crawled
+
+import os
+import re
+import mmap
+import struct
+import sqlite3
+import hashlib
+import argparse
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from itertools import chain
+from extract import get_extractor
+from normalize import DigitRuns, canonical_digits, canonical_email, default_max_edits, iter_emails, split_pieces
+
+# Index keys are 64-bit integers in three ranges:
+# - a trigram of the lowercased text: its three code points, 21 bits each (below 2**63)
+# - a trigram of the text's canonical digit runs (see normalize.DigitRuns): the same, with bit 63 set
+# - a canonical email address found in the text: a 62-bit hash, with bits 63 and 62 set
+_DIGIT_KEY = 1 << 63
+_EMAIL_KEY = 3 << 62
+_HASH_MASK = (1 << 62) - 1
+
+# Segment file layout: header, postings (uint32 doc ids), padding to 8 bytes,
+# keys (uint64, ascending), offsets of each key's postings (uint64, one more
+# than the keys). Arrays are in native byte order.
+_MAGIC = b'TIX1'
+_HEADER = struct.Struct('=4sIQ')  # Magic, key count, posting count
+_SEGMENT_FILE = re.compile(r'^segment-\d+-\d+\.idx(\.tmp)?$')
+
+# Text that may hold an email address: an @ or a spelled-out "[at]" (see normalize.iter_emails)
+_MAY_HOLD_EMAIL = re.compile(r'@|[\[({<]\s*at\s*[\])}>]')
+
+# Keys of the trigrams seen recently; most pages reuse the same few thousand
+_trigram_cache = {}
+_TRIGRAM_CACHE_SIZE = 1 << 20
+
+
+def _trigram_key(gram):
+    return (ord(gram[0]) << 42) | (ord(gram[1]) << 21) | ord(gram[2])
+
+
+def _trigram_keys(text, flag=0):
+    grams = set(zip(text, text[1:], text[2:]))
+    keys = set(map(_trigram_cache.get, grams))
+    if None in keys:
+        keys.discard(None)
+        if len(_trigram_cache) > _TRIGRAM_CACHE_SIZE:
+            _trigram_cache.clear()
+        for gram in grams:
+            if gram not in _trigram_cache:
+                _trigram_cache[gram] = _trigram_key(gram)
+            keys.add(_trigram_cache[gram])
+    return {flag | key for key in keys} if flag else keys
+
+
+def _email_key(email):
+    digest = hashlib.blake2b(email.encode('utf-8'), digest_size=8).digest()
+    return _EMAIL_KEY | (int.from_bytes(digest, 'big') & _HASH_MASK)
+
+
+def text_keys(text):
+    """
+    Index keys of a page's clean text, which must already be lowercase: its
+    trigrams, the trigrams of its canonical digit runs and its canonical
+    email addresses
+    """
+    keys = _trigram_keys(text)
+    keys |= _trigram_keys(DigitRuns(text).text, _DIGIT_KEY)
+    if _MAY_HOLD_EMAIL.search(text):
+        keys.update(_email_key(email) for email, _, _ in iter_emails(text))
+    return keys
+
+
+def term_keys(value, mode='exact'):
+    """
+    Keys a page has to contain for value to match it the way FieldMatcher
+    matches mode, as (keys, needed, pieces): the page must hold at least
+    needed of keys and, unless pieces is None, every key of at least one of
+    the key sets in pieces. None if value is too short to rule any page out.
+    """
+    lowered = ' '.join(value.lower().split())
+    pieces = None
+    if mode == 'digits' and len(canonical_digits(value)) >= 4:
+        keys = _trigram_keys(canonical_digits(value), _DIGIT_KEY)
+        needed = len(keys)
+    elif mode == 'email' and canonical_email(value) is not None:
+        keys = {_email_key(canonical_email(value))}
+        needed = 1
+    elif mode == 'fuzzy' and default_max_edits(len(lowered)) > 0:
+        max_edits = default_max_edits(len(lowered))
+        # Each edit changes at most three trigrams of an occurrence, and
+        # FieldMatcher only finds occurrences holding a piece of the term as is
+        keys = _trigram_keys(lowered)
+        needed = max(0, len(keys) - 3 * max_edits)
+        pieces = [_trigram_keys(piece) for _, piece in split_pieces(lowered, max_edits)]
+        if not all(pieces):
+            pieces = None
+    else:
+        # Values that do not fit their mode are matched as typed
+        keys = _trigram_keys(value.lower())
+        needed = len(keys)
+    if needed == 0 and pieces is None:
+        return None
+    return keys, needed, pieces
+
+
+def _contains(postings, doc_id):
+    index = bisect_left(postings, doc_id)
+    return index < len(postings) and postings[index] == doc_id
+
+
+class _Segment:
+    """
+    One immutable, memory-mapped file of postings for the documents
+    first_doc to last_doc
+    """
+
+    def __init__(self, path, first_doc, last_doc):
+        self.path = path
+        self.first_doc = first_doc
+        self.last_doc = last_doc
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, key_count, posting_count = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC:
+            raise ValueError(f"Not a text index segment: {path}")
+        self._view = memoryview(self._map)
+        start = _HEADER.size
+        self.postings = self._view[start:start + 4 * posting_count].cast('I')
+        start += 4 * posting_count
+        start += -start % 8
+        self.keys = self._view[start:start + 8 * key_count].cast('Q')
+        start += 8 * key_count
+        self.offsets = self._view[start:start + 8 * (key_count + 1)].cast('Q')
+
+    @property
+    def docs(self):
+        return self.last_doc - self.first_doc + 1
+
+    def _postings_at(self, index):
+        return self.postings[self.offsets[index]:self.offsets[index + 1]]
+
+    def lookup(self, key):
+        """
+        Ascending doc ids of the documents holding key, or None
+        """
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return self._postings_at(index)
+        return None
+
+    def entries(self):
+        """
+        Generator of (key, postings) in key order
+        """
+        for index, key in enumerate(self.keys):
+            yield key, self._postings_at(index)
+
+    def close(self):
+        for view in (self.postings, self.keys, self.offsets, self._view):
+            view.release()
+        self._map.close()
+        self._file.close()
+
+
+def _write_segment(path, entries):
+    """
+    Write (key, [postings, ...]) entries, in ascending key order, to a new
+    segment file. Postings are arrays or memoryviews of ascending doc ids.
+    """
+    keys = array('Q')
+    offsets = array('Q', [0])
+    count = 0
+    with open(path + '.tmp', 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, 0, 0))
+        for key, chunks in entries:
+            for chunk in chunks:
+                f.write(chunk)
+                count += len(chunk)
+            keys.append(key)
+            offsets.append(count)
+        f.write(b'\0' * (-(_HEADER.size + 4 * count) % 8))
+        keys.tofile(f)
+        offsets.tofile(f)
+        f.seek(0)
+        f.write(_HEADER.pack(_MAGIC, len(keys), count))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def _merged_entries(older, newer):
+    # Doc ids of the older segment are all smaller, so postings concatenate in order
+    older_entries, newer_entries = older.entries(), newer.entries()
+    a, b = next(older_entries, None), next(newer_entries, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and a[0] < b[0]):
+            yield a[0], [a[1]]
+            a = next(older_entries, None)
+        elif a is None or b[0] < a[0]:
+            yield b[0], [b[1]]
+            b = next(newer_entries, None)
+        else:
+            yield a[0], [a[1], b[1]]
+            a, b = next(older_entries, None), next(newer_entries, None)
+
+
+class TextIndex:
+    """
+    Inverted index of the stored pages' clean text, so a term can be
+    checked against every page crawled so far without reading and matching
+    each page again.
+
+    Keys are the trigrams of each page's lowercased text, plus trigrams of
+    its canonical digit runs and its canonical email addresses, so terms of
+    every FieldMatcher mode can be looked up (see term_keys). Pages are
+    indexed by content: a body served at several URLs is indexed once. A
+    lookup only narrows the pages down to those that may hold the term;
+    Parser.search and Parser.parse_incremental confirm them with the matcher.
+
+    New pages are buffered in memory and written every flush_docs pages as
+    an immutable segment file, memory-mapped for lookups. Two neighbouring
+    segments are merged whenever the older one is not larger, so there are
+    about log2(pages / flush_docs) segments. Which URL holds which content
+    is kept in SQLite next to the segments.
+    """
+
+    def __init__(self, path='data/text_index', flush_docs=500):
+        """
+        Args:
+            path: Directory holding the segment files and index.db
+            flush_docs: New documents buffered in memory before a segment is written
+        """
+        self.path = path
+        self.flush_docs = flush_docs
+        self._lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(path, 'index.db'), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                id INTEGER PRIMARY KEY,
+                content_hash TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                page_id INTEGER NOT NULL,
+                doc_id INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS segments (
+                file TEXT PRIMARY KEY,
+                first_doc INTEGER NOT NULL,
+                last_doc INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE INDEX IF NOT EXISTS urls_doc_id ON urls (doc_id);
+        """)
+        # Documents buffered when the last process stopped were lost with it;
+        # the URLs pointing at them are indexed again by the next sync()
+        self.conn.execute('DELETE FROM urls WHERE doc_id NOT IN (SELECT id FROM docs)')
+        self.conn.commit()
+
+        rows = self.conn.execute('SELECT file, first_doc, last_doc FROM segments ORDER BY first_doc').fetchall()
+        self._segments = [_Segment(os.path.join(path, file), first, last) for file, first, last in rows]
+        # Segment files a crash left behind unlisted
+        listed = {row[0] for row in rows}
+        for name in os.listdir(path):
+            if _SEGMENT_FILE.match(name) and name not in listed:
+                os.remove(os.path.join(path, name))
+
+        self._next_doc = (self.conn.execute('SELECT MAX(id) FROM docs').fetchone()[0] or 0) + 1
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'synced_page_id'").fetchone()
+        self._synced_page_id = int(row[0]) if row is not None else 0
+        self._pending = defaultdict(list)  # Key -> doc ids not written to a segment yet
+        self._pending_docs = {}            # Content hash -> doc id of those documents
+
+    def _doc_id(self, digest):
+        doc_id = self._pending_docs.get(digest)
+        if doc_id is None:
+            row = self.conn.execute('SELECT id FROM docs WHERE content_hash = ?', (digest,)).fetchone()
+            doc_id = row[0] if row is not None else None
+        return doc_id
+
+    def has_content(self, digest):
+        """
+        True if a page with the given content hash is indexed
+        """
+        with self._lock:
+            return self._doc_id(digest) is not None
+
+    def add(self, url, page_id, digest, text):
+        """
+        Index a stored page as the latest fetch of url.
+
+        Args:
+            url: URL the page was fetched from
+            page_id: Page store id of the fetch
+            digest: Content hash of the page body
+            text: Clean text of the page; only read if the content is new
+        """
+        # Keys are worked out outside the lock so lookups are not held up
+        keys = None if self.has_content(digest) else text_keys(text.lower())
+        with self._lock:
+            self._add(url, page_id, digest, text, keys)
+            self.conn.commit()
+            if len(self._pending_docs) >= self.flush_docs:
+                self._flush()
+
+    def _add(self, url, page_id, digest, text, keys=None):
+        doc_id = self._doc_id(digest)
+        if doc_id is None:
+            doc_id = self._next_doc
+            self._next_doc += 1
+            self._pending_docs[digest] = doc_id
+            pending = self._pending
+            for key in keys if keys is not None else text_keys(text.lower()):
+                pending[key].append(doc_id)
+        self.conn.execute('INSERT OR REPLACE INTO urls (url, page_id, doc_id) VALUES (?, ?, ?)',
+                          (url, page_id, doc_id))
+
+    def sync(self, page_store):
+        """
+        Index the pages stored since the last sync that were not added as
+        they were stored (by another process, or before the index existed).
+        Returns the number of pages indexed.
+        """
+        extractor = None
+        indexed = 0
+        with self._lock:
+            synced = self._synced_page_id
+        for page in page_store.iter_pages(with_html=False, after_id=synced):
+            synced = page['id']
+            with self._lock:
+                row = self.conn.execute('SELECT page_id FROM urls WHERE url = ?', (page['url'],)).fetchone()
+                if row is not None and row[0] >= page['id']:
+                    continue
+                known = self._doc_id(page['content_hash']) is not None
+            text = keys = None
+            if not known:
+                text = page_store.get_text(page['content_hash'])
+                if text is None:
+                    extractor = extractor or get_extractor()
+                    text = extractor.extract(page_store.get_body(page['content_hash']) or '').text
+                keys = text_keys(text.lower())
+            with self._lock:
+                self._add(page['url'], page['id'], page['content_hash'], text, keys)
+                if len(self._pending_docs) >= self.flush_docs:
+                    self._flush()
+            indexed += 1
+        with self._lock:
+            self._synced_page_id = max(self._synced_page_id, synced)
+            self._flush()
+        return indexed
+
+    def flush(self):
+        """
+        Write the buffered documents to a segment file
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._pending_docs:
+            first, last = min(self._pending_docs.values()), max(self._pending_docs.values())
+            file = f'segment-{first}-{last}.idx'
+            _write_segment(os.path.join(self.path, file),
+                           ((key, [array('I', self._pending[key])]) for key in sorted(self._pending)))
+            self.conn.executemany('INSERT INTO docs (id, content_hash) VALUES (?, ?)',
+                                  ((doc_id, digest) for digest, doc_id in self._pending_docs.items()))
+            self.conn.execute('INSERT INTO segments (file, first_doc, last_doc) VALUES (?, ?, ?)',
+                              (file, first, last))
+            self._segments.append(_Segment(os.path.join(self.path, file), first, last))
+            self._pending = defaultdict(list)
+            self._pending_docs = {}
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('synced_page_id', ?)",
+                          (str(self._synced_page_id),))
+        self.conn.commit()
+        self._merge()
+
+    def _merge(self):
+        while len(self._segments) >= 2 and self._segments[-2].docs <= self._segments[-1].docs:
+            older, newer = self._segments[-2:]
+            file = f'segment-{older.first_doc}-{newer.last_doc}.idx'
+            _write_segment(os.path.join(self.path, file), _merged_entries(older, newer))
+            self.conn.execute('DELETE FROM segments WHERE file IN (?, ?)',
+                              (os.path.basename(older.path), os.path.basename(newer.path)))
+            self.conn.execute('INSERT INTO segments (file, first_doc, last_doc) VALUES (?, ?, ?)',
+                              (file, older.first_doc, newer.last_doc))
+            self.conn.commit()
+            self._segments[-2:] = [_Segment(os.path.join(self.path, file), older.first_doc, newer.last_doc)]
+            for segment in (older, newer):
+                segment.close()
+                os.remove(segment.path)
+
+    def _chunks(self, key):
+        # Postings of key in every segment and in the buffer, disjoint and in doc id order
+        chunks = [postings for postings in (segment.lookup(key) for segment in self._segments) if postings]
+        if key in self._pending:
+            chunks.append(self._pending[key])
+        return chunks
+
+    def _docs_with_all(self, keys):
+        # Intersect the postings of keys, starting from the rarest
+        lists = sorted(((sum(map(len, chunks)), chunks) for chunks in map(self._chunks, keys)),
+                       key=lambda item: item[0])
+        docs = set(chain.from_iterable(lists[0][1])) if lists else set()
+        for total, chunks in lists[1:]:
+            if not docs:
+                break
+            if len(docs) * 16 < total:
+                # Few candidates left: probe the long list rather than read it
+                docs = {doc_id for doc_id in docs if any(_contains(chunk, doc_id) for chunk in chunks)}
+            else:
+                docs.intersection_update(chain.from_iterable(chunks))
+        return docs
+
+    def _matching_docs(self, keys, needed, pieces):
+        if pieces is not None:
+            docs = set().union(*map(self._docs_with_all, pieces))
+            if not docs or not needed:
+                return docs
+            chunks_of = [self._chunks(key) for key in keys]
+            return {doc_id for doc_id in docs
+                    if sum(any(_contains(chunk, doc_id) for chunk in chunks) for chunks in chunks_of) >= needed}
+        if needed == len(keys):
+            return self._docs_with_all(keys)
+        counts = Counter()
+        for key in keys:
+            for chunk in self._chunks(key):
+                counts.update(chunk)
+        return {doc_id for doc_id, count in counts.items() if count >= needed}
+
+    def candidates(self, value, mode='exact'):
+        """
+        Pages that may hold value, matched as mode: a dictionary of content
+        hash -> ids of the latest fetch of each URL serving that content.
+        None if value is too short to rule any page out.
+        """
+        plan = term_keys(value, mode)
+        if plan is None:
+            return None
+        with self._lock:
+            docs = self._matching_docs(*plan)
+            hashes = {doc_id: digest for digest, doc_id in self._pending_docs.items() if doc_id in docs}
+            found = {}
+            ids = list(docs)
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                marks = ', '.join('?' * len(batch))
+                hashes.update(self.conn.execute(
+                    f'SELECT id, content_hash FROM docs WHERE id IN ({marks})', batch))
+                for page_id, doc_id in self.conn.execute(
+                        f'SELECT page_id, doc_id FROM urls WHERE doc_id IN ({marks}) ORDER BY page_id', batch):
+                    found.setdefault(hashes[doc_id], []).append(page_id)
+        return found
+
+    def stats(self):
+        """
+        Number of URLs and distinct documents indexed, segment files, and
+        their size in bytes
+        """
+        with self._lock:
+            urls = self.conn.execute('SELECT COUNT(*) FROM urls').fetchone()[0]
+            docs = self.conn.execute('SELECT COUNT(*) FROM docs').fetchone()[0] + len(self._pending_docs)
+            size = sum(os.path.getsize(segment.path) for segment in self._segments)
+            return {'urls': urls, 'documents': docs, 'segments': len(self._segments), 'bytes': size}
+
+    def clear(self):
+        """
+        Drop everything indexed; the next sync() indexes every stored page again
+        """
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
+                os.remove(segment.path)
+            self._segments = []
+            self._pending = defaultdict(list)
+            self._pending_docs = {}
+            self._synced_page_id = 0
+            self._next_doc = 1
+            self.conn.executescript('DELETE FROM docs; DELETE FROM urls; DELETE FROM segments; DELETE FROM meta;')
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            for segment in self._segments:
+                segment.close()
+            self.conn.close()
+
+
+def main():
+    from page_store import PageStore
+    from parser import Parser
+    from matcher import MATCH_MODES
+
+    arg_parser = argparse.ArgumentParser(description="Update the text index or look a term up in every stored page")
+    arg_parser.add_argument('command', choices=['sync', 'search', 'stats', 'rebuild'])
+    arg_parser.add_argument('term', nargs='?', help='Value to search for')
+    arg_parser.add_argument('--mode', choices=MATCH_MODES, default='exact', help='How the term is matched')
+    arg_parser.add_argument('--pages', default='data/pages.db')
+    arg_parser.add_argument('--index', default='data/text_index')
+    args = arg_parser.parse_args()
+
+    page_store = PageStore(args.pages)
+    text_index = TextIndex(args.index)
+    try:
+        if args.command == 'rebuild':
+            text_index.clear()
+        if args.command in ('sync', 'rebuild'):
+            print(f"Indexed {text_index.sync(page_store)} pages")
+        elif args.command == 'stats':
+            print(text_index.stats())
+        else:
+            if not args.term:
+                arg_parser.error('search needs a term')
+            parser = Parser(None, [], page_store=page_store, text_index=text_index)
+            records = parser.search((args.term, args.mode))
+            for record in records:
+                page = page_store.get(record['page_id'], with_html=False)
+                print(f"{page['url']}: ...{' '.join(record['context'].split())}...")
+            print(f"{len(records)} matches on {len({record['page_id'] for record in records})} pages")
+    finally:
+        text_index.close()
+        page_store.close()
+
+
+if __name__ == "__main__":
+    main()
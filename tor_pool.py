@@ -0,0 +1,278 @@
+# Tor circuit pool - spreads requests over several isolated Tor circuits
+
+import time
+import random
+import secrets
+import threading
+import logging
+from stem import Signal
+from stem.control import Controller
+
+logger = logging.getLogger(__name__)
+
+
+class TorController:
+    """
+    One long-lived, authenticated stem controller connection, reconnected
+    if it drops, so NEWNYM costs a control message instead of a new
+    connection and the crawl never sleeps waiting for it
+    """
+    def __init__(self, port=9051, password=None):
+        """
+        Args:
+            port: Tor control port
+            password: Control port password, None for cookie/no auth
+        """
+        self.port = port
+        self.password = password
+        self._controller = None
+        self._lock = threading.Lock()
+
+    def _get_controller(self):
+        """
+        Return the shared, authenticated controller, reconnecting if it dropped
+        """
+        if self._controller is None or not self._controller.is_alive():
+            if self._controller is not None:
+                self._controller.close()
+            controller = Controller.from_port(port=self.port)
+            controller.authenticate(password=self.password)
+            self._controller = controller
+        return self._controller
+
+    def send_newnym(self):
+        """
+        Send NEWNYM over the shared controller connection.
+        Returns True if Tor accepted the signal.
+        """
+        try:
+            with self._lock:
+                controller = self._get_controller()
+                if not controller.is_newnym_available():
+                    logger.debug(f"NEWNYM rate limited for {controller.get_newnym_wait():.1f}s")
+                    return False
+                controller.signal(Signal.NEWNYM)
+            logger.info("Successfully renewed Tor IP")
+            return True
+        except Exception as e:
+            logger.error(f"Error renewing Tor IP: {str(e)}")
+            with self._lock:
+                self._controller = None
+            return False
+
+    def close(self):
+        with self._lock:
+            if self._controller is not None:
+                self._controller.close()
+                self._controller = None
+
+
+class Circuit:
+    """
+    One isolated Tor circuit, identified by the SOCKS credentials used to reach it.
+    Tor's IsolateSOCKSAuth (on by default) puts streams with different
+    username/password pairs on different circuits, so changing the credentials
+    moves the circuit onto a fresh path without touching the others.
+    """
+    def __init__(self, index, socks_host, socks_port):
+        self.index = index
+        self.socks_host = socks_host
+        self.socks_port = socks_port
+        self.generation = 0      # Bumped every time the circuit is rotated
+        self.in_flight = 0       # Requests currently using this circuit
+        self._new_credentials()
+
+    def _new_credentials(self):
+        self.username = f"circuit{self.index}-{secrets.token_hex(4)}"
+        self.password = secrets.token_hex(8)
+        self.requests = 0
+        self.errors = 0
+        self.latency = None      # Exponentially weighted moving average, seconds
+        self.rotated_at = time.monotonic()
+
+    @property
+    def proxy_url(self):
+        """
+        SOCKS proxy URL for this circuit, in the socks5h:// form requests expects
+        """
+        return f"socks5h://{self.username}:{self.password}@{self.socks_host}:{self.socks_port}"
+
+    @property
+    def error_rate(self):
+        return self.errors / self.requests if self.requests else 0.0
+
+    def score(self, default_latency):
+        """
+        Lower is better: prefer idle, fast, reliable circuits.
+        Circuits without a latency sample yet are scored with default_latency.
+        """
+        latency = self.latency if self.latency is not None else default_latency
+        return (self.in_flight + 1) * latency * (1.0 + 4.0 * self.error_rate)
+
+
+class TorCircuitPool:
+    """
+    Pool of isolated Tor circuits with background rotation.
+
+    Requests pick the best circuit with acquire() and report back with
+    release(). A background thread rotates circuits whose error rate or
+    latency is too high, and NEWNYM is sent through a single long-lived stem
+    controller connection without blocking the crawl.
+    """
+    def __init__(self, size=4, socks_host='127.0.0.1', socks_ports=(9050,),
+                 control_port=9051, control_password=None,
+                 max_error_rate=0.5, max_latency=30.0, min_requests=5,
+                 max_age=600.0, check_interval=10.0):
+        """
+        Args:
+            size: Number of isolated circuits to keep
+            socks_host: Host Tor's SOCKS listeners are bound to
+            socks_ports: SOCKS ports to spread circuits over (one or several SocksPorts)
+            control_port: Tor control port used for NEWNYM
+            control_password: Control port password, None for cookie/no auth
+            max_error_rate: Rotate a circuit once its error rate exceeds this
+            max_latency: Rotate a circuit once its average latency exceeds this (seconds)
+            min_requests: Requests a circuit must have served before stats are judged
+            max_age: Rotate a circuit after this many seconds regardless of stats
+            check_interval: Seconds between background health checks
+        """
+        self.circuits = [
+            Circuit(i, socks_host, socks_ports[i % len(socks_ports)]) for i in range(size)
+        ]
+        self.control_port = control_port
+        self.control_password = control_password
+        self.max_error_rate = max_error_rate
+        self.max_latency = max_latency
+        self.min_requests = min_requests
+        self.max_age = max_age
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._tor = TorController(control_port, control_password)
+        self._newnym_pending = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire(self):
+        """
+        Pick the best circuit for the next request and mark it in use
+        """
+        with self._lock:
+            # Score fresh circuits at the pool average so they get tried promptly
+            samples = [c.latency for c in self.circuits if c.latency is not None]
+            default_latency = sum(samples) / len(samples) if samples else 1.0
+            best = min(self.circuits, key=lambda c: (c.score(default_latency), random.random()))
+            best.in_flight += 1
+            return best
+
+    def release(self, circuit, latency=None, error=False):
+        """
+        Report the outcome of a request made on circuit
+
+        Args:
+            circuit: Circuit returned by acquire()
+            latency: Seconds the request took, None if unknown
+            error: True if the request failed
+        """
+        with self._lock:
+            circuit.in_flight = max(0, circuit.in_flight - 1)
+            circuit.requests += 1
+            if error:
+                circuit.errors += 1
+            if latency is not None:
+                if circuit.latency is None:
+                    circuit.latency = latency
+                else:
+                    circuit.latency = 0.8 * circuit.latency + 0.2 * latency
+
+    def rotate(self, circuit):
+        """
+        Move circuit onto a fresh Tor path by giving it new isolation credentials.
+        Requests already in flight keep their old connection.
+        """
+        with self._lock:
+            circuit._new_credentials()
+            circuit.generation += 1
+        logger.info(f"Rotated circuit {circuit.index} (generation {circuit.generation})")
+
+    def _needs_rotation(self, circuit, now):
+        if now - circuit.rotated_at > self.max_age:
+            return True
+        if circuit.requests < self.min_requests:
+            return False
+        if circuit.error_rate > self.max_error_rate:
+            return True
+        return circuit.latency is not None and circuit.latency > self.max_latency
+
+    def check_circuits(self):
+        """
+        Rotate every circuit whose stats are past the configured limits.
+        Returns the list of rotated circuits.
+        """
+        now = time.monotonic()
+        with self._lock:
+            unhealthy = [c for c in self.circuits if self._needs_rotation(c, now)]
+        for circuit in unhealthy:
+            self.rotate(circuit)
+        return unhealthy
+
+    def request_newnym(self):
+        """
+        Ask for a NEWNYM signal without waiting for it. The background thread
+        sends it as soon as Tor's rate limit allows; when no background thread
+        is running the signal is sent immediately.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._newnym_pending.set()
+            return True
+        return self.send_newnym()
+
+    def send_newnym(self):
+        """
+        Send NEWNYM over the shared controller connection.
+        Returns True if Tor accepted the signal.
+        """
+        return self._tor.send_newnym()
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            self.check_circuits()
+            if self._newnym_pending.is_set() and self.send_newnym():
+                self._newnym_pending.clear()
+
+    def start(self):
+        """
+        Start the background rotation thread
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="tor-circuit-pool", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread and close the controller connection
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._tor.close()
+
+    def stats(self):
+        """
+        Snapshot of per-circuit statistics
+        """
+        with self._lock:
+            return [
+                {
+                    "circuit": c.index,
+                    "port": c.socks_port,
+                    "generation": c.generation,
+                    "in_flight": c.in_flight,
+                    "requests": c.requests,
+                    "errors": c.errors,
+                    "latency": c.latency,
+                }
+                for c in self.circuits
+            ]